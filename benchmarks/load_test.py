@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+import numpy as np
+from urllib.parse import quote
+
+# python -m benchmarks.load_test --port 8000 --concurrency 16 --requests 2000 [--queries queries.jsonl]
+
+
+def synthetic_queries(n: int, seed: int = 42) -> list:
+    rng = np.random.default_rng(seed)
+    words = ["cell", "protein", "cancer", "gene", "risk", "treatment", "effect", "patients", "virus",
+             "expression", "blood", "brain", "therapy", "infection", "dose", "children", "mutation"]
+    return [" ".join(rng.choice(words, rng.integers(2, 7))) for _ in range(n)]
+
+
+def read_queries(path: str) -> list:
+    """
+    Query texts of a BEIR queries.jsonl, or of a file with one query per line.
+    """
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if lines and lines[0].startswith("{"):
+        return [json.loads(line)["text"] for line in lines]
+    return lines
+
+
+class Client:
+    """
+    Keep-alive HTTP/1.1 connection sending one request at a time.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader, self.writer = None, None
+
+    async def request(self, target: str) -> dict:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {target} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode())
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = json.loads(await self.reader.readexactly(int(headers["content-length"])))
+
+        if headers.get("connection") == "close":
+            self.close()
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}: {body.get('error')}")
+        return body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader, self.writer = None, None
+
+
+async def run(args, queries: list) -> dict:
+    latencies, errors, degraded = [], [], 0
+    next_request = 0
+
+    async def worker():
+        nonlocal next_request, degraded
+        client = Client(args.host, args.port)
+        while next_request < args.requests:
+            query = queries[next_request % len(queries)]
+            next_request += 1
+            target = f"/search?q={quote(query)}&k={args.k}"
+            if args.budget_ms is not None:
+                target += f"&budget_ms={args.budget_ms}"
+
+            start = time.perf_counter()
+            try:
+                response = await client.request(target)
+                degraded += response["degraded"]
+                latencies.append(time.perf_counter() - start)
+            except (OSError, RuntimeError, asyncio.IncompleteReadError) as error:
+                errors.append(str(error))
+                client.close()
+        client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    seconds = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    report = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "degraded": degraded,
+        "seconds": seconds,
+        "queries_per_second": len(latencies) / seconds if seconds else 0.0,
+    }
+    if len(latencies):
+        report.update({f"latency_p{p}_ms": float(np.percentile(latencies, p)) for p in (50, 90, 99, 99.9)})
+    report["server"] = await Client(args.host, args.port).request("/metrics")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the serving API of serve.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=16, help="Connections sending requests at once.")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests in total.")
+    parser.add_argument("--queries", default=None, help="BEIR queries.jsonl or one query per line. Default is synthetic.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None, help="Latency budget sent with each query.")
+    args = parser.parse_args(argv)
+
+    queries = read_queries(args.queries) if args.queries else synthetic_queries(args.requests)
+    report = asyncio.run(run(args, queries))
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
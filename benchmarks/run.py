@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beir.retrieval.evaluation import EvaluateRetrieval
+from local_datasets.corpus_store import JoinedTexts
+from models.commons.instrumentation import PROFILER
+from udl.ranked_lists import RankedLists
+from udl.udlf import UDLF
+
+# growth of the peak RSS of a stage not reported as a regression, however large in proportion
+RSS_NOISE_BYTES = 16 * 1024 ** 2
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "benchmarks", "history.json")
+
+
+def synthetic_ranked_lists(n: int, width: int, seed: int = 42) -> RankedLists:
+    """
+    Clustered ranked lists: each doc ranks members of its own cluster, in a random
+    order, never itself and without repetitions.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, n // (4 * (width + 1)))
+    members = n // n_clusters
+    ids = [f"doc{i:07d}" for i in range(n)]
+
+    start = rng.integers(0, members, size=(n, 1))
+    steps = 1 + (start + np.arange(width)) % (members - 1)
+    indices = ((np.arange(n)[:, None] + n_clusters * steps) % n).astype(np.int32)
+    scores = -np.sort(-rng.random((n, width), dtype=np.float32), axis=1)
+    return RankedLists(ids, indices, scores)
+
+
+def synthetic_qrels(results: RankedLists, every: int = 10, relevant: int = 5, seed: int = 42) -> dict:
+    rng = np.random.default_rng(seed)
+    qrels = {}
+    for i in range(0, len(results), every):
+        chosen = rng.choice(results.width, min(relevant, results.width), replace=False)
+        qrels[results.ids[i]] = {results.ids[results.indices[i, j]]: 1 for j in chosen}
+    return qrels
+
+
+def synthetic_corpus(n: int, n_queries: int, vocabulary: int = 20000, seed: int = 42):
+    """
+    Zipf-distributed documents of 20 to 80 words and queries of 3 to 8 words.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{i}" for i in range(vocabulary)], dtype=object)
+
+    def text(length):
+        return " ".join(words[np.minimum(rng.zipf(1.3, length), vocabulary) - 1])
+
+    corpus = {f"doc{i:07d}": {"title": text(5), "text": text(rng.integers(20, 80))} for i in range(n)}
+    queries = {f"query{i:06d}": text(rng.integers(3, 8)) for i in range(n_queries)}
+    return corpus, queries
+
+
+class SyntheticDataset:
+    """
+    Stands for a BEIR dataset, with the same accessors as local_datasets.beir_datasets.BEIR.
+    """
+
+    def __init__(self, corpus: dict, queries: dict, qrels: dict, out_dir: str):
+        self.dataset_name = "synthetic"
+        self.corpus, self.queries, self.qrels = corpus, queries, qrels
+        self.out_dir = out_dir
+
+    def queries_of_queries_and_docs(self):
+        return JoinedTexts(self.corpus, self.queries)
+
+    def corpus_of_corpus_and_queries(self):
+        return self.corpus
+
+
+class BenchmarkModel(UDLF):
+    """
+    UDLF model over given ranked lists, to run the UDLF stages without retrieval.
+    """
+
+    def __init__(self, dataset: SyntheticDataset, results: RankedLists, k_values: list):
+        super().__init__(beir_local_datasets_path=dataset.out_dir + "/", dataset_name=dataset.dataset_name)
+        os.makedirs(os.path.join(dataset.out_dir, dataset.dataset_name), exist_ok=True)
+        self.dataset = dataset
+        self.name = "benchmark"
+        self.k_values = k_values
+        self.retriever = EvaluateRetrieval(k_values=k_values)
+        self.results = results
+        self.ndcg, self._map, self.recall, self.precision = None, None, None, None
+
+    @property
+    def data(self):
+        return {
+            "dataset": self.dataset.dataset_name,
+            "k_values": self.k_values,
+            "retriever": self.name,
+            "ndcg": self.ndcg,
+            "map": self._map,
+            "recall": self.recall,
+            "precision": self.precision
+        }
+
+
+def measure(name: str, items: int, function) -> dict:
+    """
+    Runs function as a profiled stage, returns its throughput in items per second, the
+    peak RSS of the process and how much the stage grew it.
+    """
+    # records of the previous stages are dropped, the sampler thread keeps running
+    PROFILER.take()
+    with PROFILER.stage(name):
+        function()
+    record = PROFILER.take()[-1]
+    growth = record["peak_rss_bytes"] - record["start_rss_bytes"]
+    print(f"{name}: {items / record['wall_seconds']:.0f} items/s, {record['wall_seconds']:.3f}s, "
+          f"peak RSS {record['peak_rss_bytes'] / 1024 ** 2:.0f}MB, +{growth / 1024 ** 2:.0f}MB in the stage")
+    return {
+        "items": items,
+        "seconds": record["wall_seconds"],
+        "cpu_seconds": record["cpu_seconds"],
+        "throughput": items / record["wall_seconds"] if record["wall_seconds"] else float("inf"),
+        "peak_rss_bytes": record["peak_rss_bytes"],
+        "rss_growth_bytes": growth,
+        "bytes_written": record["bytes_written"]
+    }
+
+
+def run_size(n: int, args) -> dict:
+    from udl.methods.CPRR import CPRRMethod
+    from udl.methods.LHRR import LHRRMethod
+    from udl.methods.RDPAC import RDPACMethod
+
+    stages = {}
+    workdir = tempfile.mkdtemp(prefix="udlf-benchmark-")
+    results = synthetic_ranked_lists(n, args.width)
+    dataset = SyntheticDataset({}, {}, synthetic_qrels(results), workdir)
+    model = BenchmarkModel(dataset, results, args.k_values)
+
+    stages["write_udlf_ranked_list_file"] = measure(
+        "write_udlf_ranked_list_file", n, lambda: model.write_udlf_ranked_list_file(depth=args.width))
+    # the written input has the UDLF output format, the query first on each line
+    model.output_results_path = model.ranked_list_path
+    stages["read_results"] = measure("read_results", n, model.read_results)
+    stages["evaluate"] = measure("evaluate", len(dataset.qrels), lambda: model.evaluate(model.udlf_results))
+    stages["dataframe"] = measure("dataframe", 1, model.dataframe)
+
+    if n <= args.methods_max_docs:
+        for config in (CPRRMethod(l=args.width, backend="native"), LHRRMethod(l=args.width, backend="native"),
+                       RDPACMethod(l=args.width // 2, k_end=10, backend="native")):
+            stages[f"udlf_{config.method}"] = measure(f"udlf_{config.method}", n, lambda: model.udlf_run(config))
+
+    if n <= args.retrieval_max_docs:
+        stages.update(run_retrieval(n, args, workdir))
+
+    return stages
+
+
+def run_retrieval(n: int, args, workdir: str) -> dict:
+    from models.BM25 import BM25Model
+    from models.commons.dense_search import BlockedDenseSearch
+
+    stages = {}
+    n_queries = max(1, n // 10)
+    corpus, queries = synthetic_corpus(n, n_queries)
+    dataset = SyntheticDataset(corpus, queries, {}, workdir)
+
+    # same retrieval as a BM25Model run: every query and doc against the corpus, in-process
+    model = BM25Model(dataset, args.k_values, backend="sparse")
+    stages["bm25_retrieval"] = measure("bm25_retrieval", n + n_queries, lambda: setattr(model, "results", model.search()))
+
+    # the SBERT encoder needs a download, its search engine runs on random embeddings of the same size
+    rng = np.random.default_rng(42)
+    embeddings = rng.standard_normal((n, 384), dtype=np.float32)
+    ids = list(corpus)
+    engine = BlockedDenseSearch(memory_budget=args.memory_budget)
+    stages["sbert_retrieval"] = measure(
+        "sbert_retrieval", n, lambda: engine.search(embeddings, embeddings, max(args.k_values), ids, ids))
+    return stages
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def regressions(history: list, run: dict, threshold: float, window: int) -> list:
+    """
+    Stages of run whose throughput fell, or whose growth of the peak RSS rose, by more
+    than threshold against the median of the last window runs of the same size. The RSS
+    the process held before a stage, e.g. left by the previous ones, is not its own.
+    """
+    found = []
+    for size, stages in run["sizes"].items():
+        previous = [entry["sizes"][size] for entry in history if size in entry["sizes"]][-window:]
+        for name, stage in stages.items():
+            baseline = [entry[name] for entry in previous if name in entry]
+            if not baseline:
+                continue
+            throughput = median(entry["throughput"] for entry in baseline)
+            if stage["throughput"] < throughput * (1 - threshold):
+                found.append(f"{name} at {size} docs: {stage['throughput']:.0f} items/s against {throughput:.0f}")
+
+            # runs recorded before the growth was measured have no memory baseline
+            growths = [entry["rss_growth_bytes"] for entry in baseline if "rss_growth_bytes" in entry]
+            if not growths:
+                continue
+            memory = median(growths)
+            growth = stage["rss_growth_bytes"]
+            if growth > memory * (1 + threshold) and growth - memory > RSS_NOISE_BYTES:
+                found.append(f"{name} at {size} docs: RSS grown by {growth / 1024 ** 2:.0f}MB "
+                             f"against {memory / 1024 ** 2:.0f}MB")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the pipeline stages on synthetic data, without network.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000], help="Numbers of docs, 1k to 1M.")
+    parser.add_argument("--width", type=int, default=100, help="Items per ranked list.")
+    parser.add_argument("--k-values", nargs="+", type=int, default=[1, 5, 10, 100])
+    parser.add_argument("--methods-max-docs", type=int, default=100000, help="Largest size the UDLF methods run on.")
+    parser.add_argument("--retrieval-max-docs", type=int, default=10000, help="Largest size the retrieval runs on.")
+    parser.add_argument("--memory-budget", type=int, default=1024 ** 3, help="Bytes of the dense search tiles.")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON history of the runs.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Regression tolerated, as a fraction.")
+    parser.add_argument("--window", type=int, default=5, help="Previous runs the baseline is the median of.")
+    parser.add_argument("--no-record", action="store_true", help="Compares without adding the run to the history.")
+    args = parser.parse_args(argv)
+
+    run = {"timestamp": time.time(), "commit": git_commit(), "width": args.width, "sizes": {}}
+    for n in args.sizes:
+        print(f"Benchmarking {n} docs")
+        run["sizes"][str(n)] = run_size(n, args)
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    found = regressions([entry for entry in history if entry.get("width") == args.width], run,
+                        args.threshold, args.window)
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(f"{args.history}.tmp", "w") as f:
+            json.dump(history + [run], f, indent=2)
+        os.replace(f"{args.history}.tmp", args.history)
+
+    for regression in found:
+        print(f"Regression: {regression}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
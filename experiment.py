@@ -0,0 +1,305 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List
+import registry
+
+DEFAULT_K_VALUES = [1, 3, 5, 7, 10, 15, 20, 25, 30, 50, 75, 100]
+DEFAULT_WORKDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "experiments")
+
+
+def load_spec(path: str) -> dict:
+    """
+    Reads a run spec, YAML when the file ends in .yaml or .yml, JSON otherwise.
+
+    Example:
+        name: scifact-sweep
+        datasets: [scifact, nfcorpus]
+        retrievers:
+          - name: bm25
+            params: {backend: sparse}
+          - name: sbert
+        methods:
+          - name: CPRR
+            grid: {l: [100], k: [3, 5], t: [1, 2]}
+            params: {backend: native}
+        k_values: [1, 5, 10, 100]
+        parallelism: {pipelines: 2, methods: 8}
+        output: final_results.csv
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    spec.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    spec.setdefault("k_values", DEFAULT_K_VALUES)
+    spec.setdefault("methods", [])
+    spec.setdefault("parallelism", {})
+    spec["retrievers"] = [
+        {"name": retriever} if isinstance(retriever, str) else retriever for retriever in spec.get("retrievers", [])
+    ]
+
+    # every name is checked before any stage runs
+    registry.validate(registry.DATASETS, spec.get("datasets", []), "dataset")
+    registry.validate(registry.MODELS, [retriever["name"] for retriever in spec["retrievers"]], "model")
+    registry.validate(registry.METHODS, [method["name"] for method in spec["methods"]], "method")
+    if not spec.get("datasets") or not spec["retrievers"]:
+        raise ValueError(f"The run spec {path} needs at least one dataset and one retriever")
+    return spec
+
+
+def label(name: str, params: dict) -> str:
+    if not params:
+        return name
+    return f"{name}({','.join(f'{key}={value}' for key, value in sorted(params.items()))})"
+
+
+def safe_name(name: str) -> str:
+    """
+    Name usable as a single path component, e.g. of a retriever label or a method config.
+    """
+    return re.sub(r"^\.", "_", re.sub(r"[^\w.=,()-]", "_", name))
+
+
+def file_name(name: str) -> str:
+    return safe_name(name) + ".csv"
+
+
+class Stage:
+    """
+    Node of the experiment DAG. A stage is done when all its outputs exist.
+    """
+
+    def __init__(self, name: str, run: Callable, outputs: List[str], dependencies: List["Stage"] = None):
+        self.name = name
+        self.run = run
+        self.outputs = outputs
+        self.dependencies = dependencies or []
+        self.dependents = []
+        self.skipped = False
+        for dependency in self.dependencies:
+            dependency.dependents.append(self)
+
+    def done(self) -> bool:
+        return bool(self.outputs) and all(os.path.exists(output) for output in self.outputs)
+
+
+class Experiment:
+    """
+    Plans and runs a run spec as a DAG of stages: loading each dataset, then for
+    each retriever its retrieval and evaluation, then its UDLF method configs.
+
+    Stage outputs are result CSVs under the working directory. A stage is skipped
+    when its outputs exist and no stage depending on it has to run, so an
+    interrupted or extended sweep only runs what is missing. Retrieval results
+    come from the retrieval cache when they were computed before.
+    """
+
+    def __init__(self, spec: dict, workdir: str = None, pipelines: int = None, method_workers: int = None):
+        """
+        Parameters:
+            spec (dict): Run spec, see load_spec.
+            workdir (str): Directory of the stage outputs. Default is .cache/experiments/<name>.
+            pipelines (int): (dataset, retriever) pipelines run at a time. Default is the spec's, or 1.
+            method_workers (int): Processes of each UDLF method sweep. Default is the spec's, or the cores.
+        """
+        self.spec = spec
+        self.workdir = workdir or spec.get("workdir") or os.path.join(DEFAULT_WORKDIR, spec["name"])
+        self.pipelines = pipelines or spec["parallelism"].get("pipelines", 1)
+        self.method_workers = method_workers or spec["parallelism"].get("methods")
+        self.datasets = {}
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.stages = self.plan()
+
+    def method_configs(self) -> Dict[str, object]:
+        from udl.sweep import grid
+
+        configs = {}
+        for method in self.spec["methods"]:
+            method_class = registry.resolve(registry.METHODS, method["name"], "method")
+            params = method.get("params", {})
+            method_grid = {key: values if isinstance(values, list) else [values]
+                           for key, values in method.get("grid", {}).items()}
+            configs.update(grid(method_class, **method_grid, **{key: [value] for key, value in params.items()}))
+        return configs
+
+    def plan(self) -> List[Stage]:
+        from models.commons.checkpoint import config_hash
+
+        configs = self.method_configs() if self.spec["methods"] else {}
+        stages = []
+        for dataset_name in self.spec["datasets"]:
+            load = Stage(f"load {dataset_name}", lambda dataset_name=dataset_name: self.load_dataset(dataset_name), [])
+            stages.append(load)
+
+            for retriever in self.spec["retrievers"]:
+                retriever_label = retriever.get("label", label(retriever["name"], retriever.get("params", {})))
+                # outputs of other retriever params or cutoffs, e.g. under the same custom label, are kept apart
+                config = config_hash({"params": retriever.get("params", {}), "k_values": self.spec["k_values"]})
+                directory = os.path.join(self.workdir, dataset_name, safe_name(retriever_label), config[:12])
+                model_holder = {}
+
+                retrieve = Stage(
+                    f"retrieve {dataset_name}/{retriever_label}",
+                    lambda dataset_name=dataset_name, retriever=retriever, directory=directory, model_holder=model_holder:
+                        self.retrieve(dataset_name, retriever, directory, model_holder),
+                    [os.path.join(directory, "retrieval.csv")],
+                    [load]
+                )
+                stages.append(retrieve)
+
+                if configs:
+                    outputs = {name: os.path.join(directory, "methods", file_name(name)) for name in configs}
+                    stages.append(Stage(
+                        f"rerank {dataset_name}/{retriever_label} ({len(configs)} configs)",
+                        lambda configs=configs, outputs=outputs, model_holder=model_holder:
+                            self.rerank(configs, outputs, model_holder),
+                        list(outputs.values()),
+                        [retrieve]
+                    ))
+
+        # a stage is skipped when it is done and none of its dependents runs, dependents come later
+        for stage in reversed(stages):
+            stage.skipped = (stage.done() or not stage.outputs) and all(dependent.skipped for dependent in stage.dependents)
+        return stages
+
+    def load_dataset(self, dataset_name: str):
+        with self.lock:
+            if dataset_name not in self.datasets:
+                self.datasets[dataset_name] = registry.create_dataset(dataset_name)
+
+    def retrieve(self, dataset_name: str, retriever: dict, directory: str, model_holder: dict):
+        model = registry.create_model(retriever["name"], self.datasets[dataset_name], self.spec["k_values"],
+                                      **retriever.get("params", {}))
+        model.retrieve()
+        model.evaluate()
+        model_holder["model"] = model
+
+        os.makedirs(directory, exist_ok=True)
+        write_csv(model.dataframe(), os.path.join(directory, "retrieval.csv"))
+
+    def rerank(self, configs: dict, outputs: Dict[str, str], model_holder: dict):
+        from udl.sweep import SweepRunner
+
+        # only the configs without an output run
+        pending = {name: config for name, config in configs.items() if not os.path.exists(outputs[name])}
+        runner = SweepRunner(model_holder["model"], max_workers=self.method_workers)
+
+        # each output is written as soon as its config finishes, by the name the runner gives
+        def write(method_name, dataframe):
+            os.makedirs(os.path.dirname(outputs[method_name]), exist_ok=True)
+            write_csv(dataframe, outputs[method_name])
+
+        runner.run(pending, on_result=write)
+
+        if runner.failures:
+            raise RuntimeError(f"{len(runner.failures)} method configs failed: {', '.join(runner.failures)}")
+
+    def describe(self):
+        for stage in self.stages:
+            status = "cached" if stage.skipped else "pending"
+            dependencies = ", ".join(dependency.name for dependency in stage.dependencies)
+            print(f"[{status}] {stage.name}{f'  <- {dependencies}' if dependencies else ''}")
+
+    def run(self):
+        """
+        Runs the pending stages, each one as soon as its dependencies are done, with at
+        most self.pipelines stages at a time. A failed stage fails its dependents only.
+        """
+        pending = [stage for stage in self.stages if not stage.skipped]
+        finished, running = set(), {}
+        print(f"Running {len(pending)} of {len(self.stages)} stages of {self.spec['name']}")
+
+        with ThreadPoolExecutor(max_workers=self.pipelines) as executor:
+            while pending or running:
+                for stage in list(pending):
+                    if any(dependency.name in self.failures for dependency in stage.dependencies):
+                        self.failures[stage.name] = "a dependency failed"
+                        pending.remove(stage)
+                    elif all(dependency.skipped or dependency.name in finished for dependency in stage.dependencies):
+                        running[executor.submit(stage.run)] = stage
+                        pending.remove(stage)
+
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    exception = future.exception()
+                    if exception is not None:
+                        error = "".join(traceback.format_exception(type(exception), exception, exception.__traceback__))
+                        print(f"Stage {stage.name} failed:\n{error}")
+                        self.failures[stage.name] = error
+                    else:
+                        finished.add(stage.name)
+                        print(f"Stage {stage.name} done")
+
+        return self.collect()
+
+    def collect(self):
+        """
+        Concatenates every stage output that exists in the final_results.csv schema.
+        """
+        import pandas as pd
+
+        frames = [
+            pd.read_csv(output) for stage in self.stages for output in stage.outputs if os.path.exists(output)
+        ]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def write_csv(dataframe, path: str):
+    # written aside and renamed, so an interrupted stage leaves no output behind
+    dataframe.to_csv(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs a declarative experiment spec, skipping cached stages.")
+    parser.add_argument("spec", help="YAML or JSON run spec.")
+    parser.add_argument("--workdir", default=None, help="Directory of the stage outputs.")
+    parser.add_argument("--pipelines", type=int, default=None, help="(dataset, retriever) pipelines run at a time.")
+    parser.add_argument("--method-workers", type=int, default=None, help="Processes of each UDLF method sweep.")
+    parser.add_argument("--trace", default=None, help="Writes a Chrome trace of the stages to this JSON file.")
+    parser.add_argument("--plan", action="store_true", help="Prints the stages and whether they are cached, then exits.")
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+    experiment = Experiment(spec, args.workdir, args.pipelines, args.method_workers)
+    experiment.describe()
+    if args.plan:
+        return 0
+
+    from main import check_binary_path
+    from udl.udlf import UDLF
+    from models.commons.cache import RetrievalCache
+
+    # The binary is only needed by methods not running on the native backend
+    if any(config.backend == "binary" for config in experiment.method_configs().values()):
+        UDLF.set_binary_path(check_binary_path())
+    UDLF.set_cache(RetrievalCache())
+
+    final_results = experiment.run()
+    print(final_results)
+    output = spec.get("output", os.path.join(experiment.workdir, "final_results.csv"))
+    final_results.to_csv(output, index=False)
+
+    # timing, memory and IO of each stage, next to the results
+    from models.commons.instrumentation import PROFILER
+    PROFILER.export_csv(f"{os.path.splitext(output)[0]}_stages.csv")
+    if args.trace is not None:
+        PROFILER.export_chrome_trace(args.trace)
+    return 1 if experiment.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,35 @@
-from beir import util
+import csv
+import hashlib
+import json
 import os
 import pathlib
-from beir.datasets.data_loader import GenericDataLoader
+import shutil
+from local_datasets.corpus_store import CorpusStore, JoinedTexts
 
 BEIR_DATASETS_BASE_URL = "https://public.ukp.informatik.tu-darmstadt.de/thakur/BEIR/datasets"
+# version of the filtered dataset artifacts, bump it when the filtering or their layout changes
+FILTER_VERSION = 1
+MANIFEST_FILE = "manifest.json"
 
 class BEIR:
+    # the corpus is read from a compact on-disk store instead of a dict of dicts,
+    # set to False to load it with BEIR's GenericDataLoader
+    lazy = True
+    # ids excluded from the dataset, removed from the collections in exclude_from
+    invalid_ids = []
+    exclude_from = ("queries", "corpus")
+    # why an id is invalid, when known, by id; the manifest otherwise records what was found
+    invalid_reasons = {}
+    # also drops the judgments of removed docs and the queries left without any, which
+    # changes the evaluation, so it is off by default and the qrels are kept as loaded
+    prune_judgments = False
+
     def __init__(self, dataset_name):
         super().__init__()
         self.corpus = None
         self.queries = None
         self.qrels = None
+        self.manifest = None
         self.dataset_name = dataset_name
 
     def load(self):
@@ -19,11 +38,173 @@ class BEIR:
         self.data_path = os.path.join(self.out_dir, self.dataset_name)
 
         if not os.path.exists(self.data_path):
+            # beir.util imports torch and requests, only needed to download
+            from beir import util
             self.data_path = util.download_and_unzip(self.url, self.out_dir)
 
-        self.corpus, self.queries, self.qrels = GenericDataLoader(self.data_path).load(split="test")
+        if not self.lazy:
+            from beir.datasets.data_loader import GenericDataLoader
+            self.corpus, self.queries, self.qrels = GenericDataLoader(self.data_path).load(split="test")
+            return self.corpus, self.queries, self.qrels
+
+        # the dataset with its invalid items excluded is materialized once, see exclude_invalid_items
+        if os.path.exists(os.path.join(self.filtered_path(), MANIFEST_FILE)):
+            return self.load_filtered()
+
+        # corpus.jsonl is converted once, later loads only map the store
+        store_path = os.path.join(self.data_path, "store")
+        if not CorpusStore.exists(store_path):
+            CorpusStore.convert(os.path.join(self.data_path, "corpus.jsonl"), store_path)
+        self.corpus = CorpusStore(store_path)
+        self.qrels = self.load_qrels(os.path.join(self.data_path, "qrels", "test.tsv"))
+        self.queries = self.load_queries(os.path.join(self.data_path, "queries.jsonl"))
+        return self.corpus, self.queries, self.qrels
+
+    def filtered_path(self):
+        """
+        Directory of the filtered artifact, versioned by FILTER_VERSION, the excluded ids and
+        whether the judgments were pruned.
+        """
+        digest = hashlib.sha1(json.dumps(
+            [sorted(self.invalid_ids), list(self.exclude_from), self.prune_judgments]
+        ).encode()).hexdigest()
+        return os.path.join(self.data_path, "filtered", f"v{FILTER_VERSION}-{digest[:12]}")
+
+    def load_filtered(self):
+        path = self.filtered_path()
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, "queries.json")) as f:
+            self.queries = json.load(f)
+        with open(os.path.join(path, "qrels.json")) as f:
+            self.qrels = json.load(f)
+        self.corpus = CorpusStore(os.path.join(path, "store"))
+
+        print(f"Loaded {self.dataset_name} from {path}, {len(self.manifest['removed'])} invalid items excluded")
         return self.corpus, self.queries, self.qrels
 
+    def exclude_invalid_items(self):
+        """
+        Removes the invalid_ids from the collections in exclude_from, and with
+        prune_judgments the judgments left dangling. With the lazy loader, the result is
+        materialized once with a manifest of the removed items, and later loads read it directly.
+        """
+        if self.manifest is not None:
+            return
+
+        removed = []
+        for id in self.invalid_ids:
+            found = [name for name in self.exclude_from if id in getattr(self, name)]
+            # the reasons look at every collection, before the id leaves any of them
+            reasons = {name: self.invalid_reason(id, name) for name in found}
+            for name in found:
+                getattr(self, name).pop(id)
+                removed.append({"id": id, "from": name, "reason": reasons[name]})
+        if self.prune_judgments:
+            removed.extend(self.exclude_judgments({item["id"] for item in removed if item["from"] == "corpus"}))
+
+        missing = set(self.invalid_ids) - {item["id"] for item in removed}
+        print(f"Excluded {len(removed)} invalid items from {self.dataset_name}, {len(missing)} were not found")
+
+        if self.lazy:
+            self.save_filtered(removed, sorted(missing))
+
+    def invalid_reason(self, id, name):
+        """
+        Reason recorded in the manifest for an invalid id of the queries or corpus.
+        """
+        if id in self.invalid_reasons:
+            return self.invalid_reasons[id]
+        if name == "queries":
+            text = self.queries[id]
+        else:
+            doc = self.corpus[id]
+            text = f"{doc.get('title') or ''} {doc.get('text') or ''}"
+        if not text.strip():
+            return f"empty {'query' if name == 'queries' else 'doc'} text"
+        if id in self.queries and id in self.corpus:
+            return "id shared by a query and a doc"
+        return f"listed in {type(self).__name__}.invalid_ids"
+
+    def exclude_judgments(self, doc_ids):
+        """
+        Drops the qrels of the removed docs, and the queries left without judgments,
+        as GenericDataLoader only keeps queries with qrels. Returns their manifest entries.
+        """
+        removed = []
+        if not doc_ids:
+            return removed
+        for query_id in list(self.qrels):
+            judged = self.qrels[query_id]
+            for doc_id in sorted(doc_ids & judged.keys()):
+                del judged[doc_id]
+                removed.append({"id": f"{query_id}/{doc_id}", "from": "qrels", "reason": "judgment of a removed doc"})
+            if not judged:
+                del self.qrels[query_id]
+                if self.queries.pop(query_id, None) is not None:
+                    removed.append({"id": query_id, "from": "queries", "reason": "no judgments left"})
+        return removed
+
+    def save_filtered(self, removed, missing):
+        """
+        Writes the filtered corpus, queries and qrels with their manifest, on a temporary
+        directory renamed when complete.
+        """
+        path = self.filtered_path()
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+        CorpusStore.write(os.path.join(tmp_path, "store"), (
+            (id, doc["title"], doc["text"]) for id, doc in self.corpus.items()
+        ))
+        with open(os.path.join(tmp_path, "queries.json"), "w") as f:
+            json.dump(self.queries, f)
+        with open(os.path.join(tmp_path, "qrels.json"), "w") as f:
+            json.dump(self.qrels, f)
+
+        self.manifest = {
+            "dataset": self.dataset_name,
+            "version": FILTER_VERSION,
+            "exclude_from": list(self.exclude_from),
+            "prune_judgments": self.prune_judgments,
+            "removed": removed,
+            "not_found": missing,
+            "counts": {"corpus": len(self.corpus), "queries": len(self.queries), "qrels": len(self.qrels)}
+        }
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.corpus = CorpusStore(os.path.join(path, "store"))
+
+    @staticmethod
+    def load_qrels(qrels_path):
+        """
+        Reads the qrels as GenericDataLoader does, a tsv with a header row.
+        """
+        qrels = {}
+        with open(qrels_path, encoding="utf-8") as f:
+            reader = csv.reader(f, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+            next(reader)
+            for query_id, corpus_id, score in reader:
+                qrels.setdefault(query_id, {})[corpus_id] = int(score)
+        return qrels
+
+    def load_queries(self, queries_path):
+        """
+        Streams the queries, keeping only the ones with qrels, in qrels order, as GenericDataLoader does.
+        """
+        queries = {}
+        with open(queries_path, encoding="utf8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                query = json.loads(line)
+                if query.get("_id") in self.qrels:
+                    queries[query.get("_id")] = query.get("text")
+        return {query_id: queries[query_id] for query_id in self.qrels if query_id in queries}
+
     def queries_of_queries_and_docs(self):
         """
         Function to get the queries from the queries and corpus dataset
@@ -31,14 +212,9 @@ class BEIR:
             queries: Queries dataset
             corpus: Corpus dataset
         Returns:
-            queries + corpus
+            queries + corpus, as a lazy view that joins the title and text of a doc on access
         """
-        corpus_as_queries = {}
-
-        for id, value in self.corpus.items():
-            corpus_as_queries[id] = value.get("title") + " " + value.get("text")
-
-        return {**corpus_as_queries, **self.queries}
+        return JoinedTexts(self.corpus, self.queries)
 
 
     def corpus_of_corpus_and_queries(self):
@@ -69,9 +245,13 @@ class BEIR:
             del self.queries[id]
         elif id in self.corpus:
             print(f"Removing corpus id {id} from corpus")
-            del self.corpus[id]
+            # the lazy corpus store hides docs with pop, it has no item deletion
+            self.corpus.pop(id)
 
 class SciFact(BEIR):
+    invalid_ids = ["768"]
+    exclude_from = ("queries",)
+
     def __init__(self):
         super().__init__("scifact")
         self.url = f"{BEIR_DATASETS_BASE_URL}/scifact.zip"
@@ -80,10 +260,10 @@ class SciFact(BEIR):
         self.load()
         self.exclude_invalid_items()
 
-    def exclude_invalid_items(self):
-        self.queries.pop("768")
-
 class SciDocs(BEIR):
+    invalid_ids = ["a29afef550bf4edbf3293a50ef3fdb785ff1e5a3"]
+    exclude_from = ("queries",)
+
     def __init__(self):
         super().__init__("scidocs")
         self.url = f"{BEIR_DATASETS_BASE_URL}/scidocs.zip"
@@ -92,20 +272,8 @@ class SciDocs(BEIR):
         self.load()
         self.exclude_invalid_items()
 
-    def exclude_invalid_items(self):
-        self.queries.pop("a29afef550bf4edbf3293a50ef3fdb785ff1e5a3")
-
 class NFCorpus(BEIR):
-    def __init__(self):
-        super().__init__("nfcorpus")
-        self.url = f"{BEIR_DATASETS_BASE_URL}/nfcorpus.zip"
-        self.out_dir = os.path.join(pathlib.Path(__file__).parent.absolute(), "beir")
-        self.data_path = os.path.join(self.out_dir, "nfcorpus")
-        self.load()
-        self.exclude_invalid_items()
-
-    def exclude_invalid_items(self):
-        invalid = ['PLAIN-3382',
+    invalid_ids = ['PLAIN-3382',
                    'PLAIN-741',
                    'PLAIN-2230',
                    'PLAIN-2240',
@@ -229,58 +397,43 @@ class NFCorpus(BEIR):
                    'PLAIN-1363',
                    'PLAIN-1018']
 
-        for i in invalid:
-            self.queries.pop(i, None)
-            self.corpus.pop(i, None)
-
-class FIQA(BEIR):
     def __init__(self):
-        super().__init__("fiqa")
-        self.url = f"{BEIR_DATASETS_BASE_URL}/fiqa.zip"
+        super().__init__("nfcorpus")
+        self.url = f"{BEIR_DATASETS_BASE_URL}/nfcorpus.zip"
         self.out_dir = os.path.join(pathlib.Path(__file__).parent.absolute(), "beir")
-        self.data_path = os.path.join(self.out_dir, "fiqa")
+        self.data_path = os.path.join(self.out_dir, "nfcorpus")
         self.load()
         self.exclude_invalid_items()
 
-    def exclude_invalid_items(self):
-        invalid = ['101883', '486802', '38221', '133415', '205961', '42442', '430152', '584229', '238766', '585289',
+class FIQA(BEIR):
+    invalid_ids = ['101883', '486802', '38221', '133415', '205961', '42442', '430152', '584229', '238766', '585289',
                    '87369', '301479', '243478', '242979', '89669', '7915', '12229','14135', '33445', '40982', '54960', '66248', '115636',
                    '117276', '126502', '138418', '153104', '167128', '169220', '189754', '206368','207473', '215635', '237392', '248226',
                    '254541', '290110', '319894', '325407', '356535', '358213', '360125', '399083', '414219', '441462','447488', '470232',
                    '486245', '528558', '552533', '572451', '587667', '597929'
                    ]
 
-        for i in invalid:
-            self.queries.pop(i, None)
-            self.corpus.pop(i, None)
-
-class ArguAna(BEIR):
     def __init__(self):
-        super().__init__("arguana")
-        self.url = f"{BEIR_DATASETS_BASE_URL}/arguana.zip"
+        super().__init__("fiqa")
+        self.url = f"{BEIR_DATASETS_BASE_URL}/fiqa.zip"
         self.out_dir = os.path.join(pathlib.Path(__file__).parent.absolute(), "beir")
-        self.data_path = os.path.join(self.out_dir, "arguana")
+        self.data_path = os.path.join(self.out_dir, "fiqa")
         self.load()
         self.exclude_invalid_items()
 
-    def exclude_invalid_items(self):
-        invalid = ['training-society-iasihbmubf-pro06a']
-
-        for i in invalid:
-            self.queries.pop(i, None)
-            self.corpus.pop(i, None)
+class ArguAna(BEIR):
+    invalid_ids = ['training-society-iasihbmubf-pro06a']
 
-class TRECCOVID(BEIR):
     def __init__(self):
-        super().__init__("trec-covid")
-        self.url = f"{BEIR_DATASETS_BASE_URL}/trec-covid.zip"
+        super().__init__("arguana")
+        self.url = f"{BEIR_DATASETS_BASE_URL}/arguana.zip"
         self.out_dir = os.path.join(pathlib.Path(__file__).parent.absolute(), "beir")
-        self.data_path = os.path.join(self.out_dir, "trec-covid")
+        self.data_path = os.path.join(self.out_dir, "arguana")
         self.load()
         self.exclude_invalid_items()
 
-    def exclude_invalid_items(self):
-        invalid = ['vy9u5acm','k5a1oyee','r1644q1s','88eo0ktq','tpz4wyow','mvoq9vln','nqztn30k','j4eluall','vcb32uug','2a7kn146','y4lfc4va',
+class TRECCOVID(BEIR):
+    invalid_ids = ['vy9u5acm','k5a1oyee','r1644q1s','88eo0ktq','tpz4wyow','mvoq9vln','nqztn30k','j4eluall','vcb32uug','2a7kn146','y4lfc4va',
             '2qf7kdtb','fzh27v3x','098fpoec','hay19wnl','1m4bmia8','cgcvfftf','tlvgys96','fz9p6gyn','4ewemyny','e5qacf03','0e0stvsd',
             'k3opc553','fafz60od','4zbh8o4s','m4fhtvyi','ulu28g3r','iuw0wlno','nkgs2iv6','vboa8xn9','xvzmhbm7','2307yevz','1x5uthma',
             'xqn1gm50','035fpn54','8vbygrss','q4c1vlt9','puefswhz','aqjcxjfq','aksv9sqg','2goaji9g','xzobolak','xat7b13b','jppi8rrh',
@@ -315,21 +468,17 @@ class TRECCOVID(BEIR):
             'l1rbyojd','7lyh9byx','yindercz','a206ovml','swommq4w','e66s7chx','s32d15iz','ckvx2k56','stedi1x5','h99ywt4z','n0u5xjxt',
             'b2cm88gd','4aczx8o1','ml2zoxzx','ag3bwcjg','rzzik0yz','ubw2yl06','bj9wg9di','4sq86n9e','014g9lov','h151i11b','arg07b3h',
             '90rndrso','vheqc6b7','2xlym01m','6kck6qti','grmd39i7','ybhcwln6','btuciicn','y3uqik1o']
-        for i in invalid:
-            self.queries.pop(i, None)
-            self.corpus.pop(i, None)
 
-class Quora(BEIR):
     def __init__(self):
-        super().__init__("quora")
-        self.url = f"{BEIR_DATASETS_BASE_URL}/quora.zip"
+        super().__init__("trec-covid")
+        self.url = f"{BEIR_DATASETS_BASE_URL}/trec-covid.zip"
         self.out_dir = os.path.join(pathlib.Path(__file__).parent.absolute(), "beir")
-        self.data_path = os.path.join(self.out_dir, "quora")
+        self.data_path = os.path.join(self.out_dir, "trec-covid")
         self.load()
         self.exclude_invalid_items()
 
-    def exclude_invalid_items(self):
-        invalid = ['449330', '113836', '257103', '119135', '82751', '229440', '43684', '256285', '99588', '203769',
+class Quora(BEIR):
+    invalid_ids = ['449330', '113836', '257103', '119135', '82751', '229440', '43684', '256285', '99588', '203769',
                    '260659', '178982', '75059', '485828', '415084', '334468', '78035', '481842', '127361', '97519',
                    '165815', '33644', '7489', '469122', '44699', '434176', '334581', '142847', '125092', '535806',
                    '145998', '343992', '359781', '332695', '70675', '300713', '358814', '278501', '192454', '82457',
@@ -357,11 +506,17 @@ class Quora(BEIR):
                    '194227', '254533', '344084', '418159', '509991', '303150', '403473', '439029', '213609',
                    '51174']
 
-        for i in invalid:
-            self.queries.pop(i, None)
-            self.corpus.pop(i, None)
+    def __init__(self):
+        super().__init__("quora")
+        self.url = f"{BEIR_DATASETS_BASE_URL}/quora.zip"
+        self.out_dir = os.path.join(pathlib.Path(__file__).parent.absolute(), "beir")
+        self.data_path = os.path.join(self.out_dir, "quora")
+        self.load()
+        self.exclude_invalid_items()
 
 class WebisTouche2020(BEIR):
+    invalid_ids = []
+
     def __init__(self):
         super().__init__("webis-touche2020")
         self.url = f"{BEIR_DATASETS_BASE_URL}/webis-touche2020.zip"
@@ -369,10 +524,3 @@ class WebisTouche2020(BEIR):
         self.data_path = os.path.join(self.out_dir, "webis-touche2020")
         self.load()
         self.exclude_invalid_items()
-
-    def exclude_invalid_items(self):
-        invalid = []
-
-        for i in invalid:
-            self.queries.pop(i, None)
-            self.corpus.pop(i, None)
\ No newline at end of file
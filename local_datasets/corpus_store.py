@@ -0,0 +1,164 @@
+import json
+import mmap
+import os
+import numpy as np
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+IDS_FILE = "ids.txt"
+
+
+class CorpusStore(Mapping):
+    """
+    Read-only BEIR corpus backed by a compact on-disk store: the UTF-8 titles and
+    texts concatenated in one memory-mapped file, with the offsets of each doc.
+
+    It reads as the {doc_id: {"title": ..., "text": ...}} dict of BEIR, but a doc
+    is only decoded when it is accessed, so the corpus is never held in memory.
+    """
+
+    def __init__(self, path: str):
+        """
+        Parameters:
+            path (str): Directory written by CorpusStore.convert.
+        """
+        self.path = path
+        with open(os.path.join(path, IDS_FILE)) as f:
+            self.ids = f.read().splitlines()
+        # (n, 3) int64: start of the title, start of the text, end of the doc
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self.index = {id: i for i, id in enumerate(self.ids)}
+
+        with open(os.path.join(path, TEXTS_FILE), "rb") as f:
+            self.texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b""
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return all(os.path.exists(os.path.join(path, name)) for name in (TEXTS_FILE, OFFSETS_FILE, IDS_FILE))
+
+    @staticmethod
+    def write(path: str, docs: Iterable[Tuple[str, str, str]]) -> int:
+        """
+        Writes a store from (doc_id, title, text) tuples, streaming them. The files are
+        written under temporary names and renamed when complete. Returns the number of docs.
+        """
+        os.makedirs(path, exist_ok=True)
+        offsets, ids, position = [], [], 0
+        with open(os.path.join(path, TEXTS_FILE + ".tmp"), "wb") as texts:
+            for id, title, text in docs:
+                title = (title or "").encode("utf8")
+                text = (text or "").encode("utf8")
+                texts.write(title)
+                texts.write(text)
+                offsets.append((position, position + len(title), position + len(title) + len(text)))
+                ids.append(str(id))
+                position += len(title) + len(text)
+
+        np.save(os.path.join(path, OFFSETS_FILE + ".tmp.npy"), np.array(offsets, dtype=np.int64).reshape(-1, 3))
+        with open(os.path.join(path, IDS_FILE + ".tmp"), "w") as f:
+            f.write("\n".join(ids))
+
+        os.replace(os.path.join(path, OFFSETS_FILE + ".tmp.npy"), os.path.join(path, OFFSETS_FILE))
+        os.replace(os.path.join(path, IDS_FILE + ".tmp"), os.path.join(path, IDS_FILE))
+        os.replace(os.path.join(path, TEXTS_FILE + ".tmp"), os.path.join(path, TEXTS_FILE))
+        return len(ids)
+
+    @staticmethod
+    def convert(corpus_path: str, path: str):
+        """
+        Converts a BEIR corpus.jsonl into a store, streaming it line by line.
+        """
+        def docs():
+            with open(corpus_path, encoding="utf8") as corpus:
+                for line in corpus:
+                    if line.strip():
+                        doc = json.loads(line)
+                        yield doc.get("_id"), doc.get("title"), doc.get("text")
+
+        count = CorpusStore.write(path, docs())
+        print(f"Converted {count} docs of {corpus_path} into {path}")
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __contains__(self, id) -> bool:
+        return id in self.index
+
+    def __getitem__(self, id: str) -> Dict[str, str]:
+        title_start, text_start, end = self.offsets[self.index[id]]
+        return {
+            "title": self.texts[title_start:text_start].decode("utf8"),
+            "text": self.texts[text_start:end].decode("utf8")
+        }
+
+    def pop(self, id: str, default=None):
+        """
+        Hides a doc from the store, the files are left untouched.
+        """
+        if id not in self.index:
+            return default
+        doc = self[id]
+        del self.index[id]
+        return doc
+
+    def batches(self, batch_size: int = 10000) -> Iterable[Dict[str, Dict[str, str]]]:
+        """
+        Yields the docs as {doc_id: doc} dicts of at most batch_size docs.
+        """
+        ids = list(self.index)
+        for start in range(0, len(ids), batch_size):
+            yield {id: self[id] for id in ids[start:start + batch_size]}
+
+
+class JoinedTexts(Mapping):
+    """
+    Lazy {id: title + " " + text} view of a corpus, optionally overridden by the
+    queries with the same id. No text is copied until it is accessed.
+    """
+
+    def __init__(self, corpus: Mapping, queries: Dict[str, str] = None, strip: bool = False):
+        """
+        Parameters:
+            corpus (Mapping): BEIR corpus, a dict or a CorpusStore.
+            queries (Dict[str, str]): Queries, served before the docs with the same id.
+            strip (bool): Strips the joined text.
+        """
+        self.corpus = corpus
+        self.queries = queries or {}
+        self.strip = strip
+
+    def __len__(self):
+        return len(self.corpus) + sum(1 for id in self.queries if id not in self.corpus)
+
+    def __iter__(self) -> Iterator[str]:
+        # same order as {**corpus_as_queries, **queries}
+        yield from self.corpus
+        yield from (id for id in self.queries if id not in self.corpus)
+
+    def __contains__(self, id) -> bool:
+        return id in self.queries or id in self.corpus
+
+    def __getitem__(self, id: str) -> str:
+        if id in self.queries:
+            return self.queries[id]
+        doc = self.corpus[id]
+        text = (doc.get("title") or "") + " " + (doc.get("text") or "")
+        return text.strip() if self.strip else text
+
+    def batches(self, batch_size: int = 10000) -> Iterable[List[str]]:
+        """
+        Yields the ids in lists of at most batch_size, to read the texts batch by batch.
+        """
+        batch = []
+        for id in self:
+            batch.append(id)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
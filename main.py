@@ -1,68 +1,232 @@
-from enum import Enum
-from local_datasets.beir_datasets import BEIR, SciFact, SciDocs, NFCorpus, FIQA, ArguAna, TRECCOVID, WebisTouche2020
-from models.BM25 import BM25Model
-from udl.methods.CPRR import CPRRMethod
-from udl.methods.LHRR import LHRRMethod
-from udl.methods.RDPAC import RDPACMethod
-from udl.udlf import UDLF
-from dotenv import load_dotenv
+import argparse
+import asyncio
 import os
-from models.SBERT import SBERTModel
-import pandas as pd
+import shutil
+import subprocess
+import sys
+from enum import Enum
+import registry
+
+# heavy modules (beir, torch, pandas, pyUDLF) are imported by the registry
+# factories, only once a component is selected
+
+def run_udlf_with_methods(model, methods, workdir=None, on_result=None):
+    from udl.sweep import SweepRunner
 
-def run_udlf_with_methods(model, methods):
-    results = []
-    for method_name, method_config in methods.items():
-        model.udlf_run(config=method_config)
-        model.evaluate_udlf()
-        results.append(model.dataframe(method=method_name))
-    return results
+    # each method runs in its own process and working directory
+    return SweepRunner(model, workdir=workdir).run(methods, on_result=on_result)
+
+async def run_udlf_async(runs, driver):
+    """
+    Runs the methods of each (model, methods, workdir, on_result) as soon as it is
+    given by the runs iterator, whose retrieval goes on on a thread meanwhile.
+    """
+    from udl.sweep import SweepRunner
+
+    tasks = []
+    iterator = iter(runs)
+    while True:
+        # the next dataset or model is retrieved while the binaries of the previous ones run
+        run = await asyncio.to_thread(next, iterator, None)
+        if run is None:
+            break
+        model, pending, workdir, on_result = run
+        tasks.append(asyncio.create_task(SweepRunner(model, workdir=workdir).run_async(pending, driver, on_result)))
+    await asyncio.gather(*tasks)
 
 class Models(Enum):
     BM25 = "bm25"
     SBERT = "sbert"
 
 k_values = [1,3,5,7,10,15,20,25,30,50,75,100]
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "runs", "main")
+# datasets are only built, which downloads and loads them, when their turn comes
 datasets = [
-    SciFact(),
-    #ArguAna(),
-    #NFCorpus(),
-    #SciDocs()
+    "scifact",
+    #"arguana",
+    #"nfcorpus",
+    #"scidocs"
 ]
 
-if __name__ == "__main__":
+# UDLF methods to be used, as registry name and parameters
+methods = {
+    "CPRR": ("CPRR", dict(l=100, k=3, t=2)),
+    "LHRR": ("LHRR", dict(l=100, k=2, t=2)),
+    "RDPAC": ("RDPAC", dict(l=100, k_start=1, k_end=3, k_inc=1, l_mult=2, p=0.60, pl=0.99))
+}
+
+def check_binary_path():
+    """
+    Fails fast when the UDLF binary is not configured, before anything heavy is imported.
+    """
+    from dotenv import load_dotenv
 
     # Load environment variables from .env file
     load_dotenv()
 
-    # Access the variables
     bin_path = os.getenv("UDLF_BINARY_PATH")
     if not bin_path:
         raise EnvironmentError("UDLF_BINARY_PATH is not set in the .env file.")
+    if not os.path.isfile(bin_path) or not os.access(bin_path, os.X_OK):
+        raise EnvironmentError(f"UDLF_BINARY_PATH {bin_path} is not an executable file.")
+    return bin_path
+
+def check_startup(model_names, budget: float) -> int:
+    """
+    Measures, in a fresh interpreter, the import time of this entry point and of the
+    selected models. Fails when the entry point takes more than budget seconds, or
+    when torch is imported without a model that needs it.
+
+    Raises:
+        RuntimeError: The check could not import a module, with the error it printed.
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import main\n"
+        "print(time.perf_counter() - start)\n"
+        f"for name in {list(model_names)!r}:\n"
+        "    start = time.perf_counter()\n"
+        "    main.registry.resolve(main.registry.MODELS, name)\n"
+        "    print(name, time.perf_counter() - start)\n"
+        "print('torch' in sys.modules)\n"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"The startup check failed with exit code {process.returncode}:\n{process.stderr}")
+    output = process.stdout.split("\n")
+
+    main_seconds = float(output[0])
+    print(f"main imported in {main_seconds:.3f}s, budget {budget:.3f}s")
+    for line in output[1:1 + len(model_names)]:
+        name, seconds = line.split()
+        print(f"{name} imported in {float(seconds):.3f}s")
+
+    failed = main_seconds > budget
+    if output[1 + len(model_names)] == "True" and Models.SBERT.value not in model_names:
+        print("torch was imported by a run that does not need it")
+        failed = True
+    return 1 if failed else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Retrieval and UDLF re-ranking over BEIR datasets.")
+    parser.add_argument("--datasets", nargs="+", default=datasets, help=f"One of {', '.join(registry.DATASETS)}.")
+    parser.add_argument("--models", nargs="+", default=[Models.BM25.value], help=f"One of {', '.join(registry.MODELS)}.")
+    parser.add_argument("--output", default="final_results.csv", help="Results CSV, appended as each stage finishes.")
+    parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR, help="Stage outputs and completion markers.")
+    parser.add_argument("--fresh", action="store_true", help="Discards the checkpoints and results of a previous run.")
+    parser.add_argument("--trace", default=None, help="Writes a Chrome trace of the stages to this JSON file.")
+    parser.add_argument("--udlf-driver", choices=["process", "async"], default="process",
+                        help="Runs the methods of each model on a process pool, or every UDLF binary as an asyncio subprocess, "
+                             "overlapping the methods of a model with the retrieval of the next.")
+    parser.add_argument("--udlf-jobs", type=int, default=None, help="UDLF binaries running at once with the async driver. Default is the cores.")
+    parser.add_argument("--udlf-timeout", type=float, default=None, help="Seconds a UDLF binary may run before it is killed.")
+    parser.add_argument("--check-startup", action="store_true", help="Checks the import time budget and exits.")
+    parser.add_argument("--startup-budget", type=float, default=1.0, help="Seconds allowed to import main.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # configuration errors are raised before any dataset or model is loaded
+    registry.validate(registry.DATASETS, args.datasets, "dataset")
+    registry.validate(registry.MODELS, args.models, "model")
+    registry.validate(registry.METHODS, [name for name, _ in methods.values()], "method")
 
-    # Configure UDLF binary path
-    UDLF.set_binary_path(bin_path)
+    if args.check_startup:
+        return check_startup(args.models, args.startup_budget)
 
-    # List to store dataframes
-    results = []
+    # The binary is only needed by methods not running on the native backend
+    bin_path = None
+    if any(params.get("backend", "binary") == "binary" for _, params in methods.values()):
+        bin_path = check_binary_path()
 
-    # UDLF methods to be used
-    methods = {
-        "CPRR": CPRRMethod(l=100, k=3, t=2),
-        "LHRR": LHRRMethod(l=100, k=2, t=2),
-        "RDPAC": RDPACMethod(l=100, k_start=1, k_end=3, k_inc=1, l_mult=2, p=0.60, pl=0.99)
+    udlf_methods = {
+        method_name: registry.create_method(name, **params) for method_name, (name, params) in methods.items()
     }
 
-    for dataset in datasets:
-        for model_name in Models:
-            if model_name == Models.BM25:
-                model = BM25Model(dataset, k_values)
-                model.retrieve()
-                model.evaluate()
-                results.append(model.dataframe())
-                results.extend(run_udlf_with_methods(model, methods))
-
-    # Concatenate all dataframes into a single dataframe
-    final_results = pd.concat(results, ignore_index=True)
+    from udl.udlf import UDLF
+    from models.commons.cache import RetrievalCache
+    from models.commons.checkpoint import Checkpoint, ResultsFile
+    from models.commons.instrumentation import PROFILER
+
+    if bin_path is not None:
+        # Configure UDLF binary path
+        UDLF.set_binary_path(bin_path)
+        UDLF.set_timeout(args.udlf_timeout)
+
+    # Retrieval results are cached across runs, see RETRIEVAL_CACHE_DIR and RETRIEVAL_CACHE_MAX_BYTES
+    UDLF.set_cache(RetrievalCache())
+
+    # A restarted run skips the finished stages, result rows are appended as stages finish
+    checkpoint = Checkpoint(args.checkpoint_dir)
+    if args.fresh:
+        checkpoint.reset()
+        if os.path.exists(args.output):
+            os.remove(args.output)
+    results = ResultsFile(args.output)
+
+    def runs():
+        """
+        Retrieves and evaluates each dataset and model, yielding the methods left to run on it.
+        """
+        for dataset_name in args.datasets:
+            dataset = None
+            for model_name in args.models:
+                # the config of each stage includes the configs it depends on, so a change reruns its dependents
+                configs = {"retrieve": {"k_values": k_values}, "evaluate": {"k_values": k_values}}
+                for method_name, (name, params) in methods.items():
+                    configs[f"udlf-{method_name}"] = {"k_values": k_values, "method": name, "params": params}
+                if all(checkpoint.done(dataset_name, model_name, stage, config=config) for stage, config in configs.items()):
+                    print(f"Skipping {dataset_name} with {model_name}, every stage is complete")
+                    continue
+
+                dataset = dataset or registry.create_dataset(dataset_name)
+                model = registry.create_model(model_name, dataset, k_values)
+
+                if checkpoint.done(dataset_name, model_name, "retrieve", config=configs["retrieve"]):
+                    model.load_results(checkpoint.stage_path(dataset_name, model_name, "retrieve"))
+                else:
+                    model.retrieve()
+                    checkpoint.save((dataset_name, model_name, "retrieve"), model.save_results, config=configs["retrieve"])
+                    # the UDLF input written from previous results is stale
+                    shutil.rmtree(checkpoint.stage_path(dataset_name, model_name, "udlf"), ignore_errors=True)
+
+                if not checkpoint.done(dataset_name, model_name, "evaluate", config=configs["evaluate"]):
+                    model.evaluate()
+                    results.append(model.dataframe())
+                    checkpoint.complete(dataset_name, model_name, "evaluate", config=configs["evaluate"])
+
+                def complete_method(method_name, dataframe, dataset_name=dataset_name, model_name=model_name, configs=configs):
+                    results.append(dataframe)
+                    stage = f"udlf-{method_name}"
+                    checkpoint.complete(dataset_name, model_name, stage, config=configs[stage])
+
+                pending = {
+                    method_name: method for method_name, method in udlf_methods.items()
+                    if not checkpoint.done(dataset_name, model_name, f"udlf-{method_name}", config=configs[f"udlf-{method_name}"])
+                }
+                if pending:
+                    yield model, pending, checkpoint.stage_path(dataset_name, model_name, "udlf"), complete_method
+
+    if args.udlf_driver == "async":
+        from udl.driver import UDLFDriver
+        asyncio.run(run_udlf_async(runs(), UDLFDriver(bin_path, max_jobs=args.udlf_jobs, timeout=args.udlf_timeout)))
+    else:
+        for model, pending, workdir, on_result in runs():
+            run_udlf_with_methods(model, pending, workdir=workdir, on_result=on_result)
+
+    # timing, memory and IO of each stage, next to the results
+    PROFILER.export_csv(f"{os.path.splitext(args.output)[0]}_stages.csv")
+    if args.trace is not None:
+        PROFILER.export_chrome_trace(args.trace)
+
+    final_results = results.read()
     print(final_results)
-    final_results.to_csv("final_results.csv", index=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
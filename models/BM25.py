@@ -1,7 +1,12 @@
 import logging
+import time
 from beir import LoggingHandler
-from udl.udlf import UDLF
+from udl.udlf import UDLF, search_hits, text_query_ids
+from udl.ranked_lists import RankedLists
+from models.commons.sparse_bm25 import SparseBM25
+from models.commons.msearch import MultiSearch
 from local_datasets.beir_datasets import BEIR
+from models.commons.instrumentation import instrumented, stage
 
 logging.basicConfig(
     format="%(asctime)s - %(message)s",
@@ -15,24 +20,159 @@ from beir.retrieval.search.lexical import BM25Search as BM25
 
 
 class BM25Model(UDLF):
-    def __init__(self, dataset: BEIR, k_values: list, initialize: bool = True):
+    def __init__(self, dataset: BEIR, k_values: list, initialize: bool = True,
+                 backend: str = "elasticsearch", sparse_params: dict = None,
+                 msearch_batch_size: int = 128, concurrency: int = 4, max_retries: int = 3,
+                 prune_to_qrels: bool = False):
+        """
+        Parameters:
+            dataset (BEIR): Dataset to retrieve from.
+            k_values (list): Cutoffs of the evaluation, the largest one is the retrieval depth.
+            initialize (bool): Recreates the Elasticsearch index.
+            backend (str): "elasticsearch" searches a local Elasticsearch, "sparse" scores in-process.
+            sparse_params (dict): SparseBM25 parameters.
+            msearch_batch_size (int): Queries per Elasticsearch _msearch request.
+            concurrency (int): _msearch requests in flight, also the size of the connection pool.
+            max_retries (int): Retries of a failed _msearch request or query.
+            prune_to_qrels (bool): Keeps only the UDLF output of queries with qrels.
+        """
         self.dataset = dataset
         self.name = "BM25"
         self.k_values = k_values
         super().__init__(
             beir_local_datasets_path=self.dataset.out_dir + "/",
-            dataset_name=self.dataset.dataset_name
+            dataset_name=self.dataset.dataset_name,
+            prune_to_qrels=prune_to_qrels
         )
         self.ndcg, self._map, self.recall, self.precision = None, None, None, None
-        self.model = BM25(
+        self.initialize = initialize
+        self.backend = backend
+        self.sparse_params = sparse_params or {}
+        self.msearch_batch_size = msearch_batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.search_stats = None
+        # in-process index of the sparse backend, kept for incremental updates
+        self.engine = None
+        self.multi_search = None
+        # the search model connects to Elasticsearch, it is only built on retrieve
+        self.model = None
+        self.retriever = EvaluateRetrieval(k_values=self.k_values)
+        self.results = None
+
+    @property
+    def params(self):
+        if self.backend == "sparse":
+            return {"name": self.name, "backend": self.backend, **self.sparse_params}
+        return {"name": self.name, "number_of_shards": 4}
+
+    @instrumented("search")
+    def search(self):
+        if self.backend != "sparse":
+            return self.elasticsearch_search()
+
+        engine = self.sparse_index()
+        queries = self.dataset.queries_of_queries_and_docs()
+        query_ids = list(queries.keys())
+        indices, scores = engine.search(list(queries.values()), query_ids, self.retriever.top_k)
+        return RankedLists.from_matrix(query_ids, engine.doc_ids, indices, scores)
+
+    def sparse_index(self) -> SparseBM25:
+        """
+        In-process index of the corpus, built again when the corpus changed since.
+        """
+        corpus = self.dataset.corpus_of_corpus_and_queries()
+        if self.engine is None or len(self.engine.doc_ids) != len(corpus) or not all(
+                id in corpus for id in self.engine.doc_ids):
+            self.engine = SparseBM25(**self.sparse_params)
+            with stage("index"):
+                self.engine.fit(corpus)
+        return self.engine
+
+    def search_subset(self, query_ids, doc_ids=None):
+        if self.backend != "sparse":
+            raise NotImplementedError("Incremental updates of BM25 need the sparse backend")
+
+        engine = self.sparse_index()
+        queries = self.dataset.queries_of_queries_and_docs()
+        doc_ids = engine.doc_ids if doc_ids is None else doc_ids
+        indices, scores = engine.search(
+            [queries[id] for id in query_ids], query_ids, min(self.retriever.top_k, len(doc_ids)), doc_ids
+        )
+        return RankedLists.from_matrix(query_ids, doc_ids, indices, scores)
+
+    def search_texts(self, texts, top_k=None):
+        """
+        Retrieves for texts outside the dataset, such as the queries of the serving API.
+        With Elasticsearch, the index must already hold the corpus.
+        """
+        top_k = top_k or self.retriever.top_k
+        query_ids = text_query_ids(len(texts))
+        if self.backend == "sparse":
+            # the index is only checked against the corpus when there is none yet
+            engine = self.engine if self.engine is not None else self.sparse_index()
+            indices, scores = engine.search(texts, query_ids, top_k)
+            return search_hits(engine.doc_ids, indices, scores)
+
+        if self.model is None:
+            # the index is searched as it is, never recreated
+            self.initialize = False
+            self.model = self.load_model()
+        if self.multi_search is None:
+            self.multi_search = self.create_multi_search()
+        return self.multi_search.search(texts, top_k)
+
+    def create_multi_search(self) -> MultiSearch:
+        return MultiSearch(
+            client=self.model.es.es,
+            index_name=self.model.es.index_name,
+            title_key=self.model.es.title_key,
+            text_key=self.model.es.text_key,
+            batch_size=self.msearch_batch_size,
+            concurrency=self.concurrency,
+            max_retries=self.max_retries
+        )
+
+    def load_model(self):
+        return BM25(
             index_name=self.dataset.dataset_name,
             hostname="localhost",
-            initialize=initialize,
+            initialize=self.initialize,
             number_of_shards=4,
+            batch_size=self.msearch_batch_size,
+            maxsize=self.concurrency,
         )
-        self.retriever = EvaluateRetrieval(self.model, k_values=self.k_values)
-        self.results = None
 
+    def elasticsearch_search(self):
+        """
+        Same retrieval as BEIR's BM25Search, with the _msearch batches sent concurrently.
+        """
+        if self.model is None:
+            self.model = self.load_model()
+
+        corpus = self.dataset.corpus_of_corpus_and_queries()
+        queries = self.dataset.queries_of_queries_and_docs()
+        if self.initialize:
+            with stage("index"):
+                self.model.index(corpus)
+                time.sleep(self.model.sleep_for)
+
+        multi_search = self.create_multi_search()
+        query_ids = list(queries.keys())
+        with stage("msearch"):
+            hits = multi_search.search_iter(list(queries.values()), self.retriever.top_k + 1)
+            # as BEIR, the query itself is not part of its results
+            results = RankedLists.from_rows((
+                (query_ids[i], [(doc_id, score) for doc_id, score in query_hits if doc_id != query_ids[i]])
+                for i, query_hits in enumerate(hits)
+            ), self.retriever.top_k + 1)
+
+        self.search_stats = multi_search.stats
+        print(
+            f"Searched {self.search_stats['queries']} queries at {self.search_stats['queries_per_second']:.1f} queries/s, "
+            f"batch latency p50 {self.search_stats['latency_p50_ms']:.0f}ms p99 {self.search_stats['latency_p99_ms']:.0f}ms"
+        )
+        return results
 
     @property
     def data(self):
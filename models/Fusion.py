@@ -0,0 +1,153 @@
+import os
+from typing import List, Union
+from beir.retrieval.evaluation import EvaluateRetrieval
+from udl.udlf import UDLF, UDLFConfig
+from udl.fusion import align, fuse
+from udl.helpers.config import UDLFConfigHelper
+from udl.ranked_lists import RankedLists
+from local_datasets.beir_datasets import BEIR
+from models.commons.instrumentation import instrumented
+
+MEMBERS_DIR = "members"
+
+
+class FusionModel(UDLF):
+    """
+    Fusion of several retrievers over the same dataset, e.g. BM25 and SBERT.
+
+    Each retriever runs once, its results coming from the retrieval cache when they
+    were computed before, and the ranked lists are aligned on a shared id space.
+    self.results holds their in-process fusion, which the UDLF methods re-rank on
+    the native backend. On the binary backend, the aligned lists are written once
+    per retriever and fused by the UDLF fusion task instead, also in a SweepRunner.
+    """
+
+    def __init__(self, dataset: BEIR, k_values: list, models: List[Union[str, dict]] = ("bm25", "sbert"),
+                 fusion: str = "rrf", rrf_k: int = 60, weights: List[float] = None,
+                 prune_to_qrels: bool = False):
+        """
+        Parameters:
+            dataset (BEIR): Dataset to retrieve from.
+            k_values (list): Cutoffs of the evaluation, the largest one is the depth of the fused lists.
+            models (list): Registry names of the fused retrievers, or {"name": ..., "params": {...}}.
+            fusion (str): In-process fusion, "rrf", "combsum" or "borda". Default is "rrf".
+            rrf_k (int): Rank offset of RRF. Default is 60.
+            weights (List[float]): Weight of each retriever in the in-process fusion.
+            prune_to_qrels (bool): Keeps only the UDLF output of queries with qrels.
+        """
+        import registry
+
+        self.dataset = dataset
+        self.k_values = k_values
+        self.members = [
+            registry.create_model(model, dataset, k_values) if isinstance(model, str)
+            else registry.create_model(model["name"], dataset, k_values, **model.get("params", {}))
+            for model in models
+        ]
+        self.fusion, self.rrf_k, self.weights = fusion, rrf_k, weights
+        self.name = self.fusion_name()
+        super().__init__(
+            beir_local_datasets_path=self.dataset.out_dir + "/",
+            dataset_name=self.dataset.dataset_name,
+            prune_to_qrels=prune_to_qrels
+        )
+        self.ndcg, self._map, self.recall, self.precision = None, None, None, None
+        self.retriever = EvaluateRetrieval(k_values=self.k_values)
+        self.aligned = None
+        self.results = None
+
+    def fusion_name(self) -> str:
+        return "-".join([member.name for member in self.members] + [self.fusion])
+
+    @property
+    def params(self):
+        return {"name": self.name, "members": [member.params for member in self.members], "fusion": self.fusion}
+
+    @instrumented("retrieve")
+    def retrieve(self):
+        self.evaluators, self.pruned_ids, self.pruned_queries = {}, None, None
+        for member in self.members:
+            member.retrieve()
+        self.aligned = align([member.results for member in self.members])
+        self.results = self.fuse()
+
+    @instrumented("fuse")
+    def fuse(self) -> RankedLists:
+        return fuse(self.aligned, self.fusion, depth=self.retriever.top_k, k=self.rrf_k, weights=self.weights)
+
+    def set_fusion(self, fusion: str, rrf_k: int = None, weights: List[float] = None):
+        """
+        Fuses the aligned lists again with another method, without retrieving them again.
+        """
+        self.fusion = fusion
+        self.rrf_k = rrf_k or self.rrf_k
+        self.weights = weights
+        self.name = self.fusion_name()
+        self.evaluators, self.pruned_ids, self.pruned_queries = {}, None, None
+        self.results = self.fuse()
+
+    @instrumented("save_results")
+    def save_results(self, path: str = None):
+        """
+        Saves the fused lists and, under members/, the aligned lists of each retriever.
+        """
+        path = path or self.ranked_lists_dir
+        self.results.save(path)
+        for i, aligned in enumerate(self.aligned):
+            aligned.save(os.path.join(path, MEMBERS_DIR, str(i)))
+
+    @instrumented("load_results")
+    def load_results(self, path: str = None):
+        path = path or self.ranked_lists_dir
+        self.results = RankedLists.load(path)
+        self.aligned = [RankedLists.load(os.path.join(path, MEMBERS_DIR, str(i))) for i in range(len(self.members))]
+        for aligned in self.aligned:
+            # one vocabulary object, so the evaluation encodes the qrels once for all of them
+            aligned.ids = self.results.ids
+
+    def fusion_ranked_list_paths(self) -> List[str]:
+        return [
+            f"{self.beir_local_datasets_path}{self.dataset_name}/ranked_list_{member.name}.txt"
+            for member in self.members
+        ]
+
+    @instrumented("write_ranked_lists")
+    def write_fusion_ranked_list_files(self, depth: int = None) -> int:
+        """
+        Writes the aligned ranked lists of each retriever, in the same order of queries.
+        Returns integer as dataset size.
+        """
+        size = 0
+        for aligned, path in zip(self.aligned, self.fusion_ranked_list_paths()):
+            size = aligned.truncate(depth).to_text(path, query_first=True, depth=depth)
+        return size
+
+    def udlf_input(self, config: UDLFConfig, write_input: bool = True) -> "InputType":
+        """
+        Parameters of the UDLF fusion task over the aligned lists, used on the binary
+        backend; the native backend re-ranks the in-process fusion.
+        """
+        if write_input:
+            size = self.write_fusion_ranked_list_files(depth=config.depth())
+            self.write_udlf_lists_file()
+        else:
+            size = len(self.results)
+
+        params = UDLFConfigHelper.create_fusion_config(
+            size=size,
+            lists_path=self.lists_path,
+            output_path=self.output_path
+        ) | config.params()
+        return self.input_config(params, self.fusion_ranked_list_paths())
+
+    @property
+    def data(self):
+        return {
+            "dataset": self.dataset.dataset_name,
+            "k_values": self.k_values,
+            "retriever": self.name,
+            "ndcg": self.ndcg,
+            "map": self._map,
+            "recall": self.recall,
+            "precision": self.precision
+        }
@@ -1,8 +1,16 @@
 import logging
+import os
+import numpy as np
 from beir import LoggingHandler
 from models.commons.output import CommonOutput
-from udl.udlf import UDLF
+from models.commons.embeddings import EmbeddingStore
+from models.commons.dense_search import BlockedDenseSearch
+from models.commons.ann import IVFIndex, recall_report
+from udl.udlf import UDLF, search_hits, text_query_ids
+from udl.ranked_lists import RankedLists
 from local_datasets.beir_datasets import BEIR
+from local_datasets.corpus_store import JoinedTexts
+from models.commons.instrumentation import instrumented
 
 logging.basicConfig(
     format="%(asctime)s - %(message)s",
@@ -17,22 +25,187 @@ from beir.retrieval.search.dense import DenseRetrievalExactSearch as DRES
 
 
 class SBERTModel(UDLF):
-    def __init__(self, dataset: BEIR, k_values: list):
+    def __init__(self, dataset: BEIR, k_values: list, embeddings_dtype: str = "float32",
+                 search_memory_budget: int = 1024 ** 3, search_workers: int = None,
+                 index_mode: str = "exact", ivf_params: dict = None, prune_to_qrels: bool = False):
+        """
+        Parameters:
+            dataset (BEIR): Dataset to retrieve from.
+            k_values (list): Cutoffs of the evaluation, the largest one is the retrieval depth.
+            embeddings_dtype (str): Storage type of the embeddings, "float32" or "float16".
+            search_memory_budget (int): Bytes used by the exact search score tiles.
+            search_workers (int): Threads of the exact search. Default is the number of cores.
+            index_mode (str): "exact" searches the whole corpus, "ivf" uses an approximate IVF index.
+            ivf_params (dict): IVFIndex parameters, nlist and nprobe trade recall for latency.
+            prune_to_qrels (bool): Keeps only the UDLF output of queries with qrels.
+        """
         self.dataset = dataset
         self.name = "sbert"
         self.k_values = k_values
+        self.model_name = "all-MiniLM-L6-v2"
+        self.batch_size = 512
+        self.search_memory_budget = search_memory_budget
+        self.search_workers = search_workers
+        self.index_mode = index_mode
+        self.ivf_params = ivf_params or {}
         super().__init__(
             beir_local_datasets_path=self.dataset.out_dir + "/",
-            dataset_name=self.dataset.dataset_name
+            dataset_name=self.dataset.dataset_name,
+            prune_to_qrels=prune_to_qrels
         )
         self.ndcg, self._map, self.recall, self.precision = None, None, None, None
-        self.model = DRES(
-            models.SentenceBERT("all-MiniLM-L6-v2"),
-            batch_size=512
-        )
-        self.retriever = EvaluateRetrieval(self.model, k_values=self.k_values)
+        # the encoder is only loaded on retrieve
+        self.model = None
+        self.retriever = EvaluateRetrieval(k_values=self.k_values)
         self.results = None
 
+        # embeddings are stored per encoder and reused across runs
+        embeddings_path = os.path.join(self.dataset.out_dir, self.dataset.dataset_name, "embeddings", self.model_name)
+        self.corpus_store = EmbeddingStore(os.path.join(embeddings_path, "corpus"), dtype=embeddings_dtype)
+        self.queries_store = EmbeddingStore(os.path.join(embeddings_path, "queries"), dtype=embeddings_dtype)
+        self.ivf_path = os.path.join(embeddings_path, "ivf.npz")
+        # corpus ids of the stored embeddings and the IVF index, kept to serve queries
+        self.corpus_ids, self.ann = None, None
+
+    @property
+    def params(self):
+        params = {"name": self.name, "model": self.model_name, "score_function": self.retriever.score_function}
+        if self.index_mode != "exact":
+            params.update({"index_mode": self.index_mode, **self.ivf_params})
+        return params
+
+    def exact_engine(self):
+        return BlockedDenseSearch(
+            score_function=self.retriever.score_function,
+            memory_budget=self.search_memory_budget,
+            num_workers=self.search_workers
+        )
+
+    @instrumented("ann_index")
+    def ann_index(self, corpus_ids):
+        """
+        Loads the IVF index of the corpus, building and saving it when missing or outdated.
+        """
+        index = IVFIndex(score_function=self.retriever.score_function, **self.ivf_params)
+        if not index.load(self.ivf_path) or not index.is_built_for(corpus_ids):
+            index.build(self.corpus_store.view(corpus_ids), corpus_ids)
+            index.save(self.ivf_path)
+        return index
+
+    def load_model(self):
+        return DRES(
+            models.SentenceBERT(self.model_name),
+            batch_size=self.batch_size
+        )
+
+    def encode(self, texts):
+        if self.model is None:
+            self.model = self.load_model()
+        return self.model.model.encode_queries(texts, batch_size=self.batch_size, show_progress_bar=True)
+
+    @instrumented("encode")
+    def encode_dataset(self):
+        corpus = self.dataset.corpus_of_corpus_and_queries()
+        self.corpus_store.update(JoinedTexts(corpus, strip=True), self.encode)
+        self.queries_store.update(self.dataset.queries, self.encode)
+        self.corpus_ids = list(corpus.keys())
+        return self.corpus_ids
+
+    @instrumented("search")
+    def search(self):
+        """
+        Dense retrieval over the embedding store. Each corpus doc is encoded once and
+        its vector serves both as a query and as a doc, as BEIR encodes them alike.
+        """
+        corpus_ids = self.encode_dataset()
+
+        # real queries take precedence over docs with the same id, as in queries_of_queries_and_docs
+        doc_query_ids = [id for id in corpus_ids if id not in self.dataset.queries]
+        real_query_ids = list(self.dataset.queries.keys())
+
+        engine = self.ann_index(corpus_ids) if self.index_mode == "ivf" else self.exact_engine()
+        corpus_embeddings = self.corpus_store.view(corpus_ids)
+        outputs = [
+            engine.search(embeddings, corpus_embeddings, self.retriever.top_k, query_ids, corpus_ids)
+            for query_ids, embeddings in [
+                (doc_query_ids, self.corpus_store.view(doc_query_ids)),
+                (real_query_ids, self.queries_store.view(real_query_ids))
+            ]
+        ]
+
+        return RankedLists.from_matrix(
+            doc_query_ids + real_query_ids,
+            corpus_ids,
+            np.concatenate([indices for indices, _ in outputs]),
+            np.concatenate([scores for _, scores in outputs])
+        )
+
+    def search_subset(self, query_ids, doc_ids=None):
+        """
+        Exact search of the given queries against the given docs, only the docs missing
+        from the embedding store are encoded. Also used with the IVF index mode.
+        """
+        corpus_ids = self.encode_dataset()
+        doc_ids = corpus_ids if doc_ids is None else doc_ids
+
+        # real queries take precedence over docs with the same id, as in search
+        real_query_ids = [id for id in query_ids if id in self.dataset.queries]
+        doc_query_ids = [id for id in query_ids if id not in self.dataset.queries]
+        engine = self.exact_engine()
+        doc_embeddings = self.corpus_store.view(doc_ids)
+        top_k = min(self.retriever.top_k, len(doc_ids))
+        outputs = [
+            engine.search(embeddings, doc_embeddings, top_k, ids, doc_ids)
+            for ids, embeddings in [
+                (doc_query_ids, self.corpus_store.view(doc_query_ids)),
+                (real_query_ids, self.queries_store.view(real_query_ids))
+            ]
+        ]
+
+        return RankedLists.from_matrix(
+            doc_query_ids + real_query_ids,
+            doc_ids,
+            np.concatenate([indices for indices, _ in outputs]),
+            np.concatenate([scores for _, scores in outputs])
+        )
+
+    def search_texts(self, texts, top_k=None):
+        """
+        Retrieves for texts outside the dataset, such as the queries of the serving API.
+        The corpus embeddings and the IVF index are loaded on the first call.
+        """
+        if self.corpus_ids is None:
+            self.encode_dataset()
+        if self.index_mode == "ivf" and self.ann is None:
+            self.ann = self.ann_index(self.corpus_ids)
+
+        query_ids = text_query_ids(len(texts))
+        engine = self.ann if self.index_mode == "ivf" else self.exact_engine()
+        indices, scores = engine.search(
+            np.asarray(self.encode(texts), dtype=np.float32), self.corpus_store.view(self.corpus_ids),
+            top_k or self.retriever.top_k, query_ids, self.corpus_ids
+        )
+        return search_hits(self.corpus_ids, indices, scores)
+
+    def ann_recall_report(self, l_values: list = None, sample_size: int = 1000, seed: int = 42):
+        """
+        Recall@L of the IVF ranked lists against exact search, over a sample of the
+        corpus-as-query lists, to weigh the speed up against what UDLF loses.
+        """
+        corpus_ids = self.encode_dataset()
+        rng = np.random.default_rng(seed)
+        sample = [corpus_ids[i] for i in np.sort(rng.choice(len(corpus_ids), min(sample_size, len(corpus_ids)), replace=False))]
+
+        top_k = self.retriever.top_k
+        corpus_embeddings = self.corpus_store.view(corpus_ids)
+        sample_embeddings = self.corpus_store.get(sample)
+        exact, _ = self.exact_engine().search(sample_embeddings, corpus_embeddings, top_k, sample, corpus_ids)
+        approximate, _ = self.ann_index(corpus_ids).search(sample_embeddings, corpus_embeddings, top_k, sample, corpus_ids)
+
+        report = recall_report(approximate, exact, l_values or self.k_values)
+        report["Environment"] = f"{self.dataset.dataset_name}+{self.name}+ivf"
+        return report
+
     @property
     def data(self):
         return {
@@ -0,0 +1,169 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Tuple
+from models.commons.dense_search import BlockedDenseSearch, merge_top_k, normalize
+from models.commons.cache import hash_ids
+
+
+def recall_at(approximate: np.ndarray, exact: np.ndarray, l: int) -> float:
+    """
+    Mean fraction of the exact top-l found in the approximate top-l.
+    """
+    found = [
+        len(np.intersect1d(a[:l][a[:l] >= 0], e[:l][e[:l] >= 0])) / max(1, (e[:l] >= 0).sum())
+        for a, e in zip(approximate, exact)
+    ]
+    return float(np.mean(found)) if found else 1.0
+
+
+def recall_report(approximate: np.ndarray, exact: np.ndarray, l_values: List[int]) -> pd.DataFrame:
+    return pd.DataFrame([{"L": l, "Recall": recall_at(approximate, exact, l)} for l in l_values])
+
+
+class IVFIndex:
+    """
+    Inverted file index: the corpus is clustered with k-means and a query only scores
+    the docs of its nprobe closest clusters. nprobe trades recall for latency.
+    """
+
+    def __init__(self, nlist: int = None, nprobe: int = 16, score_function: str = "cos_sim",
+                 n_iter: int = 20, seed: int = 42):
+        """
+        Parameters:
+            nlist (int): Number of clusters. Default is 4 * sqrt(corpus size).
+            nprobe (int): Clusters scored per query. Default is 16.
+            score_function (str): "cos_sim" or "dot".
+            n_iter (int): k-means iterations. Default is 20.
+            seed (int): Seed of the k-means sampling.
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.score_function = score_function
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids, self.order, self.offsets, self.ids_hash = None, None, None, None
+        # parameters the loaded or built clusters come from
+        self.built_params = None
+        self.engine = BlockedDenseSearch(score_function=score_function)
+
+    @property
+    def build_params(self) -> dict:
+        """
+        Parameters the clusters depend on, unlike nprobe which is only read by search.
+        """
+        return {"nlist": self.nlist, "score_function": self.score_function, "n_iter": self.n_iter, "seed": self.seed}
+
+    def assign(self, embeddings: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        assignments = np.empty(len(embeddings), dtype=np.int64)
+        for start in range(0, len(embeddings), block_size):
+            block = self.engine.prepare(embeddings[start:start + block_size])
+            assignments[start:start + block_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def build(self, embeddings: np.ndarray, corpus_ids: List[str]):
+        """
+        Trains the clusters on a sample of the corpus and fills the inverted lists.
+        """
+        rng = np.random.default_rng(self.seed)
+        nlist = self.nlist or int(4 * np.sqrt(len(embeddings)))
+        nlist = max(1, min(nlist, len(embeddings)))
+
+        sample = np.sort(rng.choice(len(embeddings), min(len(embeddings), 256 * nlist), replace=False))
+        training = self.engine.prepare(embeddings[sample])
+        self.centroids = training[rng.choice(len(training), nlist, replace=False)]
+
+        print(f"Training IVF index with {nlist} lists on {len(training)} embeddings")
+        for _ in range(self.n_iter):
+            assignments = np.argmax(training @ self.centroids.T, axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, training)
+            counts = np.bincount(assignments, minlength=nlist)[:, None]
+            # empty clusters keep their centroid
+            self.centroids = np.where(counts > 0, sums / np.maximum(counts, 1), self.centroids)
+            if self.score_function == "cos_sim":
+                self.centroids = normalize(self.centroids)
+
+        assignments = self.assign(embeddings)
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+        self.ids_hash = hash_ids(corpus_ids)
+        self.built_params = self.build_params
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                 ids_hash=np.array(self.ids_hash), params=np.array(json.dumps(self.built_params)))
+
+    def load(self, path: str) -> bool:
+        """
+        Loads a saved index, returns False when there is none.
+        """
+        if not os.path.exists(path):
+            return False
+        data = np.load(path)
+        self.centroids, self.order, self.offsets = data["centroids"], data["order"], data["offsets"]
+        self.ids_hash = str(data["ids_hash"])
+        # indexes saved without their parameters are built again
+        self.built_params = json.loads(str(data["params"])) if "params" in data else None
+        return True
+
+    def is_built_for(self, corpus_ids: List[str]) -> bool:
+        """
+        Whether the clusters were built over these corpus ids with the current parameters.
+        """
+        return (
+            self.centroids is not None
+            and self.built_params == self.build_params
+            and self.ids_hash == hash_ids(corpus_ids)
+        )
+
+    def search(self, query_embeddings: np.ndarray, corpus_embeddings: np.ndarray, top_k: int,
+               query_ids: List[str], corpus_ids: List[str],
+               query_block_size: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same output as BlockedDenseSearch.search, rows may be padded with -1 when the
+        probed clusters hold less than top_k docs.
+        """
+        corpus_index = {id: i for i, id in enumerate(corpus_ids)}
+        identical = np.array([corpus_index.get(id, -1) for id in query_ids], dtype=np.int64)
+        nprobe = min(self.nprobe, len(self.centroids))
+
+        indices = np.full((len(query_ids), top_k), -1, dtype=np.int32)
+        scores = np.full((len(query_ids), top_k), -np.inf, dtype=np.float32)
+        for start in range(0, len(query_ids), query_block_size):
+            end = min(start + query_block_size, len(query_ids))
+            queries = self.engine.prepare(query_embeddings[start:end])
+            probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+            block_identical = identical[start:end]
+
+            best_indices = np.full((end - start, top_k), -1, dtype=np.int64)
+            best_scores = np.full((end - start, top_k), -np.inf, dtype=np.float32)
+
+            # group the queries by probed cluster, then score cluster by cluster
+            probed = np.argsort(probes.ravel(), kind="stable")
+            probing_rows = np.repeat(np.arange(end - start), nprobe)[probed]
+            bounds = np.searchsorted(probes.ravel()[probed], np.arange(len(self.centroids) + 1))
+
+            for cluster in range(len(self.centroids)):
+                rows = probing_rows[bounds[cluster]:bounds[cluster + 1]]
+                members = np.sort(self.order[self.offsets[cluster]:self.offsets[cluster + 1]])
+                if len(rows) == 0 or len(members) == 0:
+                    continue
+
+                cluster_scores = queries[rows] @ self.engine.prepare(corpus_embeddings[members]).T
+                cluster_scores[block_identical[rows][:, None] == members[None, :]] = -np.inf
+
+                best_indices[rows], best_scores[rows] = merge_top_k(
+                    np.concatenate([best_indices[rows], np.broadcast_to(members, cluster_scores.shape)], axis=1),
+                    np.concatenate([best_scores[rows], cluster_scores], axis=1),
+                    top_k
+                )
+
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            indices[start:end] = np.take_along_axis(best_indices, order, axis=1)
+            scores[start:end] = np.take_along_axis(best_scores, order, axis=1)
+
+        indices[~np.isfinite(scores)] = -1
+        return indices, scores
@@ -0,0 +1,153 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Iterable, List
+from udl.ranked_lists import RankedLists
+
+META_FILE = "meta.json"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), ".cache", "retrieval")
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+
+def hash_ids(ids: Iterable[str]) -> str:
+    """
+    Order-independent digest of a set of ids.
+    """
+    digest = hashlib.sha256()
+    for id in sorted(ids, key=lambda x: str(x)):
+        digest.update(str(id).encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class RetrievalCache:
+    """
+    Persistent cache of first-stage retrieval results, stored in the binary ranked
+    list format under a content-addressed key. Entries are evicted least recently
+    used first once the cache grows over max_bytes.
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        self.path = path or os.getenv("RETRIEVAL_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes or int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(dataset_name: str, query_ids: Iterable[str], corpus_ids: Iterable[str],
+            model_params: dict, top_k: int) -> str:
+        """
+        Key of a retrieval run: the dataset, its filtered query and corpus ids, the model and the top-k.
+        """
+        content = {
+            "dataset": dataset_name,
+            "queries": hash_ids(query_ids),
+            "corpus": hash_ids(corpus_ids),
+            "model": model_params,
+            "top_k": top_k
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def get(self, key: str) -> RankedLists:
+        """
+        Returns the cached ranked lists loaded in memory, or None on a miss.
+        """
+        path = self.entry_path(key)
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            return None
+
+        # the meta file modification time is the last access, used by the eviction
+        os.utime(os.path.join(path, META_FILE))
+        return RankedLists.load(path, mmap=False)
+
+    def put(self, key: str, ranked_lists: RankedLists, meta: dict = None):
+        """
+        Stores the ranked lists atomically and evicts old entries over the size budget.
+        """
+        tmp_path = f"{self.entry_path(key)}.{os.getpid()}.tmp"
+        ranked_lists.save(tmp_path)
+        with open(os.path.join(tmp_path, META_FILE), "w") as f:
+            json.dump({**(meta or {}), "key": key, "created": time.time()}, f)
+
+        if os.path.exists(self.entry_path(key)):
+            shutil.rmtree(self.entry_path(key))
+        os.replace(tmp_path, self.entry_path(key))
+        self.evict()
+
+    def entries(self) -> List[dict]:
+        """
+        Lists the cache entries, least recently used first.
+        """
+        entries = []
+        for key in os.listdir(self.path):
+            meta_path = os.path.join(self.path, key, META_FILE)
+            if key.endswith(".tmp") or not os.path.exists(meta_path):
+                continue
+
+            with open(meta_path) as f:
+                meta = json.load(f)
+            size = sum(
+                os.path.getsize(os.path.join(self.path, key, file))
+                for file in os.listdir(os.path.join(self.path, key))
+            )
+            entries.append({**meta, "key": key, "size": size, "last_access": os.path.getmtime(meta_path)})
+
+        return sorted(entries, key=lambda entry: entry["last_access"])
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(entry["size"] for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            print(f"Evicting retrieval cache entry {entry['key']}")
+            self.remove(entry["key"])
+            total -= entry["size"]
+
+    def remove(self, key: str):
+        shutil.rmtree(self.entry_path(key), ignore_errors=True)
+
+    def purge(self, dataset_name: str = None):
+        """
+        Removes every entry, or only the ones of a dataset.
+        """
+        for entry in self.entries():
+            if dataset_name is None or entry.get("dataset") == dataset_name:
+                self.remove(entry["key"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and purge the retrieval cache.")
+    parser.add_argument("--path", default=None, help="Cache directory.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the entries, least recently used first.")
+    purge = subparsers.add_parser("purge", help="Remove entries.")
+    purge.add_argument("--dataset", default=None, help="Only remove the entries of this dataset.")
+    purge.add_argument("--key", default=None, help="Only remove this entry.")
+    args = parser.parse_args()
+
+    cache = RetrievalCache(args.path)
+    if args.command == "list":
+        entries = cache.entries()
+        for entry in entries:
+            last_access = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["last_access"]))
+            print(f"{entry['key'][:16]}  {entry.get('dataset')}  {entry.get('model')}  "
+                  f"k={entry.get('top_k')}  {entry['size'] / 1024 ** 2:.1f}MB  {last_access}")
+        print(f"{len(entries)} entries, {sum(e['size'] for e in entries) / 1024 ** 2:.1f}MB "
+              f"of {cache.max_bytes / 1024 ** 2:.1f}MB")
+    elif args.key is not None:
+        # keys can be given by the prefix shown on list
+        for entry in cache.entries():
+            if entry["key"].startswith(args.key):
+                cache.remove(entry["key"])
+    else:
+        cache.purge(args.dataset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import pandas as pd
+from typing import Callable
+
+MARKER_SUFFIX = ".done"
+
+
+def config_hash(config) -> str:
+    """
+    Digest of a JSON-like stage config, keys in any order.
+    """
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Checkpoint:
+    """
+    Completion markers of the stages of a run, so a restarted run skips the finished
+    ones. A stage is named by a path, e.g. ("nfcorpus", "bm25", "retrieve"); its
+    outputs, if any, live in the directory of that path and its marker next to it.
+    The marker is written last, so a stage interrupted midway runs again. A stage
+    completed with a config keeps its hash in the marker, and is only done for the
+    same config, so a stage whose parameters changed runs again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def stage_path(self, *names: str) -> str:
+        return os.path.join(self.path, *names)
+
+    def done(self, *names: str, config=None) -> bool:
+        marker = self.stage_path(*names) + MARKER_SUFFIX
+        if not os.path.exists(marker):
+            return False
+        if config is None:
+            return True
+        with open(marker) as f:
+            return json.load(f).get("config") == config_hash(config)
+
+    def complete(self, *names: str, config=None, **meta):
+        marker = self.stage_path(*names) + MARKER_SUFFIX
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        if config is not None:
+            meta["config"] = config_hash(config)
+        with open(f"{marker}.tmp", "w") as f:
+            json.dump({**meta, "completed": time.time()}, f)
+        os.replace(f"{marker}.tmp", marker)
+
+    def save(self, names: tuple, write: Callable[[str], None], config=None, **meta):
+        """
+        Runs write(directory) on a temporary directory, moves it in place of the stage
+        outputs and marks the stage as complete.
+        """
+        path = self.stage_path(*names)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        write(tmp_path)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.complete(*names, config=config, **meta)
+
+    def reset(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+
+class ResultsFile:
+    """
+    Results CSV in the final_results.csv schema, appended as each stage finishes.
+    Rows of an environment written again, by a stage that was interrupted after
+    appending but before its marker, replace the previous ones. Stages finishing on
+    different threads append one at a time.
+    """
+
+    def __init__(self, path: str, key: str = "Environment"):
+        self.path = path
+        self.key = key
+        self.keys = set(pd.read_csv(path)[key]) if os.path.exists(path) else set()
+        self.lock = threading.Lock()
+
+    def append(self, dataframe: pd.DataFrame):
+        with self.lock:
+            self.write(dataframe)
+
+    def write(self, dataframe: pd.DataFrame):
+        written = set(dataframe[self.key])
+        if written & self.keys:
+            existing = pd.read_csv(self.path)
+            existing = existing[~existing[self.key].isin(written)]
+            existing.to_csv(f"{self.path}.tmp", index=False)
+            os.replace(f"{self.path}.tmp", self.path)
+            self.keys = set(existing[self.key])
+
+        # the columns of the first rows lead, later rows with other K columns are aligned to them
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            columns = pd.read_csv(self.path, nrows=0).columns
+            if list(dataframe.columns) != list(columns):
+                existing = pd.concat([pd.read_csv(self.path), dataframe], ignore_index=True)
+                existing.to_csv(f"{self.path}.tmp", index=False)
+                os.replace(f"{self.path}.tmp", self.path)
+                self.keys |= written
+                return
+            dataframe.to_csv(self.path, mode="a", header=False, index=False)
+        else:
+            dataframe.to_csv(self.path, index=False)
+        self.keys |= written
+
+    def read(self) -> pd.DataFrame:
+        return pd.read_csv(self.path) if os.path.exists(self.path) else pd.DataFrame()
@@ -0,0 +1,118 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+# bytes held per (query, doc) score of a tile: the float32 score, its negated copy
+# and the int64 position output of argpartition in merge_top_k
+BYTES_PER_SCORE = 4 + 4 + 8
+# bytes held per float32 embedding value once prepared: the float32 copy and its normalized copy
+BYTES_PER_VALUE = 4 + 4
+# bytes held per merged candidate: int64 position, float32 score, negated copy, argpartition output
+BYTES_PER_CANDIDATE = 8 + 4 + 4 + 8
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+
+def merge_top_k(indices: np.ndarray, scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keeps the top_k highest scores of each row, unsorted.
+    """
+    if scores.shape[1] <= top_k:
+        return indices, scores
+    top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    return np.take_along_axis(indices, top, axis=1), np.take_along_axis(scores, top, axis=1)
+
+
+class BlockedDenseSearch:
+    """
+    Exact top-k dense search with bounded memory. Queries are split in blocks, spread
+    over a thread pool, and each block is scored against corpus tiles sized to fit the
+    memory budget, keeping a running top-k. Embeddings can be memory-mapped and of any
+    float type, tiles are read and converted to float32 on demand.
+    """
+
+    def __init__(self, score_function: str = "cos_sim", memory_budget: int = 1024 ** 3,
+                 num_workers: int = None, query_block_size: int = 1024):
+        """
+        Parameters:
+            score_function (str): "cos_sim" or "dot".
+            memory_budget (int): Bytes used by the score tiles of all workers together.
+            num_workers (int): Threads scoring query blocks. Default is the number of cores.
+            query_block_size (int): Queries per block.
+        """
+        self.score_function = score_function
+        self.memory_budget = memory_budget
+        self.num_workers = num_workers or os.cpu_count()
+        self.query_block_size = query_block_size
+
+    def tile_size(self, n_corpus: int, top_k: int, dim: int) -> int:
+        """
+        Docs per corpus tile, so that every worker, with its prepared query block, its
+        merged candidates and the scores and prepared embeddings of its tile, stays
+        within its share of the memory budget.
+        """
+        per_worker = self.memory_budget // self.num_workers
+        fixed = self.query_block_size * (dim * BYTES_PER_VALUE + 2 * top_k * BYTES_PER_CANDIDATE)
+        per_doc = self.query_block_size * BYTES_PER_SCORE + dim * BYTES_PER_VALUE
+        tile = (per_worker - fixed) // per_doc
+        return int(min(n_corpus, max(tile, top_k, 1)))
+
+    def prepare(self, embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        return normalize(embeddings) if self.score_function == "cos_sim" else embeddings
+
+    def search(self, query_embeddings: np.ndarray, corpus_embeddings: np.ndarray, top_k: int,
+               query_ids: List[str], corpus_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        As in BEIR, a doc is never retrieved for a query with the same id.
+
+        Returns:
+            (n_queries, top_k) int32 positions in corpus_ids, sorted by descending score, and their float32 scores.
+        """
+        corpus_index = {id: i for i, id in enumerate(corpus_ids)}
+        identical = np.array([corpus_index.get(id, -1) for id in query_ids], dtype=np.int64)
+        top_k = min(top_k, len(corpus_ids))
+        tile = self.tile_size(len(corpus_ids), top_k, corpus_embeddings.shape[1])
+
+        indices = np.empty((len(query_ids), top_k), dtype=np.int32)
+        scores = np.empty((len(query_ids), top_k), dtype=np.float32)
+
+        def search_block(start: int):
+            end = min(start + self.query_block_size, len(query_ids))
+            queries = self.prepare(query_embeddings[start:end])
+            rows = np.arange(end - start)
+            block_identical = identical[start:end]
+
+            best_indices = np.empty((end - start, 0), dtype=np.int64)
+            best_scores = np.empty((end - start, 0), dtype=np.float32)
+            for tile_start in range(0, len(corpus_ids), tile):
+                tile_end = min(tile_start + tile, len(corpus_ids))
+                tile_scores = queries @ self.prepare(corpus_embeddings[tile_start:tile_end]).T
+
+                in_tile = (block_identical >= tile_start) & (block_identical < tile_end)
+                tile_scores[rows[in_tile], block_identical[in_tile] - tile_start] = -np.inf
+
+                tile_indices, tile_scores = merge_top_k(
+                    np.broadcast_to(np.arange(tile_start, tile_end), tile_scores.shape), tile_scores, top_k
+                )
+                best_indices, best_scores = merge_top_k(
+                    np.concatenate([best_indices, tile_indices], axis=1),
+                    np.concatenate([best_scores, tile_scores], axis=1),
+                    top_k
+                )
+
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            indices[start:end] = np.take_along_axis(best_indices, order, axis=1)
+            scores[start:end] = np.take_along_axis(best_scores, order, axis=1)
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            list(executor.map(search_block, range(0, len(query_ids), self.query_block_size)))
+
+        # a query's own doc is only scored -inf, it is padding when top_k reaches it
+        indices[~np.isfinite(scores)] = -1
+        return indices, scores
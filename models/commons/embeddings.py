@@ -0,0 +1,174 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Callable, Dict, List
+
+EMBEDDINGS_FILE = "embeddings.npy"
+IDS_FILE = "ids.txt"
+HASHES_FILE = "hashes.txt"
+# names the directory of the current matrix, ids and hashes, replaced at once by an update
+CURRENT_FILE = "CURRENT"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class GatheredRows:
+    """
+    Rows of a memory-mapped matrix in another order, read and copied only when a
+    block of them is indexed, e.g. by the tiles of a dense search.
+    """
+
+    def __init__(self, matrix: np.ndarray, rows: np.ndarray):
+        self.matrix = matrix
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def shape(self):
+        return (len(self.rows),) + self.matrix.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.matrix.dtype
+
+    def __getitem__(self, key) -> np.ndarray:
+        return np.asarray(self.matrix[self.rows[key]])
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+class EmbeddingStore:
+    """
+    Memory-mapped embeddings keyed by id and content hash. Only texts that are new
+    or changed since the last update are encoded again.
+
+    Each update writes the matrix, ids and hashes to a new directory of the store, then
+    points the CURRENT file to it with an atomic rename, so a crash or a concurrent
+    update never leaves a matrix with the ids or hashes of another.
+    """
+
+    def __init__(self, path: str, dtype: str = "float32"):
+        """
+        Parameters:
+            path (str): Directory of the store, one per encoder.
+            dtype (str): Storage type of the embeddings, "float32" or "float16".
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.ids, self.hashes, self.embeddings = [], [], None
+        self.current = self.current_path()
+
+        if self.current is not None:
+            self.embeddings = np.load(os.path.join(self.current, EMBEDDINGS_FILE), mmap_mode="r")
+            with open(os.path.join(self.current, IDS_FILE)) as f:
+                self.ids = f.read().splitlines()
+            with open(os.path.join(self.current, HASHES_FILE)) as f:
+                self.hashes = f.read().splitlines()
+
+        self.index = {id: i for i, id in enumerate(self.ids)}
+
+    def current_path(self) -> str:
+        """
+        Directory of the stored files, the store itself for stores written before CURRENT, None when empty.
+        """
+        current_file = os.path.join(self.path, CURRENT_FILE)
+        if os.path.exists(current_file):
+            with open(current_file) as f:
+                return os.path.join(self.path, f.read().strip())
+        if os.path.exists(os.path.join(self.path, EMBEDDINGS_FILE)):
+            return self.path
+        return None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self, texts: Dict[str, str], encode: Callable[[List[str]], np.ndarray]):
+        """
+        Encodes the texts whose id is missing from the store or whose content changed.
+        Every text is encoded again when the store was written with another dtype.
+
+        Parameters:
+            texts (Dict[str, str]): Texts by id.
+            encode (Callable): Encodes a list of texts into a (n, dim) matrix.
+        """
+        hashes = {id: content_hash(text) for id, text in texts.items()}
+        retyped = self.embeddings is not None and self.embeddings.dtype != self.dtype
+        stale = [
+            id for id, hash in hashes.items()
+            if retyped or id not in self.index or self.hashes[self.index[id]] != hash
+        ]
+        if not stale:
+            return
+
+        if retyped:
+            print(f"The store in {self.path} holds {self.embeddings.dtype} embeddings, encoding them again as {self.dtype}")
+        print(f"Encoding {len(stale)} of {len(texts)} texts, the others are stored in {self.path}")
+        vectors = np.asarray(encode([texts[id] for id in stale]), dtype=self.dtype)
+
+        ids, stored_hashes = list(self.ids), list(self.hashes)
+        index = dict(self.index)
+        for id in stale:
+            if id not in index:
+                index[id] = len(ids)
+                ids.append(id)
+                stored_hashes.append(None)
+            stored_hashes[index[id]] = hashes[id]
+
+        # every file is written to a new directory, the rows stored are copied in chunks
+        os.makedirs(self.path, exist_ok=True)
+        generation = tempfile.mkdtemp(prefix="generation-", dir=self.path)
+        embeddings = np.lib.format.open_memmap(
+            os.path.join(generation, EMBEDDINGS_FILE), mode="w+", dtype=self.dtype, shape=(len(ids), vectors.shape[1])
+        )
+        if self.embeddings is not None:
+            for start in range(0, len(self.embeddings), 65536):
+                end = min(start + 65536, len(self.embeddings))
+                embeddings[start:end] = self.embeddings[start:end]
+        embeddings[[index[id] for id in stale]] = vectors
+        embeddings.flush()
+        del embeddings
+        with open(os.path.join(generation, IDS_FILE), "w") as f:
+            f.write("\n".join(ids))
+        with open(os.path.join(generation, HASHES_FILE), "w") as f:
+            f.write("\n".join(stored_hashes))
+
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{CURRENT_FILE}.", dir=self.path)
+        with os.fdopen(fd, "w") as f:
+            f.write(os.path.basename(generation))
+        os.replace(tmp_path, os.path.join(self.path, CURRENT_FILE))
+
+        # the files replaced are removed, the ones of a store written before CURRENT included
+        previous = self.current
+        if previous == self.path:
+            for name in (EMBEDDINGS_FILE, IDS_FILE, HASHES_FILE):
+                if os.path.exists(os.path.join(self.path, name)):
+                    os.remove(os.path.join(self.path, name))
+        elif previous is not None:
+            shutil.rmtree(previous, ignore_errors=True)
+
+        self.ids, self.hashes, self.index, self.current = ids, stored_hashes, index, generation
+        self.embeddings = np.load(os.path.join(generation, EMBEDDINGS_FILE), mmap_mode="r")
+
+    def get(self, ids: List[str]) -> np.ndarray:
+        """
+        Returns the (len(ids), dim) embeddings of ids, as float32.
+        """
+        return np.asarray(self.embeddings[[self.index[id] for id in ids]], dtype=np.float32)
+
+    def view(self, ids: List[str]):
+        """
+        Returns the embeddings of ids without copying them: the memory-mapped rows when
+        they are stored contiguously and in order, else rows gathered block by block as
+        they are indexed. Blocks keep the storage type.
+        """
+        rows = np.fromiter((self.index[id] for id in ids), dtype=np.int64, count=len(ids))
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return self.embeddings[rows[0]:rows[0] + len(rows)]
+        return GatheredRows(self.embeddings, rows)
@@ -0,0 +1,220 @@
+import contextvars
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import pandas as pd
+from contextlib import contextmanager
+from typing import Dict, List
+
+# labels of the enclosing stages, inherited by the nested ones
+_labels = contextvars.ContextVar("labels", default={})
+
+
+def current_labels() -> dict:
+    """
+    Labels of the innermost open stage.
+    """
+    return _labels.get()
+
+
+def rss_bytes() -> int:
+    """
+    Current resident set size, the peak so far when /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def io_bytes() -> Dict[str, int]:
+    """
+    Bytes read and written by this process through system calls, zero when /proc is not available.
+    """
+    counters = {"rchar": 0, "wchar": 0}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                name, value = line.split(":")
+                if name in counters:
+                    counters[name] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def cpu_seconds() -> float:
+    """
+    CPU time of this process and of its finished children, such as the UDLF binary.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def environment(labels: dict) -> str:
+    """
+    Environment of the labels as named in final_results.csv, e.g. "scifact+BM25+CPRR".
+    """
+    return "+".join(str(labels[key]) for key in ("dataset", "model", "method") if labels.get(key))
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time, RSS at the start, peak RSS and bytes read/written of each stage.
+
+    A background thread samples the RSS while stages are open, so each stage gets
+    its own peak. Records are exported as a CSV to join with final_results.csv on
+    Environment, or as a Chrome trace to open in chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, sample_interval: float = 0.02):
+        """
+        Parameters:
+            sample_interval (float): Seconds between two RSS samples.
+        """
+        self.sample_interval = sample_interval
+        self.enabled = True
+        self.records = []
+        self.open = []
+        self.lock = threading.Lock()
+        self.sampler = None
+
+    def sample(self):
+        while True:
+            time.sleep(self.sample_interval)
+            with self.lock:
+                if not self.open:
+                    continue
+                rss = rss_bytes()
+                for record in self.open:
+                    record["peak_rss_bytes"] = max(record["peak_rss_bytes"], rss)
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """
+        Records the enclosed block as a stage, labelled with the given labels and the ones of the enclosing stages.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        labels = {**_labels.get(), **{key: value for key, value in labels.items() if value is not None}}
+        token = _labels.set(labels)
+        if self.sampler is None:
+            self.sampler = threading.Thread(target=self.sample, daemon=True)
+            self.sampler.start()
+
+        record = {
+            "stage": name,
+            **labels,
+            "pid": os.getpid(),
+            "thread": threading.get_ident(),
+            "start": time.time(),
+            "start_rss_bytes": rss_bytes()
+        }
+        record["peak_rss_bytes"] = record["start_rss_bytes"]
+        io_start, cpu_start, wall_start = io_bytes(), cpu_seconds(), time.perf_counter()
+        with self.lock:
+            self.open.append(record)
+
+        try:
+            yield
+        finally:
+            io_end = io_bytes()
+            record["wall_seconds"] = time.perf_counter() - wall_start
+            record["cpu_seconds"] = cpu_seconds() - cpu_start
+            record["bytes_read"] = io_end["rchar"] - io_start["rchar"]
+            record["bytes_written"] = io_end["wchar"] - io_start["wchar"]
+            record["peak_rss_bytes"] = max(record["peak_rss_bytes"], rss_bytes())
+            record["Environment"] = environment(labels)
+            with self.lock:
+                self.open.remove(record)
+                self.records.append(record)
+            _labels.reset(token)
+
+    def reset(self):
+        """
+        Forgets every record, and the sampler thread, in a forked child, where the sampler
+        did not survive the fork. The lock is created again instead of acquired, as the
+        sampler may have held it at the time of the fork.
+        """
+        self.lock = threading.Lock()
+        self.records, self.open, self.sampler = [], [], None
+
+    def extend(self, records: List[dict]):
+        """
+        Adds the records of another process, e.g. of a sweep worker.
+        """
+        with self.lock:
+            self.records.extend(records)
+
+    def take(self) -> List[dict]:
+        """
+        Returns the records and forgets them.
+        """
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+    def dataframe(self) -> pd.DataFrame:
+        columns = ["Environment", "stage", "dataset", "model", "method", "wall_seconds", "cpu_seconds",
+                   "start_rss_bytes", "peak_rss_bytes", "bytes_read", "bytes_written", "start", "pid"]
+        dataframe = pd.DataFrame(self.records)
+        return dataframe.reindex(columns=columns)
+
+    def export_csv(self, path: str):
+        """
+        Appends the records to a CSV, the companion of a results CSV across resumed runs.
+        """
+        dataframe = self.dataframe()
+        header = not os.path.exists(path) or os.path.getsize(path) == 0
+        dataframe.to_csv(path, mode="a", header=header, index=False)
+
+    def export_chrome_trace(self, path: str):
+        """
+        Writes the records in the Chrome trace event format, one complete event per stage.
+        """
+        events = [{
+            "name": record["stage"],
+            "cat": record["Environment"] or "stage",
+            "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": record["wall_seconds"] * 1e6,
+            "pid": record["pid"],
+            "tid": record["thread"],
+            "args": {key: record[key] for key in (
+                "Environment", "cpu_seconds", "start_rss_bytes", "peak_rss_bytes", "bytes_read", "bytes_written"
+            )}
+        } for record in self.records]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+PROFILER = Profiler()
+# forked workers, e.g. of a sweep, start with no records and a lock of their own
+os.register_at_fork(after_in_child=PROFILER.reset)
+
+
+def stage(name: str, **labels):
+    """
+    Records a block as a stage of the shared profiler.
+    """
+    return PROFILER.stage(name, **labels)
+
+
+def instrumented(name: str):
+    """
+    Records each call of a model method as a stage, labelled with the dataset and
+    name of the model it is called on.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            with PROFILER.stage(name, dataset=getattr(self, "dataset_name", None), model=getattr(self, "name", None)):
+                return function(self, *args, **kwargs)
+        return wrapper
+    return decorator
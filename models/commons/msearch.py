@@ -0,0 +1,134 @@
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+
+class MultiSearch:
+    """
+    Sends lexical queries to Elasticsearch as _msearch batches, several batches at a
+    time over the pooled connections of one client. Failed batches, and failed items
+    of a batch, are retried with exponential backoff.
+    """
+
+    def __init__(self, client, index_name: str, title_key: str = "title", text_key: str = "txt",
+                 batch_size: int = 128, concurrency: int = 4, max_retries: int = 3, backoff: float = 1.0):
+        """
+        Parameters:
+            client: Elasticsearch client, its connection pool should hold at least concurrency connections.
+            index_name (str): Index to search.
+            title_key (str): Title field, as indexed by BEIR.
+            text_key (str): Text field, as indexed by BEIR.
+            batch_size (int): Queries per _msearch request. Default is 128.
+            concurrency (int): Requests in flight. Default is 4.
+            max_retries (int): Retries of a failed request or item. Default is 3.
+            backoff (float): Seconds before the first retry, doubled on each one. Default is 1.
+        """
+        self.client = client
+        self.index_name = index_name
+        self.title_key = title_key
+        self.text_key = text_key
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.latencies = []
+        self.elapsed = 0.0
+        self.queries = 0
+
+    def request(self, texts: List[str], top_hits: int) -> list:
+        # same query as BEIR's lexical_multisearch
+        request = []
+        for text in texts:
+            request.append({"index": self.index_name, "search_type": "dfs_query_then_fetch"})
+            request.append({
+                "_source": False,
+                "query": {
+                    "multi_match": {
+                        "query": text,
+                        "type": "best_fields",
+                        "fields": [self.text_key, self.title_key],
+                        "tie_breaker": 0.5
+                    }
+                },
+                "size": top_hits
+            })
+        return request
+
+    def search_batch(self, texts: List[str], top_hits: int) -> List[List[Tuple[str, float]]]:
+        start = time.perf_counter()
+        try:
+            return self.send(texts, top_hits)
+        finally:
+            # one latency per batch, its retries and their backoff included
+            self.latencies.append(time.perf_counter() - start)
+
+    def send(self, texts: List[str], top_hits: int) -> List[List[Tuple[str, float]]]:
+        """
+        Searches a batch, retrying the request or its failed items.
+
+        Raises:
+            RuntimeError: Some queries still failed after max_retries retries.
+        """
+        hits = [None] * len(texts)
+        pending = list(range(len(texts)))
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                responses = self.client.msearch(body=self.request([texts[i] for i in pending], top_hits))["responses"]
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Retrying _msearch of {len(pending)} queries after error: {e}")
+                continue
+
+            failed = []
+            for i, response in zip(pending, responses):
+                if "error" in response:
+                    failed.append(i)
+                else:
+                    hits[i] = [(hit["_id"], hit["_score"]) for hit in response["hits"]["hits"]]
+
+            pending = failed
+            if not pending:
+                return hits
+
+            print(f"Retrying {len(pending)} failed queries of a _msearch batch")
+
+        raise RuntimeError(f"{len(pending)} queries failed after {self.max_retries} retries")
+
+    def search(self, texts: List[str], top_hits: int) -> List[List[Tuple[str, float]]]:
+        """
+        Returns the (doc_id, score) hits of each text, in order.
+        """
+        return list(self.search_iter(texts, top_hits))
+
+    def search_iter(self, texts: List[str], top_hits: int) -> Iterator[List[Tuple[str, float]]]:
+        """
+        Yields the (doc_id, score) hits of each text, in order, as their batches complete,
+        so a batch is released once its hits are consumed.
+        """
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for batch in executor.map(lambda batch: self.search_batch(batch, top_hits), batches):
+                yield from batch
+        self.elapsed += time.perf_counter() - start
+        self.queries += len(texts)
+
+    @property
+    def stats(self) -> dict:
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "queries": self.queries,
+            "batches": len(self.latencies),
+            "seconds": self.elapsed,
+            "queries_per_second": self.queries / self.elapsed if self.elapsed else 0.0,
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            "latency_p90_ms": float(np.percentile(latencies, 90)) if len(latencies) else 0.0,
+            "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0.0
+        }
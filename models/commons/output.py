@@ -1,8 +1,10 @@
 import pandas as pd
 import time
+from models.commons.instrumentation import instrumented
 
 
 class CommonOutput:
+    @instrumented("dataframe")
     def dataframe(self, method: str = None):
         # Flatten the nested dictionaries
         environment = f"{self.dataset.dataset_name}+{self.name}{'+' + method if method else ''}"
@@ -0,0 +1,138 @@
+from functools import lru_cache
+
+# Porter's stemmer as in Martin Porter's reference C implementation, which Lucene's
+# PorterStemFilter ports and the english analyzer of the BEIR Elasticsearch index uses.
+# Each rule list is tried in order and only the first suffix the word ends with applies.
+STEP_2 = [
+    ("ational", "ate"), ("tional", "tion"), ("enci", "ence"), ("anci", "ance"), ("izer", "ize"),
+    ("bli", "ble"), ("alli", "al"), ("entli", "ent"), ("eli", "e"), ("ousli", "ous"),
+    ("ization", "ize"), ("ation", "ate"), ("ator", "ate"), ("alism", "al"), ("iveness", "ive"),
+    ("fulness", "ful"), ("ousness", "ous"), ("aliti", "al"), ("iviti", "ive"), ("biliti", "ble"),
+    ("logi", "log")
+]
+STEP_3 = [
+    ("icate", "ic"), ("ative", ""), ("alize", "al"), ("iciti", "ic"), ("ical", "ic"), ("ful", ""),
+    ("ness", "")
+]
+STEP_4 = [
+    "al", "ance", "ence", "er", "ic", "able", "ible", "ant", "ement", "ment", "ent", "ion", "ou",
+    "ism", "ate", "iti", "ous", "ive", "ize"
+]
+
+
+def is_consonant(word: str, i: int) -> bool:
+    if word[i] in "aeiou":
+        return False
+    if word[i] == "y":
+        return i == 0 or not is_consonant(word, i - 1)
+    return True
+
+
+def measure(stem: str) -> int:
+    """
+    Number of vowel-consonant sequences m of the stem, written [C](VC)^m[V].
+    """
+    m, i = 0, 0
+    while i < len(stem) and is_consonant(stem, i):
+        i += 1
+    while i < len(stem):
+        while i < len(stem) and not is_consonant(stem, i):
+            i += 1
+        if i == len(stem):
+            break
+        while i < len(stem) and is_consonant(stem, i):
+            i += 1
+        m += 1
+    return m
+
+
+def has_vowel(stem: str) -> bool:
+    return any(not is_consonant(stem, i) for i in range(len(stem)))
+
+
+def ends_double_consonant(word: str) -> bool:
+    return len(word) > 1 and word[-1] == word[-2] and is_consonant(word, len(word) - 1)
+
+
+def ends_cvc(word: str) -> bool:
+    """
+    Whether the word ends consonant-vowel-consonant, the last not w, x or y.
+    """
+    n = len(word)
+    return (
+        n > 2 and is_consonant(word, n - 1) and not is_consonant(word, n - 2) and is_consonant(word, n - 3)
+        and word[-1] not in "wxy"
+    )
+
+
+def replace_suffix(word: str, rules: list, min_measure: int) -> str:
+    for suffix, replacement in rules:
+        if word.endswith(suffix):
+            stem = word[:len(word) - len(suffix)]
+            return stem + replacement if measure(stem) > min_measure else word
+    return word
+
+
+def step_1(word: str) -> str:
+    if word.endswith("sses"):
+        word = word[:-2]
+    elif word.endswith("ies"):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+
+    if word.endswith("eed"):
+        if measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        for suffix in ("ed", "ing"):
+            stem = word[:len(word) - len(suffix)]
+            if word.endswith(suffix) and has_vowel(stem):
+                if stem.endswith(("at", "bl", "iz")):
+                    word = stem + "e"
+                elif ends_double_consonant(stem):
+                    word = stem if stem[-1] in "lsz" else stem[:-1]
+                elif measure(stem) == 1 and ends_cvc(stem):
+                    word = stem + "e"
+                else:
+                    word = stem
+                break
+
+    if word.endswith("y") and has_vowel(word[:-1]):
+        word = word[:-1] + "i"
+    return word
+
+
+def step_4(word: str) -> str:
+    for suffix in STEP_4:
+        if word.endswith(suffix):
+            stem = word[:len(word) - len(suffix)]
+            # -ion is only removed after s or t
+            if suffix == "ion" and not stem.endswith(("s", "t")):
+                continue
+            return stem if measure(stem) > 1 else word
+    return word
+
+
+def step_5(word: str) -> str:
+    if word.endswith("e"):
+        m = measure(word[:-1])
+        if m > 1 or (m == 1 and not ends_cvc(word[:-1])):
+            word = word[:-1]
+    if word.endswith("ll") and measure(word) > 1:
+        word = word[:-1]
+    return word
+
+
+@lru_cache(maxsize=1 << 16)
+def porter_stem(token: str) -> str:
+    """
+    Porter stem of a lowercase token, tokens of up to two letters are kept.
+    """
+    if len(token) <= 2:
+        return token
+    word = step_1(token)
+    word = replace_suffix(word, STEP_2, 0)
+    word = replace_suffix(word, STEP_3, 0)
+    word = step_4(word)
+    return step_5(word)
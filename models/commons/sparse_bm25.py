@@ -0,0 +1,152 @@
+import re
+import numpy as np
+from collections import Counter
+from scipy import sparse
+from typing import Callable, Dict, List, Tuple
+from models.commons.porter import porter_stem
+
+# Lucene's english analyzer stop words, used by the Elasticsearch index of BEIR
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with"
+}
+TOKEN = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+
+
+def tokenize(text: str, stemmer: Callable[[str], str] = porter_stem) -> List[str]:
+    tokens = []
+    for token in TOKEN.findall(text.lower()):
+        if token.endswith("'s"):
+            token = token[:-2]
+        if token and token not in STOPWORDS:
+            tokens.append(stemmer(token))
+    return tokens
+
+
+def top_k_sparse(scores: sparse.csr_matrix, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k columns of each row of a sparse score matrix, sorted by descending score.
+    Ties keep the column order, rows with less than top_k matches are padded with -1.
+    """
+    scores.sort_indices()
+    rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+    order = np.lexsort((-scores.data, rows))
+    positions = np.arange(len(order)) - scores.indptr[rows]
+    keep = positions < top_k
+
+    indices = np.full((scores.shape[0], top_k), -1, dtype=np.int32)
+    top_scores = np.full((scores.shape[0], top_k), -np.inf, dtype=np.float32)
+    indices[rows[keep], positions[keep]] = scores.indices[order[keep]]
+    top_scores[rows[keep], positions[keep]] = scores.data[order[keep]]
+    return indices, top_scores
+
+
+class SparseBM25:
+    """
+    In-process BM25 over a CSR term-document matrix per field. Scores follow the
+    Elasticsearch setup of BEIR: Lucene BM25 on the title and text fields combined
+    as a best_fields multi_match, the best field plus tie_breaker times the other.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, tie_breaker: float = 0.5,
+                 stemmer: Callable[[str], str] = porter_stem, batch_size: int = 256):
+        """
+        Parameters:
+            k1 (float): Term frequency saturation. Default is 1.2, as in Elasticsearch.
+            b (float): Length normalization. Default is 0.75, as in Elasticsearch.
+            tie_breaker (float): Weight of the field that is not the best. Default is 0.5, as in BEIR.
+            stemmer (Callable): Token stemmer. Default is Porter's, as in the english analyzer of Elasticsearch.
+            batch_size (int): Queries scored per sparse product.
+        """
+        self.k1 = k1
+        self.b = b
+        self.tie_breaker = tie_breaker
+        self.stemmer = stemmer
+        self.batch_size = batch_size
+        self.fields = ["title", "text"]
+        self.vocabulary, self.doc_ids, self.weights = {}, [], {}
+
+    def term_counts(self, texts: List[str], grow: bool) -> sparse.csr_matrix:
+        """
+        (len(texts), vocabulary) term count matrix, unknown terms are added when grow is set.
+        """
+        rows, cols, counts = [], [], []
+        for i, text in enumerate(texts):
+            for term, count in Counter(tokenize(text, self.stemmer)).items():
+                if term not in self.vocabulary:
+                    if not grow:
+                        continue
+                    self.vocabulary[term] = len(self.vocabulary)
+                rows.append(i)
+                cols.append(self.vocabulary[term])
+                counts.append(count)
+        return sparse.csr_matrix(
+            (np.array(counts, dtype=np.float32), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+            shape=(len(texts), len(self.vocabulary))
+        )
+
+    def fit(self, corpus: Dict[str, Dict[str, str]]):
+        """
+        Indexes the corpus, storing per field the (vocabulary, docs) matrix of BM25 term weights.
+        """
+        self.doc_ids = list(corpus.keys())
+        counts = {
+            field: self.term_counts([doc.get(field) or "" for doc in corpus.values()], grow=True)
+            for field in self.fields
+        }
+
+        for field, tf in counts.items():
+            tf.resize((len(self.doc_ids), len(self.vocabulary)))
+            lengths = np.asarray(tf.sum(axis=1)).ravel()
+            average_length = lengths.mean() if lengths.mean() > 0 else 1
+            df = np.bincount(tf.indices, minlength=len(self.vocabulary))
+            idf = np.log(1 + (len(self.doc_ids) - df + 0.5) / (df + 0.5))
+
+            rows = np.repeat(np.arange(tf.shape[0]), np.diff(tf.indptr))
+            norm = self.k1 * (1 - self.b + self.b * lengths[rows] / average_length)
+            tf.data = (idf[tf.indices] * tf.data / (tf.data + norm)).astype(np.float32)
+            self.weights[field] = tf.T.tocsr()
+
+        print(f"Indexed {len(self.doc_ids)} docs with {len(self.vocabulary)} terms")
+
+    def search(self, queries: List[str], query_ids: List[str], top_k: int,
+               doc_ids: List[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        As in BEIR, a doc is never retrieved for a query with the same id.
+
+        Parameters:
+            doc_ids (List[str]): Only these indexed docs are searched, scored with the
+                statistics of the whole index. Default searches every doc.
+
+        Returns:
+            (n_queries, top_k) int32 positions in doc_ids, padded with -1, and their float32 scores.
+        """
+        weights = self.weights
+        if doc_ids is None:
+            doc_ids = self.doc_ids
+        else:
+            index = {id: i for i, id in enumerate(self.doc_ids)}
+            columns = np.array([index[id] for id in doc_ids], dtype=np.int64)
+            weights = {field: matrix[:, columns] for field, matrix in self.weights.items()}
+
+        doc_index = {id: i for i, id in enumerate(doc_ids)}
+        identical = np.array([doc_index.get(id, -1) for id in query_ids], dtype=np.int64)
+
+        indices = np.empty((len(queries), top_k), dtype=np.int32)
+        scores = np.empty((len(queries), top_k), dtype=np.float32)
+        for start in range(0, len(queries), self.batch_size):
+            end = min(start + self.batch_size, len(queries))
+            terms = self.term_counts(queries[start:end], grow=False)
+            title, text = (terms @ weights[field] for field in self.fields)
+
+            # best_fields: max(title, text) + tie_breaker * min(title, text)
+            batch_scores = (title.maximum(text) * (1 - self.tie_breaker) + (title + text) * self.tie_breaker).tocsr()
+
+            rows = np.repeat(np.arange(end - start), np.diff(batch_scores.indptr))
+            batch_scores.data[batch_scores.indices == identical[start:end][rows]] = 0
+            batch_scores.eliminate_zeros()
+
+            indices[start:end], scores[start:end] = top_k_sparse(batch_scores, top_k)
+
+        return indices, scores
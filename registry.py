@@ -0,0 +1,59 @@
+import importlib
+
+# "module:attribute" of each component, its module is only imported once the
+# component is selected, so a BM25-only run never imports torch through SBERT
+DATASETS = {
+    "scifact": "local_datasets.beir_datasets:SciFact",
+    "scidocs": "local_datasets.beir_datasets:SciDocs",
+    "nfcorpus": "local_datasets.beir_datasets:NFCorpus",
+    "fiqa": "local_datasets.beir_datasets:FIQA",
+    "arguana": "local_datasets.beir_datasets:ArguAna",
+    "trec-covid": "local_datasets.beir_datasets:TRECCOVID",
+    "quora": "local_datasets.beir_datasets:Quora",
+    "webis-touche2020": "local_datasets.beir_datasets:WebisTouche2020",
+}
+
+MODELS = {
+    "bm25": "models.BM25:BM25Model",
+    "sbert": "models.SBERT:SBERTModel",
+    "fusion": "models.Fusion:FusionModel",
+}
+
+METHODS = {
+    "CPRR": "udl.methods.CPRR:CPRRMethod",
+    "LHRR": "udl.methods.LHRR:LHRRMethod",
+    "RDPAC": "udl.methods.RDPAC:RDPACMethod",
+}
+
+
+def validate(registry: dict, names, kind: str):
+    """
+    Raises a ValueError naming the unknown components, without importing any of them.
+    """
+    unknown = [name for name in names if name not in registry]
+    if unknown:
+        raise ValueError(f"Unknown {kind} {', '.join(unknown)}, choose from {', '.join(registry)}")
+
+
+def resolve(registry: dict, name: str, kind: str = "component"):
+    """
+    Imports and returns the class registered under name.
+    """
+    validate(registry, [name], kind)
+    module_name, attribute = registry[name].split(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def create_dataset(name: str):
+    """
+    Builds a dataset, which downloads and loads it.
+    """
+    return resolve(DATASETS, name, "dataset")()
+
+
+def create_model(name: str, dataset, k_values: list, **params):
+    return resolve(MODELS, name, "model")(dataset, k_values, **params)
+
+
+def create_method(name: str, **params):
+    return resolve(METHODS, name, "method")(**params)
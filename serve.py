@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import registry
+
+# HTTP front end of udl.serving.QueryService, on asyncio streams only:
+#   GET  /search?q=<text>&k=10&budget_ms=100
+#   POST /search  {"query": "<text>", "k": 10, "budget_ms": 100}
+#   GET  /metrics, GET /health
+
+MAX_BODY_BYTES = 1 << 20
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_request(reader: asyncio.StreamReader):
+    """
+    Reads one HTTP/1.1 request, returns its method, target, headers and body, or None when the client left.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"Bodies are limited to {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, headers, body
+
+
+def write_response(writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool):
+    body = json.dumps(payload).encode()
+    writer.write((
+        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    ).encode() + body)
+
+
+class Server:
+    """
+    Answers the requests of each connection in turn, running the searches on a
+    thread pool so the event loop keeps accepting and reading other connections.
+    """
+
+    def __init__(self, service, workers: int = None):
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+
+    async def route(self, method: str, target: str, body: bytes) -> dict:
+        url = urlsplit(target)
+        if url.path == "/health":
+            return {"status": "ok"}
+        if url.path == "/metrics":
+            return self.service.metrics()
+        if url.path != "/search":
+            raise HTTPError(404, f"No route {url.path}")
+
+        if method == "POST":
+            try:
+                params = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                raise HTTPError(400, "The body is not JSON")
+            if not isinstance(params, dict):
+                raise HTTPError(400, "The body must be a JSON object")
+        else:
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            params["query"] = params.pop("q", None)
+        if not params.get("query"):
+            raise HTTPError(400, "A query is required")
+        if not isinstance(params["query"], str):
+            raise HTTPError(400, "The query must be a string")
+
+        try:
+            top_k = int(params.get("k", 10))
+            budget_ms = float(params["budget_ms"]) if params.get("budget_ms") is not None else None
+        except (TypeError, ValueError):
+            raise HTTPError(400, "k and budget_ms must be numbers")
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.service.search, params["query"], top_k, budget_ms)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, payload = 200, await self.route(method, target, body)
+                except HTTPError as error:
+                    keep_alive = False
+                    status, payload = error.status, {"error": str(error)}
+                except Exception as error:
+                    keep_alive = False
+                    status, payload = 500, {"error": repr(error)}
+
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serves queries with the precomputed UDLF re-ranking of a dataset.")
+    parser.add_argument("--dataset", default="scifact", help=f"One of {', '.join(registry.DATASETS)}.")
+    parser.add_argument("--model", default="bm25", help=f"One of {', '.join(registry.MODELS)}.")
+    parser.add_argument("--model-params", default="{}", help="JSON parameters of the model, e.g. '{\"backend\": \"sparse\"}'.")
+    parser.add_argument("--method", default="CPRR", help=f"One of {', '.join(registry.METHODS)}, run for the neighbour graph.")
+    parser.add_argument("--backend", choices=["binary", "native"], default="binary",
+                        help="Runs the method with the UDLF binary, or in-process for a graph built without it.")
+    parser.add_argument("--serving-dir", default=None, help="Directory of the neighbour graphs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None, help="Threads running searches. Default is the cores.")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Default latency budget of a query.")
+    parser.add_argument("--depth", type=int, default=100, help="Items retrieved for each query.")
+    parser.add_argument("--expansion", type=int, default=10, help="Refined lists used to re-rank each query.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    registry.validate(registry.DATASETS, [args.dataset], "dataset")
+    registry.validate(registry.MODELS, [args.model], "model")
+    registry.validate(registry.METHODS, [args.method], "method")
+
+    from main import check_binary_path, k_values, methods
+    from experiment import label, safe_name
+    from udl.udlf import UDLF
+    from udl.serving import DEFAULT_SERVING_DIR, LatencyStats, QueryService
+    from models.commons.cache import RetrievalCache
+
+    if args.backend == "binary":
+        UDLF.set_binary_path(check_binary_path())
+    UDLF.set_cache(RetrievalCache())
+    dataset = registry.create_dataset(args.dataset)
+    model_params = json.loads(args.model_params)
+    model = registry.create_model(args.model, dataset, k_values, **model_params)
+
+    # parameters of main.py when it lists the method
+    params = next((params for name, params in methods.values() if name == args.method), {})
+    config = registry.create_method(args.method, **{**params, "backend": args.backend})
+
+    graph_path = os.path.join(
+        args.serving_dir or DEFAULT_SERVING_DIR, safe_name(args.dataset), safe_name(label(args.model, model_params)),
+        safe_name(args.method)
+    )
+    graph = QueryService.build_graph(model, config, graph_path)
+    service = QueryService(model, graph, depth=args.depth, expansion=args.expansion, budget_ms=args.budget_ms)
+
+    # the first search loads the retrieval index or encoder, before any request waits on it
+    service.search("warm up")
+    service.stats = LatencyStats()
+    asyncio.run(Server(service, args.workers).serve(args.host, args.port))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
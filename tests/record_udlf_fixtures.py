@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from udl.ranked_lists import RankedLists
+from udl.methods.CPRR import CPRRMethod
+from udl.methods.LHRR import LHRRMethod
+from udl.methods.RDPAC import RDPACMethod
+
+# Records the output of the UDLF binary for the native backend tests:
+#   UDLF_BINARY_PATH=/path/to/udlf UDLF_CONFIG_PATH=/path/to/config.ini python tests/record_udlf_fixtures.py
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "udlf")
+RANKED_LIST_FILE = "ranked_list.txt"
+LISTS_FILE = "lists.txt"
+
+# method configs whose binary output is recorded, by fixture name
+METHODS = {
+    "CPRR": CPRRMethod(l=30, k=5, t=2),
+    "LHRR": LHRRMethod(l=30, k=5, t=2),
+    "RDPAC": RDPACMethod(l=15, k_start=1, k_end=5, k_inc=1, l_mult=2, p=0.6, pl=0.99)
+}
+
+
+def fixture_clusters(n: int = 200, clusters: int = 10, seed: int = 7):
+    """
+    Noisy points around random centers, and the cluster of each.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, 16))
+    labels = rng.integers(clusters, size=n)
+    return centers[labels] + rng.normal(scale=1.2, size=(n, 16)), labels
+
+
+def fixture_ranked_lists(n: int = 200, width: int = 40, clusters: int = 10, seed: int = 7) -> RankedLists:
+    """
+    Noisy clustered ranked lists, each query first in its own list, as the UDLF input.
+    """
+    points, _ = fixture_clusters(n, clusters, seed)
+    distances = ((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+    ranks = np.argsort(distances, axis=1, kind="stable")[:, :width].astype(np.int32)
+    return RankedLists.from_positions([f"d{i:04d}" for i in range(n)], ranks)
+
+
+def fixture_path(name: str, fixtures_dir: str = FIXTURES_DIR) -> str:
+    return os.path.join(fixtures_dir, f"{name}.txt")
+
+
+def record(binary_path: str, config_path: str, fixtures_dir: str = FIXTURES_DIR):
+    """
+    Runs the UDLF binary with each method config over the fixture ranked lists and keeps
+    its output in fixtures_dir, next to the ranked lists it read.
+    """
+    from udl.driver import UDLFDriver, UDLFJob
+    from udl.helpers.config import UDLFConfigHelper
+    from udl.input_type import InputType
+    from pyUDLF import run_calls as udlf
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+    ranked_list_path = os.path.join(fixtures_dir, RANKED_LIST_FILE)
+    lists_path = os.path.join(fixtures_dir, LISTS_FILE)
+    results = fixture_ranked_lists()
+    size = results.to_text(ranked_list_path, lists_path, query_first=True)
+
+    udlf.setBinaryPath(binary_path)
+    udlf.setConfigPath(config_path)
+    jobs = []
+    for name, config in METHODS.items():
+        udlf_config = InputType()
+        params = UDLFConfigHelper.create_config(
+            size=size,
+            ranked_list_path=ranked_list_path,
+            lists_path=lists_path,
+            output_path=os.path.join(fixtures_dir, name)
+        ) | config.params()
+        for key, value in params.items():
+            udlf_config.set_param(key, value)
+        jobs.append(UDLFJob(name, udlf_config, os.path.join(fixtures_dir, "jobs", name)))
+
+    for job in asyncio.run(UDLFDriver(binary_path).run_all(jobs)):
+        if isinstance(job, Exception):
+            raise job
+        os.replace(job.output_path, fixture_path(job.name, fixtures_dir))
+        print(f"Recorded {job.name} in {fixture_path(job.name, fixtures_dir)}")
+    shutil.rmtree(os.path.join(fixtures_dir, "jobs"), ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Records the UDLF binary output of the native backend tests.")
+    parser.add_argument("--binary", default=os.getenv("UDLF_BINARY_PATH"))
+    parser.add_argument("--config", default=os.getenv("UDLF_CONFIG_PATH"), help="UDLF config.ini the parameters start from.")
+    args = parser.parse_args(argv)
+    record(args.binary, args.config)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
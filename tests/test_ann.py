@@ -0,0 +1,21 @@
+import numpy as np
+from models.commons.ann import IVFIndex
+
+
+def test_saved_index_is_rebuilt_when_its_parameters_change(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(500, 16)).astype(np.float32)
+    corpus_ids = [f"d{i}" for i in range(len(embeddings))]
+    path = str(tmp_path / "ivf.npz")
+    index = IVFIndex(nlist=8, n_iter=5, seed=1)
+    index.build(embeddings, corpus_ids)
+    index.save(path)
+
+    loaded = IVFIndex(nlist=8, n_iter=5, seed=1, nprobe=2)
+    assert loaded.load(path)
+    assert loaded.is_built_for(corpus_ids)
+    assert not loaded.is_built_for(corpus_ids[:-1])
+    for params in ({"nlist": 16}, {"n_iter": 10}, {"seed": 2}, {"score_function": "dot"}):
+        changed = IVFIndex(**({"nlist": 8, "n_iter": 5, "seed": 1} | params))
+        changed.load(path)
+        assert not changed.is_built_for(corpus_ids)
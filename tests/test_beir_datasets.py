@@ -0,0 +1,64 @@
+import json
+import os
+from local_datasets.beir_datasets import BEIR, MANIFEST_FILE
+from local_datasets.corpus_store import CorpusStore
+
+
+class ToyDataset(BEIR):
+    invalid_ids = ["d1", "q2", "unknown"]
+
+    def __init__(self, data_path):
+        super().__init__("toy")
+        self.data_path = data_path
+        store_path = os.path.join(data_path, "store")
+        if not CorpusStore.exists(store_path):
+            CorpusStore.write(store_path, [("d1", "title", "text"), ("d2", "", "text"), ("q2", "", "")])
+        self.corpus = CorpusStore(store_path)
+        self.queries = {"q1": "one", "q2": "two", "q3": "three"}
+        self.qrels = {"q1": {"d1": 1, "d2": 1}, "q2": {"d2": 1}, "q3": {"d1": 2}}
+
+
+def test_exclude_invalid_items(tmp_path):
+    dataset = ToyDataset(str(tmp_path))
+    dataset.exclude_invalid_items()
+
+    assert list(dataset.corpus) == ["d2"]
+    assert dataset.queries == {"q1": "one", "q3": "three"}
+    # only the invalid ids are removed, the qrels are evaluated as loaded
+    assert dataset.qrels == {"q1": {"d1": 1, "d2": 1}, "q2": {"d2": 1}, "q3": {"d1": 2}}
+    assert [(item["id"], item["from"], item["reason"]) for item in dataset.manifest["removed"]] == [
+        ("d1", "corpus", "listed in ToyDataset.invalid_ids"),
+        ("q2", "queries", "id shared by a query and a doc"),
+        ("q2", "corpus", "empty doc text")
+    ]
+    assert dataset.manifest["not_found"] == ["unknown"]
+
+    with open(os.path.join(dataset.filtered_path(), MANIFEST_FILE)) as f:
+        assert json.load(f) == dataset.manifest
+    loaded = ToyDataset(str(tmp_path))
+    loaded.load_filtered()
+    assert (list(loaded.corpus), loaded.queries, loaded.qrels) == (["d2"], dataset.queries, dataset.qrels)
+
+
+def test_prune_judgments(tmp_path):
+    dataset = ToyDataset(str(tmp_path))
+    unpruned_path = dataset.filtered_path()
+    dataset.prune_judgments = True
+    assert dataset.filtered_path() != unpruned_path
+    dataset.exclude_invalid_items()
+
+    assert dataset.queries == {"q1": "one"}
+    # judgments of removed docs are dropped, with the queries left without any
+    assert dataset.qrels == {"q1": {"d2": 1}, "q2": {"d2": 1}}
+    assert [(item["id"], item["from"], item["reason"]) for item in dataset.manifest["removed"][3:]] == [
+        ("q1/d1", "qrels", "judgment of a removed doc"),
+        ("q3/d1", "qrels", "judgment of a removed doc"),
+        ("q3", "queries", "no judgments left")
+    ]
+
+
+def test_pop_corpus_id(tmp_path):
+    dataset = ToyDataset(str(tmp_path))
+    dataset.pop_querie_or_corpus_id("d1")
+    dataset.pop_querie_or_corpus_id("q1")
+    assert "d1" not in dataset.corpus and "q1" not in dataset.queries
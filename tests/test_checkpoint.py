@@ -0,0 +1,21 @@
+import os
+from models.commons.checkpoint import Checkpoint
+
+
+def test_stage_is_done_for_the_config_it_completed_with(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path))
+    config = {"k_values": [1, 10], "method": "CPRR", "params": {"l": 100, "k": 3}}
+    assert not checkpoint.done("scifact", "bm25", "udlf-CPRR", config=config)
+
+    checkpoint.complete("scifact", "bm25", "udlf-CPRR", config=config)
+    assert checkpoint.done("scifact", "bm25", "udlf-CPRR")
+    assert checkpoint.done("scifact", "bm25", "udlf-CPRR", config={"params": {"k": 3, "l": 100}, **config})
+    assert not checkpoint.done("scifact", "bm25", "udlf-CPRR", config={**config, "params": {"l": 100, "k": 5}})
+    assert not checkpoint.done("scifact", "bm25", "udlf-CPRR", config={**config, "k_values": [1, 10, 100]})
+
+
+def test_save_records_the_config(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path))
+    checkpoint.save(("scifact", "bm25", "retrieve"), os.makedirs, config={"k_values": [10]})
+    assert checkpoint.done("scifact", "bm25", "retrieve", config={"k_values": [10]})
+    assert not checkpoint.done("scifact", "bm25", "retrieve", config={"k_values": [100]})
@@ -0,0 +1,55 @@
+import tracemalloc
+import numpy as np
+from models.commons.dense_search import BlockedDenseSearch, normalize
+from models.commons.embeddings import EmbeddingStore, GatheredRows
+
+
+def test_search_is_exact_over_gathered_rows(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3000, 32)).astype(np.float32)
+    store = EmbeddingStore(str(tmp_path))
+    store.update({f"d{i}": f"text {i}" for i in range(len(vectors))}, lambda texts: vectors[[int(t.split()[1]) for t in texts]])
+
+    corpus_ids = [f"d{i}" for i in rng.permutation(len(vectors))]
+    corpus = store.view(corpus_ids)
+    assert isinstance(corpus, GatheredRows)
+
+    queries = rng.normal(size=(50, 32)).astype(np.float32)
+    engine = BlockedDenseSearch(memory_budget=1 << 20, num_workers=2, query_block_size=16)
+    indices, scores = engine.search(queries, corpus, 20, [f"q{i}" for i in range(50)], corpus_ids)
+
+    expected = normalize(queries) @ normalize(np.asarray(corpus)).T
+    assert np.allclose(np.take_along_axis(expected, indices, axis=1), scores, atol=1e-5)
+    assert np.allclose(np.sort(expected, axis=1)[:, ::-1][:, :20], scores, atol=1e-5)
+
+
+def test_search_stays_within_the_memory_budget():
+    rng = np.random.default_rng(0)
+    corpus = rng.normal(size=(40000, 64)).astype(np.float32)
+    queries = rng.normal(size=(256, 64)).astype(np.float32)
+    corpus_ids = [f"d{i}" for i in range(len(corpus))]
+    budget = 8 << 20
+    engine = BlockedDenseSearch(memory_budget=budget, num_workers=1, query_block_size=256)
+
+    tracemalloc.start()
+    try:
+        engine.search(queries, corpus, 100, [f"q{i}" for i in range(len(queries))], corpus_ids)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # the id index of the corpus, about 50 bytes per id, is held besides the tiles
+    assert peak < budget + 64 * len(corpus_ids)
+
+
+def test_search_never_returns_the_query_doc():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(4, 8)).astype(np.float32)
+    ids = ["a", "b", "c", "d"]
+    indices, scores = BlockedDenseSearch().search(vectors, vectors, 10, ids, ids)
+
+    assert indices.shape == (4, 4)
+    # the last position of each list would be its own doc, it is padding instead
+    assert (indices[:, -1] == -1).all() and np.isneginf(scores[:, -1]).all()
+    assert all(i not in row for i, row in enumerate(indices))
+    assert (indices[:, :-1] >= 0).all()
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import stat
+import time
+import pytest
+from udl.driver import UDLFDriver, UDLFJob
+
+# writes the output file the config names, as the UDLF binary does
+SCRIPT = """#!/bin/sh
+echo "running $1"
+sleep {sleep}
+echo done > output.txt
+echo "log line" > log_out.txt
+"""
+# records its pid, then becomes the sleep, so the pid is the one the driver runs
+LONG_SCRIPT = """#!/bin/sh
+echo $$ > pid.txt
+exec sleep 30
+"""
+
+
+class FakeConfig:
+    def __init__(self):
+        self.params = {}
+
+    def set_param(self, key, value):
+        self.params[key] = value
+
+    def set_output_log_file(self, path):
+        self.params["OUTPUT_LOG_FILE_PATH"] = path
+
+    def write_config(self, path):
+        with open(path, "w") as f:
+            f.writelines(f"{key} = {value}\n" for key, value in self.params.items())
+
+
+def fake_binary(tmp_path, sleep=0, script=SCRIPT):
+    path = tmp_path / "udlf"
+    path.write_text(script.format(sleep=sleep))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_run_sync_works_inside_an_event_loop(tmp_path):
+    driver = UDLFDriver(fake_binary(tmp_path))
+    job = UDLFJob("CPRR", FakeConfig(), str(tmp_path / "job"))
+
+    async def main():
+        return driver.run_sync(job)
+
+    assert asyncio.run(main()) is job
+    assert job.returncode == 0 and os.path.exists(job.output_path)
+    assert [(record["source"], record["line"]) for record in job.records] == [
+        ("stdout", f"running {job.config_path}"), ("log", "log line")
+    ]
+
+
+def test_run_sync_kills_a_job_past_the_timeout(tmp_path):
+    driver = UDLFDriver(fake_binary(tmp_path, sleep=5), timeout=0.2)
+    job = UDLFJob("CPRR", FakeConfig(), str(tmp_path / "job"))
+    with pytest.raises(TimeoutError, match="running"):
+        driver.run_sync(job)
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+async def run_sampled(driver, jobs):
+    """
+    run_all, sampling the running jobs and their memory while they run.
+    """
+    samples = []
+
+    async def sample():
+        while True:
+            samples.append((driver.running, driver.memory_in_use))
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample())
+    try:
+        return await driver.run_all(jobs), samples
+    finally:
+        sampler.cancel()
+
+
+def test_run_all_caps_the_running_jobs(tmp_path):
+    driver = UDLFDriver(fake_binary(tmp_path, sleep=0.2), max_jobs=2)
+    jobs = [UDLFJob(f"job{i}", FakeConfig(), str(tmp_path / f"job{i}")) for i in range(5)]
+    outputs, samples = asyncio.run(run_sampled(driver, jobs))
+
+    assert outputs == jobs and all(job.returncode == 0 for job in jobs)
+    assert max(running for running, _ in samples) == 2
+    assert driver.running == 0 and driver.memory_in_use == 0
+
+
+def test_a_job_over_the_memory_budget_runs_alone(tmp_path):
+    driver = UDLFDriver(fake_binary(tmp_path, sleep=0.2), max_jobs=4, memory_budget=100)
+    jobs = [
+        UDLFJob("large", FakeConfig(), str(tmp_path / "large"), memory=500),
+        UDLFJob("small0", FakeConfig(), str(tmp_path / "small0"), memory=40),
+        UDLFJob("small1", FakeConfig(), str(tmp_path / "small1"), memory=40)
+    ]
+    outputs, samples = asyncio.run(run_sampled(driver, jobs))
+
+    assert outputs == jobs
+    # the large job never shares the driver, the small ones run together within the budget
+    assert all(running == 1 for running, memory in samples if memory >= 500)
+    assert (2, 80) in samples
+    assert max(memory for running, memory in samples if running > 1) <= 100
+
+
+def test_run_timeout_kills_the_process(tmp_path):
+    driver = UDLFDriver(fake_binary(tmp_path, script=LONG_SCRIPT), timeout=0.5)
+    job = UDLFJob("CPRR", FakeConfig(), str(tmp_path / "job"))
+    with pytest.raises(TimeoutError):
+        asyncio.run(driver.run(job))
+
+    with open(os.path.join(job.workdir, "pid.txt")) as f:
+        assert not is_running(int(f.read()))
+    assert driver.running == 0
+
+
+def test_cancelling_a_run_kills_the_process(tmp_path):
+    driver = UDLFDriver(fake_binary(tmp_path, script=LONG_SCRIPT))
+    job = UDLFJob("CPRR", FakeConfig(), str(tmp_path / "job"))
+    pid_path = os.path.join(job.workdir, "pid.txt")
+
+    async def main():
+        task = asyncio.create_task(driver.run(job))
+        while not os.path.exists(pid_path) or not os.path.getsize(pid_path):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    assert time.perf_counter() - start < 10
+    with open(pid_path) as f:
+        assert not is_running(int(f.read()))
+    assert driver.running == 0
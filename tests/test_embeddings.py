@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pytest
+from models.commons import embeddings as embeddings_module
+from models.commons.embeddings import CURRENT_FILE, EMBEDDINGS_FILE, HASHES_FILE, IDS_FILE, EmbeddingStore, content_hash
+
+
+class Encoder:
+    """
+    Encodes a text as its length and a count of the calls, recording the texts encoded.
+    """
+
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded.append(list(texts))
+        return np.array([[len(text), len(self.encoded)] for text in texts], dtype=np.float32)
+
+
+def test_update_encodes_only_new_and_changed_texts(tmp_path):
+    encode = Encoder()
+    store = EmbeddingStore(str(tmp_path))
+    store.update({"a": "one", "b": "three"}, encode)
+    store.update({"a": "one", "b": "changed", "c": "new"}, encode)
+    assert encode.encoded == [["one", "three"], ["changed", "new"]]
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert reopened.ids == ["a", "b", "c"]
+    assert reopened.get(["a", "b", "c"]).tolist() == [[3, 1], [7, 2], [3, 2]]
+    # a single directory of files is kept
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("generation-")]) == 1
+
+
+def test_an_interrupted_update_keeps_the_previous_store(tmp_path, monkeypatch):
+    store = EmbeddingStore(str(tmp_path))
+    store.update({"a": "one"}, Encoder())
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    # the update stops before CURRENT points to its files
+    monkeypatch.setattr(embeddings_module.os, "replace", fail)
+    with pytest.raises(OSError):
+        EmbeddingStore(str(tmp_path)).update({"a": "changed", "b": "two"}, Encoder())
+    monkeypatch.undo()
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert reopened.ids == ["a"] and reopened.hashes == [content_hash("one")]
+    assert reopened.get(["a"]).tolist() == [[3, 1]]
+
+
+def test_a_store_written_before_current_is_read_and_replaced(tmp_path):
+    np.save(os.path.join(tmp_path, EMBEDDINGS_FILE), np.array([[3, 0]], dtype=np.float32))
+    (tmp_path / IDS_FILE).write_text("a")
+    (tmp_path / HASHES_FILE).write_text(content_hash("one"))
+
+    store = EmbeddingStore(str(tmp_path))
+    assert store.get(["a"]).tolist() == [[3, 0]]
+    store.update({"a": "one", "b": "two"}, Encoder())
+
+    assert os.path.exists(tmp_path / CURRENT_FILE) and not os.path.exists(tmp_path / EMBEDDINGS_FILE)
+    assert EmbeddingStore(str(tmp_path)).get(["a", "b"]).tolist() == [[3, 0], [3, 1]]
+
+
+def test_a_store_of_another_dtype_is_encoded_again(tmp_path):
+    EmbeddingStore(str(tmp_path)).update({"a": "one"}, Encoder())
+
+    encode = Encoder()
+    store = EmbeddingStore(str(tmp_path), dtype="float16")
+    store.update({"a": "one"}, encode)
+    assert encode.encoded == [["one"]]
+    assert store.embeddings.dtype == np.float16
+    assert EmbeddingStore(str(tmp_path), dtype="float16").embeddings.dtype == np.float16
@@ -0,0 +1,55 @@
+import numpy as np
+import pytrec_eval
+from udl.evaluation import Evaluator
+from udl.ranked_lists import RankedLists
+
+K_VALUES = [1, 3, 5, 10, 100]
+
+
+def pytrec_evaluate(qrels, results, k_values, ignore_identical_ids=True):
+    """
+    BEIR's EvaluateRetrieval.evaluate.
+    """
+    if ignore_identical_ids:
+        results = {query_id: {doc_id: score for doc_id, score in docs.items() if doc_id != query_id}
+                   for query_id, docs in results.items()}
+    cutoffs = ",".join(str(k) for k in k_values)
+    evaluator = pytrec_eval.RelevanceEvaluator(qrels, {f"map_cut.{cutoffs}", f"ndcg_cut.{cutoffs}",
+                                                       f"recall.{cutoffs}", f"P.{cutoffs}"})
+    scores = evaluator.evaluate(results)
+    measures = []
+    for name, key in (("NDCG", "ndcg_cut"), ("MAP", "map_cut"), ("Recall", "recall"), ("P", "P")):
+        measures.append({
+            f"{name}@{k}": round(sum(query[f"{key}_{k}"] for query in scores.values()) / len(scores), 5)
+            for k in k_values
+        })
+    return tuple(measures)
+
+
+def random_run(seed: int, n_queries: int = 60, n_docs: int = 300, depth: int = 120):
+    rng = np.random.default_rng(seed)
+    query_ids = [f"q{i}" for i in range(n_queries)]
+    doc_ids = [f"d{i}" for i in range(n_docs)] + query_ids[:10]
+    qrels = {}
+    for query_id in query_ids[5:]:
+        judged = rng.choice(doc_ids, size=rng.integers(1, 15), replace=False)
+        qrels[query_id] = {str(doc_id): int(rng.integers(0, 3)) for doc_id in judged}
+    results = {}
+    for query_id in query_ids[:-5]:
+        docs = rng.choice(doc_ids, size=rng.integers(0, depth), replace=False)
+        # few distinct scores, so many ties
+        results[query_id] = {str(doc_id): float(rng.integers(0, 8)) for doc_id in docs}
+    return qrels, results
+
+
+def test_matches_pytrec_eval_with_ties():
+    for seed in range(5):
+        qrels, results = random_run(seed)
+        ranked_lists = RankedLists.from_beir(results)
+        evaluator = Evaluator(qrels, ranked_lists.ids, K_VALUES)
+
+        expected = pytrec_evaluate(qrels, results, K_VALUES)
+        for measures, expected_measures in zip(evaluator.evaluate(ranked_lists), expected):
+            assert measures.keys() == expected_measures.keys()
+            for key in measures:
+                assert abs(measures[key] - expected_measures[key]) < 1e-4, (seed, key)
@@ -0,0 +1,131 @@
+import os
+import threading
+import pandas as pd
+import pytest
+import registry
+from experiment import Experiment, file_name, safe_name
+
+
+def test_safe_name_is_one_path_component():
+    assert safe_name("bm25(backend=sparse)") == "bm25(backend=sparse)"
+    assert safe_name("../sbert+a/b") == "_._sbert_a_b"
+    assert safe_name("..") == "_."
+    assert file_name("CPRR(l=100,k=3)") == "CPRR(l=100,k=3).csv"
+
+
+SPEC = {
+    "name": "toy",
+    "datasets": ["scifact", "nfcorpus"],
+    "retrievers": [{"name": "bm25", "params": {"backend": "sparse"}}, {"name": "sbert"}],
+    "methods": [],
+    "k_values": [1, 10],
+    "parallelism": {}
+}
+
+
+class FakeModel:
+    def __init__(self, dataset, k_values, **params):
+        self.dataset = dataset
+        self.params = params
+
+    def retrieve(self):
+        pass
+
+    def evaluate(self):
+        pass
+
+    def dataframe(self):
+        return pd.DataFrame([{"Metric": "NDCG", "Environment": f"{self.dataset}+{self.params}", "K1": 1.0}])
+
+
+@pytest.fixture
+def components(monkeypatch):
+    """
+    Datasets and models built by the experiments, as names.
+    """
+    built = {"datasets": [], "models": []}
+
+    def create_dataset(name):
+        built["datasets"].append(name)
+        return name
+
+    def create_model(name, dataset, k_values, **params):
+        built["models"].append((dataset, name))
+        return FakeModel(dataset, k_values, **params)
+
+    monkeypatch.setattr(registry, "create_dataset", create_dataset)
+    monkeypatch.setattr(registry, "create_model", create_model)
+    return built
+
+
+def test_a_second_run_skips_the_completed_stages(tmp_path, components):
+    first = Experiment(SPEC, str(tmp_path))
+    assert [stage.name for stage in first.stages] == [
+        "load scifact", "retrieve scifact/bm25(backend=sparse)", "retrieve scifact/sbert",
+        "load nfcorpus", "retrieve nfcorpus/bm25(backend=sparse)", "retrieve nfcorpus/sbert"
+    ]
+    assert not any(stage.skipped for stage in first.stages)
+    assert len(first.run()) == 4
+    assert len(components["models"]) == 4
+
+    second = Experiment(SPEC, str(tmp_path))
+    assert all(stage.skipped for stage in second.stages)
+    assert len(second.run()) == 4
+    assert len(components["models"]) == 4 and components["datasets"] == ["scifact", "nfcorpus"]
+
+    # a missing output runs its stage again, with the stages it depends on
+    os.remove(second.stages[2].outputs[0])
+    third = Experiment(SPEC, str(tmp_path))
+    assert [stage.name for stage in third.stages if not stage.skipped] == ["load scifact", "retrieve scifact/sbert"]
+    third.run()
+    assert components["models"][-1] == ("scifact", "sbert")
+
+
+def test_other_retriever_params_do_not_reuse_the_outputs(tmp_path, components):
+    Experiment(SPEC, str(tmp_path)).run()
+    spec = {**SPEC, "retrievers": [{"name": "bm25", "params": {"backend": "elasticsearch"}, "label": "bm25(backend=sparse)"}]}
+    assert not any(stage.skipped for stage in Experiment(spec, str(tmp_path)).stages)
+
+
+def test_pipelines_run_in_parallel(tmp_path, components, monkeypatch):
+    # each retrieval waits for another one to run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    retrieve = FakeModel.retrieve
+    monkeypatch.setattr(FakeModel, "retrieve", lambda self: (barrier.wait(), retrieve(self)))
+
+    experiment = Experiment({**SPEC, "datasets": ["scifact"]}, str(tmp_path), pipelines=2)
+    experiment.run()
+    assert experiment.failures == {}
+
+
+def test_a_failed_stage_only_fails_its_dependents(tmp_path, components, monkeypatch):
+    def create_dataset(name):
+        if name == "nfcorpus":
+            raise OSError("download failed")
+        return name
+
+    monkeypatch.setattr(registry, "create_dataset", create_dataset)
+    experiment = Experiment(SPEC, str(tmp_path))
+    assert len(experiment.run()) == 2
+    assert sorted(experiment.failures) == [
+        "load nfcorpus", "retrieve nfcorpus/bm25(backend=sparse)", "retrieve nfcorpus/sbert"
+    ]
+
+
+def test_a_missing_method_output_reruns_its_retrieval(tmp_path, components):
+    # the method configs are built with udl.sweep, which imports beir
+    pytest.importorskip("beir")
+    spec = {**SPEC, "datasets": ["scifact"], "retrievers": [{"name": "bm25"}],
+            "methods": [{"name": "CPRR", "grid": {"l": [10], "k": [3, 5]}}]}
+    experiment = Experiment(spec, str(tmp_path))
+    rerank = experiment.stages[-1]
+    assert [stage.name for stage in experiment.stages] == ["load scifact", "retrieve scifact/bm25", "rerank scifact/bm25 (2 configs)"]
+    assert rerank.dependencies == [experiment.stages[1]]
+
+    for output in experiment.stages[1].outputs + rerank.outputs:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        open(output, "w").close()
+    assert all(stage.skipped for stage in Experiment(spec, str(tmp_path)).stages)
+
+    os.remove(rerank.outputs[0])
+    assert not any(stage.skipped for stage in Experiment(spec, str(tmp_path)).stages)
@@ -0,0 +1,31 @@
+import os
+import signal
+import time
+import pytest
+from models.commons.instrumentation import PROFILER, stage
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_child_profiles_while_the_parent_holds_the_lock():
+    with stage("parent"):
+        pass
+    # as if the sampler thread held the lock at the time of the fork
+    with PROFILER.lock:
+        pid = os.fork()
+        if pid == 0:
+            with stage("child"):
+                pass
+            os._exit(0 if [record["stage"] for record in PROFILER.take()] == ["child"] else 1)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            assert os.waitstatus_to_exitcode(status) == 0
+            break
+        time.sleep(0.05)
+    else:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        pytest.fail("the forked child deadlocked on the profiler lock")
+    assert "parent" in [record["stage"] for record in PROFILER.take()]
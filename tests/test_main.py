@@ -0,0 +1,19 @@
+import pytest
+from main import check_startup, main
+
+
+def test_main_imports_within_the_startup_budget(capsys):
+    # a fresh interpreter imports main without torch nor any dataset or model
+    assert check_startup([], 1.0) == 0
+    assert "main imported in" in capsys.readouterr().out
+
+
+def test_check_startup_flag():
+    # BM25 is imported with beir
+    pytest.importorskip("beir")
+    assert main(["--check-startup", "--models", "bm25", "--startup-budget", "1.0"]) == 0
+
+
+def test_check_startup_shows_the_import_error():
+    with pytest.raises(RuntimeError, match="Unknown component missing"):
+        check_startup(["missing"], 1.0)
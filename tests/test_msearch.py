@@ -0,0 +1,55 @@
+import threading
+import pytest
+from models.commons.msearch import MultiSearch
+
+
+class FakeClient:
+    """
+    Answers _msearch with one hit per query, the query text as doc id, after failing
+    the first requests and the first attempts of some queries as scripted.
+    """
+
+    def __init__(self, failed_requests: int = 0, failing_queries: dict = None):
+        self.failed_requests = failed_requests
+        self.failing_queries = dict(failing_queries or {})
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def msearch(self, body):
+        texts = [search["query"]["multi_match"]["query"] for search in body[1::2]]
+        with self.lock:
+            self.requests.append(texts)
+            if self.failed_requests > 0:
+                self.failed_requests -= 1
+                raise ConnectionError("connection reset")
+            responses = []
+            for text in texts:
+                if self.failing_queries.get(text, 0) > 0:
+                    self.failing_queries[text] -= 1
+                    responses.append({"error": {"type": "es_rejected_execution_exception"}})
+                else:
+                    responses.append({"hits": {"hits": [{"_id": text, "_score": 1.0}]}})
+        return {"responses": responses}
+
+
+def test_retries_failed_requests_and_items():
+    client = FakeClient(failed_requests=1, failing_queries={"q1": 2, "q4": 1})
+    search = MultiSearch(client, "index", batch_size=3, concurrency=1, backoff=0)
+    texts = [f"q{i}" for i in range(6)]
+
+    assert search.search(texts, 10) == [[(text, 1.0)] for text in texts]
+    # only the failed items are sent again
+    assert client.requests == [["q0", "q1", "q2"], ["q0", "q1", "q2"], ["q1"], ["q1"], ["q3", "q4", "q5"], ["q4"]]
+    assert search.stats["batches"] == 2
+    assert search.stats["queries"] == 6
+
+
+def test_raises_when_retries_run_out():
+    search = MultiSearch(FakeClient(failing_queries={"q1": 3}), "index", batch_size=3, max_retries=2, backoff=0)
+    with pytest.raises(RuntimeError, match="1 queries failed after 2 retries"):
+        search.search(["q0", "q1", "q2"], 10)
+    assert len(search.latencies) == 1
+
+    search = MultiSearch(FakeClient(failed_requests=3), "index", max_retries=2, backoff=0)
+    with pytest.raises(ConnectionError):
+        search.search(["q0"], 10)
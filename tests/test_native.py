@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pytest
+from udl.native import position_agreement, rank_agreement
+from udl.ranked_lists import RankedLists, exclude_queries
+from udl.udlf import native_rerank
+from record_udlf_fixtures import FIXTURES_DIR, METHODS, RANKED_LIST_FILE, fixture_clusters, fixture_path, fixture_ranked_lists, record
+
+# mean top-10 overlap, then share of the top-10 positions in the same order, the native
+# backend must reach against the binary output of each method
+MIN_AGREEMENT = {"CPRR": 0.9, "LHRR": 0.9, "RDPAC": 0.9}
+MIN_POSITION_AGREEMENT = {"CPRR": 0.75, "LHRR": 0.75, "RDPAC": 0.7}
+AGREEMENT_DEPTH = 10
+
+
+def test_rank_agreement():
+    a = np.array([[0, 1, 2, 3], [4, 5, 6, -1]])
+    assert rank_agreement(a, a, 3) == 1.0
+    assert rank_agreement(a, a[:, ::-1], 2) == 0.0
+    assert rank_agreement(a, np.array([[1, 0, 9, 9], [4, 8, 9, 9]]), 2) == 0.75
+
+
+@pytest.mark.parametrize("name", METHODS)
+def test_native_reorders_the_top_l(name):
+    config = METHODS[name]
+    results = fixture_ranked_lists()
+    reranked = native_rerank(results, config)
+
+    # each list is a permutation of the first l items of its input, the query aside
+    l = min(config.l, results.width)
+    for row in range(len(results)):
+        before = set(results.indices[row, :l]) - {row}
+        after = set(reranked.indices[row][reranked.indices[row] >= 0])
+        assert after == before
+
+
+@pytest.fixture(scope="module")
+def binary_outputs(tmp_path_factory):
+    """
+    Directory of the binary outputs: the checked in fixtures, or ones recorded now when
+    the UDLF binary is configured.
+    """
+    if all(os.path.exists(fixture_path(name)) for name in METHODS):
+        return FIXTURES_DIR
+    binary, config = os.getenv("UDLF_BINARY_PATH"), os.getenv("UDLF_CONFIG_PATH")
+    if not binary or not config:
+        pytest.skip("No recorded binary output, set UDLF_BINARY_PATH and UDLF_CONFIG_PATH or run tests/record_udlf_fixtures.py")
+    fixtures_dir = str(tmp_path_factory.mktemp("udlf"))
+    record(binary, config, fixtures_dir)
+    return fixtures_dir
+
+
+def test_position_agreement():
+    a = np.array([[0, 1, 2, 3], [4, 5, 6, -1]])
+    assert position_agreement(a, a, 3) == 1.0
+    # the same entries in another order
+    assert position_agreement(a, a[:, [1, 0, 2, 3]], 3) == pytest.approx(1 / 3)
+    assert position_agreement(a, np.array([[0, 9, 2, 3], [4, 5, -1, -1]]), 4) == 0.625
+
+
+@pytest.mark.parametrize("name", METHODS)
+def test_native_brings_the_cluster_first(name):
+    # every method puts more of the query's own cluster in the top-10 than the input lists
+    results = fixture_ranked_lists()
+    _, labels = fixture_clusters()
+    before = np.asarray(exclude_queries(results.indices))[:, :AGREEMENT_DEPTH]
+    after = np.asarray(native_rerank(results, METHODS[name]).indices)[:, :AGREEMENT_DEPTH]
+    assert (labels[after] == labels[:, None]).mean() > (labels[before] == labels[:, None]).mean()
+
+
+@pytest.mark.parametrize("name", METHODS)
+def test_native_matches_binary(name, binary_outputs):
+    results = fixture_ranked_lists()
+    # the output was recorded on the lists the test builds
+    recorded = RankedLists.from_text(os.path.join(binary_outputs, RANKED_LIST_FILE), results.ids)
+    assert np.array_equal(recorded.indices, results.with_query_first().indices)
+    binary = RankedLists.from_text(fixture_path(name, binary_outputs), results.ids)
+    binary = RankedLists.from_positions(results.ids, exclude_queries(binary.indices))
+    native = native_rerank(results, METHODS[name])
+
+    assert rank_agreement(native.indices, binary.indices, AGREEMENT_DEPTH) >= MIN_AGREEMENT[name]
+    assert position_agreement(native.indices, binary.indices, AGREEMENT_DEPTH) >= MIN_POSITION_AGREEMENT[name]
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from udl.ranked_lists import RankedLists
+
+
+def test_from_rows_matches_from_beir():
+    results = {
+        "q2": {"d1": 1.0, "q1": 3.0, "d3": 3.0},
+        "q1": {"d2": 0.5},
+        "q3": {}
+    }
+    streamed = RankedLists.from_rows(((query_id, docs.items()) for query_id, docs in results.items()), 5)
+    encoded = RankedLists.from_beir(results)
+
+    assert streamed.ids == encoded.ids == ["q1", "q2", "q3", "d1", "d2", "d3"]
+    assert streamed.width == 3
+    assert np.array_equal(streamed.indices, encoded.indices)
+    assert np.array_equal(streamed.scores, encoded.scores)
+    # ties keep the order of the hits
+    assert streamed.to_beir(["q2"]) == {"q2": {"q1": 3.0, "d3": 3.0, "d1": 1.0}}
+
+
+def test_from_rows_keeps_the_best_hits():
+    rows = [("q1", [("d1", 1.0), ("d2", 4.0), ("d3", 2.0)])]
+    assert RankedLists.from_rows(rows, 2).to_beir() == {"q1": {"d2": 4.0, "d3": 2.0}}
+
+
+def test_with_query_first_rejects_repeated_queries():
+    results = RankedLists(["q1", "q2", "d1"], np.array([[0, 2, 0], [2, -1, -1]], dtype=np.int32),
+                          np.zeros((2, 3), dtype=np.float32))
+    with pytest.raises(ValueError, match="q1"):
+        results.with_query_first()
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import numpy as np
+import pytest
+from serve import HTTPError, Server
+from udl.methods.CPRR import CPRRMethod
+from udl.ranked_lists import RankedLists
+from udl.serving import QueryService
+
+
+class FakeModel:
+    """
+    Model whose results are given, re-ranked by reversing each list.
+    """
+
+    def __init__(self, results: RankedLists):
+        self.results = results
+        self.udlf_results = None
+        self.runs = 0
+
+    def retrieve(self):
+        raise AssertionError("the results are given")
+
+    def udlf_run(self, config):
+        self.runs += 1
+        self.udlf_results = RankedLists.from_positions(self.results.ids, np.asarray(self.results.indices)[:, ::-1])
+
+    def search_texts(self, texts, top_k=None):
+        return [[("d1", 2.0), ("d0", 1.0)] for _ in texts]
+
+
+def results(seed: int) -> RankedLists:
+    rng = np.random.default_rng(seed)
+    indices = np.array([rng.permutation([j for j in range(4) if j != i])[:2] for i in range(4)], dtype=np.int32)
+    return RankedLists.from_positions([f"d{i}" for i in range(4)], indices)
+
+
+def test_build_graph_reuses_only_a_graph_of_the_same_config_and_results(tmp_path):
+    path = str(tmp_path / "graph")
+    model = FakeModel(results(0))
+    config = CPRRMethod(l=2, k=1, t=1, backend="native")
+
+    graph = QueryService.build_graph(model, config, path)
+    assert model.runs == 1
+    loaded = QueryService.build_graph(model, config, path)
+    assert model.runs == 1
+    assert np.array_equal(loaded.indices, graph.indices) and loaded.ids == graph.ids
+
+    # other method parameters, then other results, rebuild the graph
+    QueryService.build_graph(model, CPRRMethod(l=2, k=2, t=1, backend="native"), path)
+    assert model.runs == 2
+    model.results = results(1)
+    QueryService.build_graph(model, CPRRMethod(l=2, k=2, t=1, backend="native"), path)
+    assert model.runs == 3
+
+
+@pytest.fixture
+def server():
+    model = FakeModel(results(0))
+    model.udlf_run(None)
+    return Server(QueryService(model, model.udlf_results, budget_ms=1000), workers=1)
+
+
+@pytest.mark.parametrize("body", [b"[1, 2]", b"\"query\"", b"{not json", b"{}", b"{\"query\": 5}",
+                                  b"{\"query\": \"q\", \"k\": [1]}", b"{\"query\": \"q\", \"k\": \"x\"}"])
+def test_invalid_requests_are_rejected(server, body):
+    with pytest.raises(HTTPError) as error:
+        asyncio.run(server.route("POST", "/search", body))
+    assert error.value.status == 400
+
+
+def test_search_request(server):
+    response = asyncio.run(server.route("POST", "/search", json.dumps({"query": "q", "k": 2}).encode()))
+    assert [result["id"] for result in response["results"]][:1] == ["d1"]
+    response = asyncio.run(server.route("GET", "/search?q=q&k=1", b""))
+    assert len(response["results"]) == 1
+
+
+def test_a_non_object_body_gets_a_400_response(server):
+    async def request():
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /search HTTP/1.1\r\nContent-Length: 3\r\n\r\n[1]")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+
+    response = asyncio.run(request())
+    assert response.startswith(b"HTTP/1.1 400 Bad Request")
+    assert json.loads(response.split(b"\r\n\r\n", 1)[1]) == {"error": "The body must be a JSON object"}
@@ -0,0 +1,97 @@
+import math
+import numpy as np
+import pytest
+from models.commons.porter import porter_stem
+from models.commons.sparse_bm25 import SparseBM25, tokenize
+
+# examples of Porter's paper, "An algorithm for suffix stripping" (1980)
+PORTER_EXAMPLES = {
+    "caresses": "caress", "ponies": "poni", "ties": "ti", "caress": "caress", "cats": "cat",
+    "feed": "feed", "agreed": "agre", "plastered": "plaster", "bled": "bled", "motoring": "motor",
+    "sing": "sing", "conflated": "conflat", "troubled": "troubl", "sized": "size", "hopping": "hop",
+    "tanned": "tan", "falling": "fall", "hissing": "hiss", "fizzed": "fizz", "failing": "fail",
+    "filing": "file", "happy": "happi", "sky": "sky", "relational": "relat", "conditional": "condit",
+    "rational": "ration", "valenci": "valenc", "digitizer": "digit", "radicalli": "radic",
+    "differentli": "differ", "vileli": "vile", "analogousli": "analog", "vietnamization": "vietnam",
+    "predication": "predic", "operator": "oper", "feudalism": "feudal", "decisiveness": "decis",
+    "hopefulness": "hope", "callousness": "callous", "formaliti": "formal", "sensitiviti": "sensit",
+    "sensibiliti": "sensibl", "triplicate": "triplic", "formative": "form", "formalize": "formal",
+    "electriciti": "electr", "electrical": "electr", "hopeful": "hope", "goodness": "good",
+    "revival": "reviv", "allowance": "allow", "inference": "infer", "airliner": "airlin",
+    "gyroscopic": "gyroscop", "adjustable": "adjust", "defensible": "defens", "irritant": "irrit",
+    "replacement": "replac", "adjustment": "adjust", "dependent": "depend", "adoption": "adopt",
+    "homologou": "homolog", "communism": "commun", "activate": "activ", "angulariti": "angular",
+    "homologous": "homolog", "effective": "effect", "bowdlerize": "bowdler", "probate": "probat",
+    "rate": "rate", "cease": "ceas", "controll": "control", "roll": "roll",
+    "generalizations": "gener", "oscillators": "oscil",
+    # departures of the reference implementation, kept by Lucene
+    "conformabli": "conform", "archaeology": "archaeolog"
+}
+
+
+@pytest.mark.parametrize("word", PORTER_EXAMPLES)
+def test_porter_stem(word):
+    assert porter_stem(word) == PORTER_EXAMPLES[word]
+
+
+def test_tokenize_as_the_english_analyzer():
+    # possessives and stop words are removed before stemming
+    assert tokenize("The Cat's toys are running, and it's 2 studies of COVID-19.") == [
+        "cat", "toi", "run", "2", "studi", "covid", "19"
+    ]
+
+
+# title and text lengths are 1, 1, 1 and 2, 4, 1 terms, the average text length is 7 / 3
+CORPUS = {
+    "d1": {"title": "cat", "text": "dog bird"},
+    "d2": {"title": "dog", "text": "cats cat bird fish"},
+    "d3": {"title": "bird", "text": "fish"}
+}
+
+
+def lucene_bm25(tf, df, length, average_length, n=3, k1=1.2, b=0.75):
+    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+    return idf * tf / (tf + k1 * (1 - b + b * length / average_length))
+
+
+def test_bm25_scores_as_lucene():
+    engine = SparseBM25()
+    engine.fit(CORPUS)
+    indices, scores = engine.search(["bird fish"], ["q1"], 3)
+
+    # d3 matches bird in its title and fish in its text, best_fields adds half the weaker field
+    title = lucene_bm25(1, 1, 1, 1)
+    text = lucene_bm25(1, 2, 1, 7 / 3)
+    assert (round(title, 4), round(text, 4)) == (0.4458, 0.2788)
+    # d2 and d1 only match in their text
+    d2 = 2 * lucene_bm25(1, 2, 4, 7 / 3)
+    d1 = lucene_bm25(1, 2, 2, 7 / 3)
+    assert round(d2, 4) == 0.3307
+
+    assert indices.tolist() == [[2, 1, 0]]
+    assert np.allclose(scores, [[title + 0.5 * text, d2, d1]], atol=1e-6)
+
+
+def test_bm25_ranks_over_fields_and_excludes_the_query_doc():
+    engine = SparseBM25()
+    engine.fit(CORPUS)
+    indices, scores = engine.search(["cat", "cat", "whale"], ["q1", "d2", "q3"], 3)
+
+    # cats and cat stem alike, twice in the longer text of d2 outweighs once in the short title of d1
+    assert indices[0].tolist() == [1, 0, -1]
+    assert scores[0, 0] == pytest.approx(lucene_bm25(2, 1, 4, 7 / 3), abs=1e-6)
+    assert scores[0, 1] == pytest.approx(lucene_bm25(1, 1, 1, 1), abs=1e-6)
+    # d2 is never retrieved for the query of the same id, unmatched positions are padding
+    assert indices[1].tolist() == [0, -1, -1]
+    assert indices[2].tolist() == [-1, -1, -1] and np.isneginf(scores[2]).all()
+
+
+def test_bm25_searches_a_subset_with_the_index_statistics():
+    engine = SparseBM25()
+    engine.fit(CORPUS)
+    full_indices, full_scores = engine.search(["bird fish"], ["q1"], 3)
+    indices, scores = engine.search(["bird fish"], ["q1"], 2, doc_ids=["d1", "d2"])
+
+    # positions are in doc_ids, the scores the ones of the whole index
+    assert indices.tolist() == [[1, 0]]
+    assert np.allclose(scores, full_scores[:, 1:])
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from udl.methods.CPRR import CPRRMethod
+from udl.methods.LHRR import LHRRMethod
+from udl.methods.RDPAC import RDPACMethod
+from udl.ranked_lists import RankedLists
+from udl.udlf import UDLF, native_rerank
+
+METHODS = {
+    "CPRR": CPRRMethod(l=20, k=5, t=2, backend="native"),
+    "LHRR": LHRRMethod(l=20, k=5, t=2, backend="native"),
+    "RDPAC": RDPACMethod(l=10, k_start=1, k_end=4, k_inc=1, l_mult=2, backend="native")
+}
+WIDTH = 20
+
+
+class ScoredUDLF(UDLF):
+    """
+    Retrieves over a fixed matrix of random scores between every doc, each doc being a query.
+    """
+
+    def __init__(self, tmp_path, scores: np.ndarray, corpus: set):
+        super().__init__(f"{tmp_path}/", "toy")
+        self.name = "scored"
+        self.scores = scores
+        self.corpus = corpus
+
+    def search_subset(self, query_ids, doc_ids=None):
+        doc_ids = sorted(self.corpus if doc_ids is None else doc_ids)
+        return RankedLists.from_rows((
+            (query_id, [(doc_id, self.scores[int(query_id[1:]), int(doc_id[1:])]) for doc_id in doc_ids])
+            for query_id in query_ids
+        ), WIDTH)
+
+
+def updated_run(tmp_path, scores, config, added, removed):
+    docs = {f"d{i:04d}" for i in range(len(scores))} - set(added)
+    udlf = ScoredUDLF(tmp_path, scores, docs)
+    udlf.results = udlf.search_subset(sorted(docs))
+    udlf.udlf_results = native_rerank(udlf.results, config)
+
+    udlf.corpus = (docs | set(added)) - set(removed)
+    udlf.update(added, removed)
+    udlf.udlf_update(config)
+    return udlf
+
+
+def assert_matches_full_run(udlf, config):
+    expected = native_rerank(udlf.results, config)
+    rows, indices, _ = expected.rows_of(udlf.udlf_results)
+    assert sorted(rows) == list(range(len(expected)))
+    assert np.array_equal(indices[np.argsort(rows)], np.asarray(expected.indices))
+
+
+@pytest.mark.parametrize("name", METHODS)
+def test_update_matches_a_full_run_on_random_lists(tmp_path, name):
+    rng = np.random.default_rng(3)
+    scores = rng.random((600, 600))
+    udlf = updated_run(tmp_path, scores, METHODS[name], ["d0007"], ["d0100", "d0321"])
+    assert_matches_full_run(udlf, METHODS[name])
+
+
+@pytest.mark.parametrize("name", METHODS)
+def test_update_rereads_only_the_reach_of_the_change(tmp_path, capsys, name):
+    # docs only rank the docs of their own block, a change stays within its block
+    rng = np.random.default_rng(5)
+    blocks = np.arange(600) // 100
+    scores = np.where(blocks[:, None] == blocks[None, :], rng.random((600, 600)), -1.0)
+    udlf = updated_run(tmp_path, scores, METHODS[name], ["d0007"], ["d0042"])
+    assert_matches_full_run(udlf, METHODS[name])
+    assert "reading 99 ranked lists" in capsys.readouterr().out
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+import subprocess
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Callable, List
+from models.commons.instrumentation import stage
+
+if TYPE_CHECKING:
+    from udl.input_type import InputType
+
+# rough bytes the binary holds per ranked list item, for the lists and the method structures
+BYTES_PER_ITEM = 64
+BASE_MEMORY_BYTES = 64 * 1024 ** 2
+# share of the available memory the running jobs may use, by default
+MEMORY_FRACTION = 0.8
+CONFIG_FILE = "config.ini"
+OUTPUT_FILE = "output"
+LOG_FILE = "log_out.txt"
+RECORDS_FILE = "records.jsonl"
+
+
+def available_memory() -> int:
+    """
+    Physical memory not in use, None when the platform does not tell.
+    """
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_memory(size: int, depth: int) -> int:
+    """
+    Memory of a UDLF run over size ranked lists of depth items.
+    """
+    return BASE_MEMORY_BYTES + size * depth * BYTES_PER_ITEM
+
+
+class UDLFJob:
+    """
+    One run of the UDLF binary, in its own working directory with its own config file.
+    """
+
+    def __init__(self, name: str, config: "InputType", workdir: str, memory: int = BASE_MEMORY_BYTES):
+        """
+        Parameters:
+            name (str): Name of the job in its records, e.g. the method name.
+            config (InputType): Parameters of the run, the output and log paths are set to the working directory.
+            workdir (str): Directory of the config, output, log and records files.
+            memory (int): Estimated bytes of the run, see estimate_memory.
+        """
+        self.name = name
+        self.config = config
+        self.workdir = workdir
+        self.memory = memory
+        self.config_path = os.path.join(workdir, CONFIG_FILE)
+        # the binary appends the extension to the output path
+        self.output_path = os.path.join(workdir, f"{OUTPUT_FILE}.txt")
+        self.log_path = os.path.join(workdir, LOG_FILE)
+        self.records_path = os.path.join(workdir, RECORDS_FILE)
+        self.records = []
+        self.returncode = None
+        self.seconds = None
+
+    def write_config(self):
+        os.makedirs(self.workdir, exist_ok=True)
+        self.config.set_param("OUTPUT_FILE_PATH", os.path.join(self.workdir, OUTPUT_FILE))
+        self.config.set_output_log_file(self.log_path)
+        self.config.write_config(self.config_path)
+
+    def tail(self, lines: int = 20) -> str:
+        return "\n".join(record["line"] for record in self.records[-lines:])
+
+
+class UDLFDriver:
+    """
+    Runs UDLF binary jobs as asyncio subprocesses, so the interpreter keeps working,
+    e.g. evaluating the output of a job, while other jobs run.
+
+    At most max_jobs run at once, and the estimated memory of the running jobs stays
+    within the memory budget; a job larger than the budget runs alone. Each line the
+    binary prints, then each line of its log file, is kept as a structured record on
+    the job and in its records file. A job running longer than the timeout, or whose
+    task is cancelled, has its process killed.
+    """
+
+    def __init__(self, binary_path: str, max_jobs: int = None, memory_budget: int = None,
+                 timeout: float = None, on_record: Callable[[dict], None] = None):
+        """
+        Parameters:
+            binary_path (str): Path of the UDLF binary.
+            max_jobs (int): Jobs running at once. Default is the number of cores.
+            memory_budget (int): Bytes of the running jobs. Default is a share of the available memory.
+            timeout (float): Seconds a job may run, None waits for it.
+            on_record (Callable): Called with each record as it is read.
+        """
+        self.binary_path = binary_path
+        self.max_jobs = max_jobs or os.cpu_count()
+        available = available_memory()
+        self.memory_budget = memory_budget or (int(available * MEMORY_FRACTION) if available else None)
+        self.timeout = timeout
+        self.on_record = on_record
+        self.running = 0
+        self.memory_in_use = 0
+        self.condition = None
+
+    def fits(self, memory: int) -> bool:
+        if self.running >= self.max_jobs:
+            return False
+        if self.memory_budget is None or self.running == 0:
+            return True
+        return self.memory_in_use + memory <= self.memory_budget
+
+    @asynccontextmanager
+    async def slot(self, memory: int = 0):
+        """
+        Waits until a job of the given memory fits, and holds its place while it runs.
+        Also taken by jobs running in-process, so they share the same limits.
+        """
+        # created on first use, in the running event loop
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.fits(memory))
+            self.running += 1
+            self.memory_in_use += memory
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.running -= 1
+                self.memory_in_use -= memory
+                self.condition.notify_all()
+
+    def record(self, job: UDLFJob, source: str, line: str, start: float, records_file):
+        record = {"job": job.name, "source": source, "seconds": time.perf_counter() - start, "line": line}
+        job.records.append(record)
+        records_file.write(json.dumps(record) + "\n")
+        if self.on_record is not None:
+            self.on_record(record)
+
+    async def stream(self, job: UDLFJob, reader: asyncio.StreamReader, source: str, start: float, records_file):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            self.record(job, source, line.decode(errors="replace").rstrip(), start, records_file)
+
+    async def run(self, job: UDLFJob) -> UDLFJob:
+        """
+        Runs a job once it fits, returns it with its records, exit code and duration.
+
+        Raises:
+            TimeoutError: The job ran longer than the timeout, its process was killed.
+            RuntimeError: The binary failed or wrote no output.
+        """
+        job.write_config()
+        async with self.slot(job.memory):
+            with stage("udlf_binary"), open(job.records_path, "w") as records_file:
+                await self.execute(job, records_file)
+        return self.check(job)
+
+    def run_sync(self, job: UDLFJob) -> UDLFJob:
+        """
+        run without an event loop, so it may be called from code already running on one.
+        The binary runs as a blocking subprocess, its output is recorded once it exits.
+
+        Raises:
+            TimeoutError: The job ran longer than the timeout, its process was killed.
+            RuntimeError: The binary failed or wrote no output.
+        """
+        job.write_config()
+        with stage("udlf_binary"), open(job.records_path, "w") as records_file:
+            start = time.perf_counter()
+            try:
+                process = subprocess.run(
+                    [self.binary_path, job.config_path],
+                    cwd=job.workdir,
+                    capture_output=True,
+                    timeout=self.timeout
+                )
+            except subprocess.TimeoutExpired as error:
+                job.seconds = time.perf_counter() - start
+                self.record_output(job, error.stdout, error.stderr, start, records_file)
+                raise TimeoutError(f"UDLF job {job.name} timed out after {self.timeout}s:\n{job.tail()}")
+            job.returncode = process.returncode
+            job.seconds = time.perf_counter() - start
+            self.record_output(job, process.stdout, process.stderr, start, records_file)
+            self.record_log(job, start, records_file)
+        return self.check(job)
+
+    @staticmethod
+    def check(job: UDLFJob) -> UDLFJob:
+        if job.returncode != 0:
+            raise RuntimeError(f"UDLF job {job.name} exited with code {job.returncode}:\n{job.tail()}")
+        if not os.path.exists(job.output_path):
+            raise RuntimeError(f"UDLF job {job.name} wrote no output to {job.output_path}:\n{job.tail()}")
+        return job
+
+    def record_output(self, job: UDLFJob, stdout: bytes, stderr: bytes, start: float, records_file):
+        for source, output in (("stdout", stdout), ("stderr", stderr)):
+            for line in (output or b"").decode(errors="replace").splitlines():
+                self.record(job, source, line.rstrip(), start, records_file)
+
+    def record_log(self, job: UDLFJob, start: float, records_file):
+        # the binary writes its log file once it is done
+        if os.path.exists(job.log_path):
+            with open(job.log_path, errors="replace") as f:
+                for line in f:
+                    if line.strip():
+                        self.record(job, "log", line.rstrip(), start, records_file)
+
+    async def execute(self, job: UDLFJob, records_file):
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            self.binary_path, job.config_path,
+            cwd=job.workdir,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        waiting = asyncio.gather(
+            process.wait(),
+            self.stream(job, process.stdout, "stdout", start, records_file),
+            self.stream(job, process.stderr, "stderr", start, records_file)
+        )
+        try:
+            await asyncio.wait_for(waiting, self.timeout)
+        except asyncio.TimeoutError:
+            await self.kill(process, waiting)
+            raise TimeoutError(f"UDLF job {job.name} timed out after {self.timeout}s:\n{job.tail()}")
+        except asyncio.CancelledError:
+            await self.kill(process, waiting)
+            raise
+        finally:
+            job.returncode = process.returncode
+            job.seconds = time.perf_counter() - start
+        self.record_log(job, start, records_file)
+
+    @staticmethod
+    async def kill(process, waiting: asyncio.Future):
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        # the readers are cancelled with the wait, their outcome is consumed here
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+    async def run_all(self, jobs: List[UDLFJob]) -> list:
+        """
+        Runs the jobs concurrently, returns each job or the exception it raised, in order.
+        """
+        return await asyncio.gather(*(self.run(job) for job in jobs), return_exceptions=True)
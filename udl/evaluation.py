@@ -0,0 +1,112 @@
+import numpy as np
+from typing import Dict, List, Tuple
+from udl.ranked_lists import RankedLists, compact
+
+
+class Evaluator:
+    """
+    Evaluates integer ranked lists for every cutoff at once with cumulative sums,
+    computing the same NDCG, MAP, Recall and P as BEIR's pytrec_eval evaluation.
+
+    The qrels are encoded once for a vocabulary as sorted (query, doc) keys, so the
+    relevance of every ranked item is a vectorized lookup, and only queries with
+    qrels are read from the ranked lists. As trec_eval, docs of equal score are
+    ranked by descending doc id.
+    """
+
+    def __init__(self, qrels: Dict[str, Dict[str, int]], ids: List[str], k_values: List[int],
+                 ignore_identical_ids: bool = True):
+        """
+        Parameters:
+            qrels (Dict[str, Dict[str, int]]): Relevance judgements {query_id: {doc_id: relevance}}.
+            ids (List[str]): Vocabulary of the ranked lists to evaluate.
+            k_values (List[int]): Cutoffs.
+            ignore_identical_ids (bool): Drops the query from its own ranked list, as BEIR does.
+        """
+        self.ids = ids
+        self.k_values = k_values
+        self.ignore_identical_ids = ignore_identical_ids
+        index = {id: i for i, id in enumerate(ids)}
+        # position of each id in the sorted vocabulary, the tie order of trec_eval
+        self.id_ranks = np.empty(len(ids), dtype=np.int64)
+        self.id_ranks[sorted(range(len(ids)), key=ids.__getitem__)] = np.arange(len(ids))
+
+        self.query_ids = [query_id for query_id in qrels if query_id in index]
+        self.rows = np.array([index[query_id] for query_id in self.query_ids], dtype=np.int64)
+
+        max_k = max(k_values)
+        self.relevant = np.zeros(len(self.query_ids))
+        self.ideal = np.zeros((len(self.query_ids), max_k))
+        keys, gains = [], []
+        for i, query_id in enumerate(self.query_ids):
+            judged = qrels[query_id]
+            self.relevant[i] = sum(1 for relevance in judged.values() if relevance > 0)
+            ideal = sorted((relevance for relevance in judged.values() if relevance > 0), reverse=True)[:max_k]
+            self.ideal[i, :len(ideal)] = ideal
+            for doc_id, relevance in judged.items():
+                if doc_id in index and relevance > 0:
+                    keys.append(i * len(ids) + index[doc_id])
+                    gains.append(relevance)
+
+        order = np.argsort(keys)
+        self.keys = np.array(keys, dtype=np.int64)[order]
+        self.gains = np.array(gains, dtype=np.float64)[order]
+        self.discounts = 1 / np.log2(np.arange(2, max_k + 2))
+        self.ideal_dcg = np.cumsum(self.ideal * self.discounts, axis=1)
+
+    def relevance(self, ranked: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """
+        Relevance of each item of the ranked matrix, whose rows are the given qrels queries, 0 for padding.
+        """
+        if len(self.keys) == 0:
+            return np.zeros(ranked.shape)
+
+        keys = queries[:, None] * len(self.ids) + ranked
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = (ranked >= 0) & (self.keys[positions] == keys)
+        return np.where(found, self.gains[positions], 0)
+
+    def trec_order(self, ranked: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """
+        Ranked rows by descending score, then descending doc id, padding last.
+        """
+        order = np.lexsort((-self.id_ranks[ranked], -scores), axis=1)
+        return np.take_along_axis(ranked, order, axis=1)
+
+    def evaluate(self, results: RankedLists) -> Tuple[Dict[str, float], ...]:
+        """
+        Returns the ndcg, map, recall and precision dicts keyed as BEIR, e.g. "NDCG@10".
+        """
+        max_k = max(self.k_values)
+        in_results = self.rows < len(results)
+        rows = self.rows[in_results]
+
+        ranked = self.trec_order(np.asarray(results.indices[rows]), np.asarray(results.scores[rows]))
+        if self.ignore_identical_ids:
+            ranked = compact(np.where(ranked == rows[:, None], -1, ranked))
+        ranked = ranked[:, :max_k]
+        if ranked.shape[1] < max_k:
+            ranked = np.pad(ranked, ((0, 0), (0, max_k - ranked.shape[1])), constant_values=-1)
+
+        gains = self.relevance(ranked, np.nonzero(in_results)[0])
+        hits = np.cumsum(gains > 0, axis=1)
+        relevant = self.relevant[in_results]
+        safe_relevant = np.where(relevant > 0, relevant, 1)
+
+        dcg = np.cumsum(gains * self.discounts, axis=1)
+        ideal_dcg = self.ideal_dcg[in_results]
+        safe_ideal_dcg = np.where(ideal_dcg > 0, ideal_dcg, 1)
+        precision_at = np.cumsum((gains > 0) * hits / np.arange(1, max_k + 1), axis=1)
+
+        ndcg, _map, recall, precision = {}, {}, {}, {}
+        for k in self.k_values:
+            ndcg[f"NDCG@{k}"] = self.mean(dcg[:, k - 1] / safe_ideal_dcg[:, k - 1])
+            _map[f"MAP@{k}"] = self.mean(precision_at[:, k - 1] / safe_relevant)
+            recall[f"Recall@{k}"] = self.mean(hits[:, k - 1] / safe_relevant)
+            precision[f"P@{k}"] = self.mean(hits[:, k - 1] / k)
+
+        return ndcg, _map, recall, precision
+
+    @staticmethod
+    def mean(values: np.ndarray) -> float:
+        return round(float(values.mean()), 5) if len(values) else 0.0
@@ -0,0 +1,88 @@
+import numpy as np
+from typing import List
+from udl.ranked_lists import RankedLists
+
+FUSION_METHODS = ("rrf", "combsum", "borda")
+
+
+def align(results: List[RankedLists]) -> List[RankedLists]:
+    """
+    Re-encodes the ranked lists of several retrievers over a shared vocabulary: the
+    queries, which must be the same for every retriever, then every retrieved doc of
+    any of them. Row i and index j then mean the same id in each of the returned lists.
+    """
+    query_ids = results[0].query_ids
+    for other in results[1:]:
+        if other.query_ids != query_ids:
+            raise ValueError("The ranked lists to align were not retrieved for the same queries")
+
+    n = len(query_ids)
+    doc_ids = sorted({id for other in results for id in other.ids[n:]}, key=lambda x: str(x))
+    ids = query_ids + doc_ids
+    return [other.select(ids, n) for other in results]
+
+
+def contributions(results: RankedLists, method: str, k: int) -> np.ndarray:
+    """
+    Score each item of the ranked lists adds to its doc in the fused list.
+    """
+    ranks = np.broadcast_to(np.arange(results.width), results.indices.shape)
+    if method == "rrf":
+        return 1.0 / (k + ranks + 1)
+    if method == "borda":
+        return (results.width - ranks).astype(np.float64)
+
+    # combsum adds the scores of each list, min-max normalized per query
+    valid = np.asarray(results.indices) >= 0
+    scores = np.where(valid, np.asarray(results.scores, dtype=np.float64), 0.0)
+    low = np.where(valid, scores, np.inf).min(axis=1, keepdims=True)
+    high = np.where(valid, scores, -np.inf).max(axis=1, keepdims=True)
+    spread = np.where(high > low, high - low, 1.0)
+    return np.where(high > low, (scores - low) / spread, 1.0)
+
+
+def fuse(results: List[RankedLists], method: str = "rrf", depth: int = None, k: int = 60,
+         weights: List[float] = None) -> RankedLists:
+    """
+    Fuses aligned ranked lists in-process, every query at once.
+
+    Parameters:
+        results (List[RankedLists]): Ranked lists sharing their vocabulary, see align.
+        method (str): "rrf" sums 1 / (k + rank), "combsum" sums the min-max normalized
+            scores and "borda" sums width - rank, rank starting at 0.
+        depth (int): Items of each fused list. Default keeps every doc retrieved by any list.
+        k (int): Rank offset of RRF. Default is 60.
+        weights (List[float]): Weight of each retriever. Default weighs them alike.
+
+    Returns:
+        Fused ranked lists, scored by their fused score, over the shared vocabulary.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method {method}, choose from {', '.join(FUSION_METHODS)}")
+
+    n, size = len(results[0]), len(results[0].ids)
+    weights = weights or [1.0] * len(results)
+    # the lists of each query side by side, padding sorted last under the index size
+    indices = np.concatenate([np.where(np.asarray(other.indices) >= 0, other.indices, size) for other in results], axis=1)
+    values = np.concatenate([
+        np.where(np.asarray(other.indices) >= 0, weight * contributions(other, method, k), 0.0)
+        for other, weight in zip(results, weights)
+    ], axis=1)
+
+    # the contributions to the same doc of a query are summed, each doc's sum is kept on its first entry
+    order = np.argsort(indices, axis=1, kind="stable")
+    indices = np.take_along_axis(indices, order, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    first = np.ones(indices.shape, dtype=bool)
+    first[:, 1:] = indices[:, 1:] != indices[:, :-1]
+    totals = np.full(indices.shape, -np.inf)
+    totals[first] = np.add.reduceat(values.ravel(), np.flatnonzero(first))
+    totals[indices == size] = -np.inf
+
+    # by descending fused score, ties broken by vocabulary position as the docs are sorted
+    counts = np.isfinite(totals).sum(axis=1)
+    width = int(counts.max(initial=0)) if depth is None else min(depth, int(counts.max(initial=0)))
+    order = np.argsort(-totals, axis=1, kind="stable")[:, :width]
+    scores = np.take_along_axis(totals, order, axis=1).astype(np.float32)
+    indices = np.where(np.isfinite(scores), np.take_along_axis(indices, order, axis=1), -1).astype(np.int32)
+    return RankedLists(results[0].ids, indices, scores)
@@ -12,4 +12,20 @@ class UDLFConfigHelper:
             "INPUT_FILE": ranked_list_path,
             "INPUT_FILE_LIST": lists_path,
             "OUTPUT_FILE_PATH": output_path
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def create_fusion_config(
+            size: int,
+            lists_path: str,
+            output_path: str
+    ) -> dict:
+        """
+        Config of the UDLF fusion task, its ranked list files are set with InputType.set_input_files.
+        """
+        return {
+            "UDL_TASK": "FUSION",
+            "SIZE_DATASET": size,
+            "INPUT_FILE_LIST": lists_path,
+            "OUTPUT_FILE_PATH": output_path
+        }
@@ -1,7 +1,8 @@
 from udl.udlf import UDLFConfig
+from udl import native
 
 class CPRRMethod(UDLFConfig):
-    def __init__(self, l: int, k: int=3, t: int=2):
+    def __init__(self, l: int, k: int=3, t: int=2, backend: str = "binary"):
         """
         Constructor for the CPRRMethod class.
 
@@ -9,11 +10,13 @@ class CPRRMethod(UDLFConfig):
             l (int): Size of ranked lists (must be lesser than SIZE_DATASET, this param is mandatory).
             k (int): Number of nearest neighbors. Default is 3.
             t (int): Number of iterations. Default is 2.
+            backend (str): "binary" runs the UDLF binary, "native" runs in-process. Default is "binary".
         """
         self.method = "CPRR"
         self.l = l
         self.k = k
         self.t = t
+        self.backend = backend
 
     def params(self):
         """
@@ -24,4 +27,23 @@ class CPRRMethod(UDLFConfig):
             "PARAM_CPRR_L": self.l,
             "PARAM_CPRR_K": self.k,
             "PARAM_CPRR_T": self.t
-        }
\ No newline at end of file
+        }
+
+    def depth(self):
+        """
+        Items of each ranked list read by the CPRR method, l.
+        """
+        return self.l
+
+    def reach(self):
+        """
+        Hops a change travels through the CPRR method, one per iteration: a list is re-sorted
+        by the top-k of the lists that hold its items.
+        """
+        return self.t
+
+    def run_native(self, ranks):
+        """
+        Runs the CPRR method in-process over integer ranked lists.
+        """
+        return native.cprr(ranks, self.l, self.k, self.t)
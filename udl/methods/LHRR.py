@@ -1,7 +1,8 @@
 from udl.udlf import UDLFConfig
+from udl import native
 
 class LHRRMethod(UDLFConfig):
-    def __init__(self, l: int, k: int=40, t: int=2):
+    def __init__(self, l: int, k: int=40, t: int=2, backend: str = "binary"):
         """
         Constructor for the LHRRMethod class.
 
@@ -9,11 +10,13 @@ class LHRRMethod(UDLFConfig):
             l (int): Size of ranked lists (must be lesser than SIZE_DATASET, this param is mandatory).
             k (int): Number of nearest neighbors. Default is 3.
             t (int): Number of iterations. Default is 2.
+            backend (str): "binary" runs the UDLF binary, "native" runs in-process. Default is "binary".
         """
         self.method = "LHRR"
         self.l = l
         self.k = k
         self.t = t
+        self.backend = backend
 
     def params(self):
         """
@@ -24,4 +27,23 @@ class LHRRMethod(UDLFConfig):
             "PARAM_LHRR_L": self.l,
             "PARAM_LHRR_K": self.k,
             "PARAM_LHRR_T": self.t
-        }
\ No newline at end of file
+        }
+
+    def depth(self):
+        """
+        Items of each ranked list read by the LHRR method, l.
+        """
+        return self.l
+
+    def reach(self):
+        """
+        Hops a change travels through the LHRR method, two per iteration: the rank
+        normalization reads the lists of the items, then the hyperedges the normalized lists.
+        """
+        return 2 * self.t
+
+    def run_native(self, ranks):
+        """
+        Runs the LHRR method in-process over integer ranked lists.
+        """
+        return native.lhrr(ranks, self.l, self.k, self.t)
@@ -1,9 +1,11 @@
 from udl.udlf import UDLFConfig
+from udl import native
 
 class RDPACMethod(UDLFConfig):
 
     def __init__(self, l: int, k_start: int = 1, k_end: int = 40, k_inc: int = 1,
-                 l_mult: int = 2, p: float = 0.60, pl: float = 0.99):
+                 l_mult: int = 2, p: float = 0.60, pl: float = 0.99,
+                 backend: str = "binary"):
         """
         Constructor for the RDPACMethod class.
 
@@ -15,6 +17,7 @@ class RDPACMethod(UDLFConfig):
             l_mult (int): Multiplier for l. Default is 2.
             p (float):  Default is 0.60.
             pl (float): Default is 0.99.
+            backend (str): "binary" runs the UDLF binary, "native" runs in-process. Default is "binary".
         """
         self.method = "RDPAC"
         self.l = l
@@ -24,6 +27,7 @@ class RDPACMethod(UDLFConfig):
         self.l_mult = l_mult
         self.p = p
         self.pl = pl
+        self.backend = backend
 
     def params(self):
         """
@@ -38,4 +42,23 @@ class RDPACMethod(UDLFConfig):
             "PARAM_RDPAC_L_MULT": self.l_mult,
             "PARAM_RDPAC_P": self.p,
             "PARAM_RDPAC_PL": self.pl
-        }
\ No newline at end of file
+        }
+
+    def depth(self):
+        """
+        Items of each ranked list read by the RDPAC method, l times l_mult, the depth of its affinity graph.
+        """
+        return self.l * self.l_mult
+
+    def reach(self):
+        """
+        Hops a change travels through the RDPAC method: one for the symmetric affinity, one
+        per diffusion step and one for the final symmetrization.
+        """
+        return len(range(self.k_start, self.k_end + 1, self.k_inc)) + 2
+
+    def run_native(self, ranks):
+        """
+        Runs the RDPAC method in-process over integer ranked lists.
+        """
+        return native.rdpac(ranks, self.l, self.k_start, self.k_end, self.k_inc, self.l_mult, self.p, self.pl)
@@ -0,0 +1,205 @@
+import numpy as np
+from scipy import sparse
+
+
+def sparse_from_ranks(ranks: np.ndarray, weights: np.ndarray, n: int) -> sparse.csr_matrix:
+    """
+    Builds a (n, n) sparse matrix where row i holds weights[i, j] at column ranks[i, j].
+    Padding entries (-1) are ignored.
+    """
+    weights = np.broadcast_to(weights, ranks.shape)
+    valid = ranks >= 0
+    rows = np.nonzero(valid)[0]
+    return sparse.csr_matrix(
+        (weights[valid].astype(np.float64), (rows, ranks[valid])),
+        shape=(n, n)
+    )
+
+
+def resort(ranks: np.ndarray, similarity: sparse.csr_matrix, l: int) -> np.ndarray:
+    """
+    Re-sorts the first l entries of each ranked list by the new similarity, in descending order.
+    Ties keep the original order, padding entries (-1) go to the end.
+    """
+    top = ranks[:, :l]
+    valid = top >= 0
+    rows = np.broadcast_to(np.arange(top.shape[0])[:, None], top.shape)
+
+    scores = np.full(top.shape, -np.inf)
+    scores[valid] = np.asarray(similarity[rows[valid], top[valid]]).ravel()
+
+    order = np.argsort(-scores, axis=1, kind="stable")
+    resorted = ranks.copy()
+    resorted[:, :l] = np.take_along_axis(top, order, axis=1)
+    return resorted
+
+
+def neighbour_graph(ranks: np.ndarray) -> sparse.csr_matrix:
+    """
+    Links each row to the items of its ranked list and to the rows whose list holds it.
+    """
+    graph = sparse_from_ranks(ranks, 1, ranks.shape[0])
+    return (graph + graph.T).tocsr()
+
+
+def neighbourhood(graph: sparse.csr_matrix, mask: np.ndarray, hops: int) -> np.ndarray:
+    """
+    Mask of the rows within hops of the rows of mask over the neighbour graph.
+    """
+    for _ in range(hops):
+        grown = mask | (graph @ mask.astype(np.float64) > 0)
+        if grown.sum() == mask.sum():
+            break
+        mask = grown
+    return mask
+
+
+def rank_agreement(a: np.ndarray, b: np.ndarray, depth: int) -> float:
+    """
+    Mean overlap between the top-depth entries of two ranked list matrices.
+    Used to check the native backend against the output of the UDLF binary.
+    """
+    overlaps = [
+        len(set(x[:depth][x[:depth] >= 0]) & set(y[:depth][y[:depth] >= 0])) / depth
+        for x, y in zip(a, b)
+    ]
+    return float(np.mean(overlaps)) if overlaps else 1.0
+
+
+def position_agreement(a: np.ndarray, b: np.ndarray, depth: int) -> float:
+    """
+    Mean share of the top-depth positions of two ranked list matrices holding the same
+    entry, so unlike rank_agreement a swap of two entries counts against it.
+    """
+    a, b = np.asarray(a)[:, :depth], np.asarray(b)[:, :depth]
+    if not len(a):
+        return 1.0
+    return float(((a == b) & (a >= 0)).sum(axis=1).mean() / depth)
+
+
+def cprr(ranks: np.ndarray, l: int, k: int, t: int) -> np.ndarray:
+    """
+    Cartesian Product of Ranking References.
+
+    Parameters:
+        ranks (np.ndarray): (n, width) int matrix, row i is the ranked list of element i.
+        l (int): Size of ranked lists.
+        k (int): Number of nearest neighbors.
+        t (int): Number of iterations.
+    Returns:
+        (n, l) re-ranked lists.
+    """
+    n = ranks.shape[0]
+    l = min(l, ranks.shape[1])
+    k = min(k, l)
+    ranks = np.asarray(ranks)
+
+    for _ in range(t):
+        # every pair of the top-k of a list gets the product of their position weights
+        references = sparse_from_ranks(ranks[:, :k], k - np.arange(k), n)
+        similarity = (references.T @ references).tocsr()
+        ranks = resort(ranks, similarity, l)
+
+    return ranks[:, :l]
+
+
+def rank_normalization(ranks: np.ndarray, l: int) -> np.ndarray:
+    """
+    Re-sorts the first l entries of each ranked list by the reciprocal position tau_q(x) + tau_x(q).
+    Elements missing from a ranked list are placed at position l.
+    """
+    n = ranks.shape[0]
+    positions = sparse_from_ranks(ranks[:, :l], np.arange(1, l + 1), n)
+
+    top = ranks[:, :l]
+    valid = top >= 0
+    rows = np.broadcast_to(np.arange(n)[:, None], top.shape)
+
+    reverse = np.zeros(top.shape)
+    reverse[valid] = np.asarray(positions[top[valid], rows[valid]]).ravel()
+    reverse[reverse == 0] = l
+
+    # lower is better, so the similarity is its negation
+    scores = np.where(valid, -(np.arange(1, l + 1) + reverse), -np.inf)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    normalized = ranks.copy()
+    normalized[:, :l] = np.take_along_axis(top, order, axis=1)
+    return normalized
+
+
+def lhrr(ranks: np.ndarray, l: int, k: int, t: int) -> np.ndarray:
+    """
+    Log-based Hypergraph of Ranking References.
+
+    Parameters:
+        ranks (np.ndarray): (n, width) int matrix, row i is the ranked list of element i.
+        l (int): Size of ranked lists.
+        k (int): Number of nearest neighbors.
+        t (int): Number of iterations.
+    Returns:
+        (n, l) re-ranked lists.
+    """
+    n = ranks.shape[0]
+    l = min(l, ranks.shape[1])
+    k = min(k, l)
+    ranks = np.asarray(ranks)
+
+    for _ in range(t):
+        ranks = rank_normalization(ranks, l)
+
+        # hyperedge of q is its top-k, membership decays with log_k of the position
+        membership = 1 - np.log(np.arange(1, k + 1)) / np.log(max(k, 2))
+        incidence = sparse_from_ranks(ranks[:, :k], membership, n)
+        edge_weights = np.asarray(incidence.sum(axis=1)).ravel()
+
+        pairwise = (incidence @ incidence.T).multiply(incidence.T @ incidence)
+        cartesian = incidence.T @ sparse.diags(edge_weights) @ incidence
+        similarity = cartesian.multiply(pairwise).tocsr()
+
+        ranks = resort(ranks, similarity, l)
+
+    return ranks[:, :l]
+
+
+def rdpac(ranks: np.ndarray, l: int, k_start: int, k_end: int, k_inc: int,
+          l_mult: int, p: float, pl: float) -> np.ndarray:
+    """
+    Rank Diffusion Process with Assured Convergence.
+
+    Parameters:
+        ranks (np.ndarray): (n, width) int matrix, row i is the ranked list of element i.
+        l (int): Size of ranked lists.
+        k_start (int): Starting value for k.
+        k_end (int): Ending value for k.
+        k_inc (int): Increment value for k.
+        l_mult (int): Multiplier for l, depth used to build the affinity graph.
+        p (float): Decay of the rank-biased affinity.
+        pl (float): Weight of the diffused affinity on each step, lesser than 1 to ensure convergence.
+    Returns:
+        (n, l) re-ranked lists.
+    """
+    n = ranks.shape[0]
+    l = min(l, ranks.shape[1])
+    depth = min(l * l_mult, ranks.shape[1])
+    ranks = np.asarray(ranks)
+
+    affinity = sparse_from_ranks(ranks[:, :depth], p ** np.arange(depth), n)
+    affinity = ((affinity + affinity.T) / 2).tocsr()
+    support = affinity.copy()
+    support.data[:] = 1
+
+    similarity = affinity
+    for k in range(k_start, k_end + 1, k_inc):
+        k = min(k, depth)
+        transition = sparse_from_ranks(ranks[:, :k], p ** np.arange(k), n)
+        row_sums = np.asarray(transition.sum(axis=1)).ravel()
+        row_sums[row_sums == 0] = 1
+        transition = sparse.diags(1 / row_sums) @ transition
+
+        similarity = pl * (transition @ similarity) + (1 - pl) * affinity
+        similarity = similarity.multiply(support).tocsr()
+
+    # keep each element as the first item of its own ranked list
+    similarity = similarity + similarity.T
+    similarity = (similarity + sparse.identity(n) * (similarity.max() + 1)).tocsr()
+    return resort(ranks, similarity, l)[:, :l]
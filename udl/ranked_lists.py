@@ -0,0 +1,473 @@
+import hashlib
+import numpy as np
+import os
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+INDICES_FILE = "indices.npy"
+SCORES_FILE = "scores.npy"
+IDS_FILE = "ids.txt"
+# characters buffered before each write of the text files
+WRITE_BUFFER_SIZE = 1 << 22
+# rows allocated at once while streaming ranked lists in
+ROWS_PER_BLOCK = 4096
+
+
+def compact(indices: np.ndarray) -> np.ndarray:
+    """
+    Moves the padding entries (-1) of each row to the end, keeping the order of the others.
+    """
+    order = np.argsort(indices < 0, axis=1, kind="stable")
+    return np.take_along_axis(indices, order, axis=1)
+
+
+def exclude_queries(indices: np.ndarray) -> np.ndarray:
+    """
+    Removes each query from its own ranked list, row i being the list of query i.
+    """
+    rows = np.arange(indices.shape[0])[:, None]
+    return compact(np.where(indices == rows, -1, indices))
+
+
+def top(scores: np.ndarray, depth: int = None) -> np.ndarray:
+    """
+    Positions of the depth best scores, by descending score. Only the best depth
+    are sorted, selected first with argpartition.
+    """
+    if depth is not None and len(scores) > depth:
+        best = np.argpartition(-scores, depth - 1)[:depth]
+        return best[np.argsort(-scores[best], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+
+def write_lines(path: str, lines: Iterable[str], buffer_size: int = WRITE_BUFFER_SIZE) -> int:
+    """
+    Writes the lines in chunks of about buffer_size characters, returns how many were written.
+    """
+    count, size, chunk = 0, 0, []
+    with open(path, "w") as f:
+        for line in lines:
+            chunk.append(line)
+            size += len(line) + 1
+            if size >= buffer_size:
+                f.write(("\n" if count else "") + "\n".join(chunk))
+                count += len(chunk)
+                size, chunk = 0, []
+        if chunk:
+            f.write(("\n" if count else "") + "\n".join(chunk))
+            count += len(chunk)
+    return count
+
+
+def write_ranked_lists(path: str, rows: Iterable[Tuple[str, Sequence[str]]], depth: int = None,
+                       query_first: bool = True, buffer_size: int = WRITE_BUFFER_SIZE) -> int:
+    """
+    Streams ranked lists to a UDLF ranked list file, one row at a time.
+
+    Parameters:
+        path (str): Ranked list file.
+        rows (Iterable): (query_id, doc_ids) rows, doc_ids ranked.
+        depth (int): Items per line, the query included. Default keeps every item.
+        query_first (bool): Writes the query as the first item of its own list, as the UDLF input expects.
+        buffer_size (int): Characters buffered before each write.
+
+    Returns:
+        Number of lines, the UDLF dataset size.
+    """
+    def lines():
+        for query_id, doc_ids in rows:
+            if depth is not None:
+                doc_ids = doc_ids[:depth]
+
+            if not query_first:
+                yield " ".join(doc_ids[:depth])
+                continue
+
+            others = [doc_id for doc_id in doc_ids if doc_id != query_id]
+            if depth is not None:
+                others = others[:depth - 1]
+            yield " ".join([query_id] + others)
+
+    return write_lines(path, lines(), buffer_size)
+
+
+class RankedLists:
+    """
+    Integer-encoded ranked lists.
+
+    The vocabulary ids holds the query ids first, sorted as strings, followed by
+    any retrieved doc id that is not a query. Row i of the matrices is the ranked
+    list of ids[i], so the first len(self) ids are also the UDLF lists file.
+    """
+
+    def __init__(self, ids: List[str], indices: np.ndarray, scores: np.ndarray):
+        """
+        Parameters:
+            ids (List[str]): Vocabulary, the first indices.shape[0] ids are the queries.
+            indices (np.ndarray): (n_queries, L) int32 matrix of positions in ids, padded with -1.
+            scores (np.ndarray): (n_queries, L) float32 matrix of scores, padded with -inf.
+        """
+        # ranked lists derived from others share their vocabulary
+        self.ids = ids if isinstance(ids, list) else list(ids)
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.indices = indices
+        self.scores = scores
+
+    def __len__(self):
+        return self.indices.shape[0]
+
+    @property
+    def query_ids(self) -> List[str]:
+        return self.ids[:len(self)]
+
+    @property
+    def width(self) -> int:
+        return self.indices.shape[1]
+
+    @classmethod
+    def from_beir(cls, results: Dict[str, Dict[str, float]]) -> "RankedLists":
+        """
+        Encodes BEIR results {query_id: {doc_id: score}}, each row sorted by descending score.
+        """
+        width = max((len(docs) for docs in results.values()), default=0)
+        return cls.from_rows(((query_id, docs.items()) for query_id, docs in results.items()), width)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, Iterable[Tuple[str, float]]]], width: int) -> "RankedLists":
+        """
+        Encodes (query_id, hits) rows as they are streamed, hits being (doc_id, score) pairs,
+        so the results are never held as a dict. Each row keeps its width best hits, sorted
+        by descending score, and the matrices are cut to the longest row.
+        """
+        # ids are numbered as they come, then renumbered into the vocabulary order
+        index = {}
+        row_ids, blocks, filled = [], [], ROWS_PER_BLOCK
+        for query_id, hits in rows:
+            if filled == ROWS_PER_BLOCK:
+                blocks.append((
+                    np.full((ROWS_PER_BLOCK, width), -1, dtype=np.int32),
+                    np.full((ROWS_PER_BLOCK, width), -np.inf, dtype=np.float32)
+                ))
+                filled = 0
+            block_indices, block_scores = blocks[-1]
+
+            row_ids.append(query_id)
+            index.setdefault(query_id, len(index))
+            hits = list(hits)
+            row_indices = np.fromiter((index.setdefault(doc_id, len(index)) for doc_id, _ in hits), dtype=np.int32, count=len(hits))
+            row_scores = np.fromiter((score for _, score in hits), dtype=np.float32, count=len(hits))
+            order = top(row_scores, width)
+            block_indices[filled, :len(order)] = row_indices[order]
+            block_scores[filled, :len(order)] = row_scores[order]
+            filled += 1
+
+        n = len(row_ids)
+        indices = np.concatenate([block[0] for block in blocks])[:n] if blocks else np.full((0, width), -1, dtype=np.int32)
+        scores = np.concatenate([block[1] for block in blocks])[:n] if blocks else np.full((0, width), -np.inf, dtype=np.float32)
+        width = int((indices >= 0).sum(axis=1).max()) if n else 0
+
+        order = sorted(range(n), key=lambda i: str(row_ids[i]))
+        query_ids = [row_ids[i] for i in order]
+        known = set(query_ids)
+        ids = query_ids + sorted((id for id in index if id not in known), key=lambda x: str(x))
+        positions = {id: i for i, id in enumerate(ids)}
+        mapping = np.fromiter((positions[id] for id in index), dtype=np.int32, count=len(index))
+
+        indices = indices[order, :width]
+        return cls(ids, np.where(indices >= 0, mapping[indices], -1).astype(np.int32), scores[order, :width])
+
+    @classmethod
+    def from_matrix(cls, query_ids: List[str], doc_ids: List[str],
+                    indices: np.ndarray, scores: np.ndarray) -> "RankedLists":
+        """
+        Encodes search output where row i, already sorted, is the ranked list of query_ids[i]
+        and indices are positions in doc_ids, padded with -1.
+        """
+        order = sorted(range(len(query_ids)), key=lambda i: str(query_ids[i]))
+        sorted_query_ids = [query_ids[i] for i in order]
+        known = set(sorted_query_ids)
+        ids = sorted_query_ids + sorted((id for id in doc_ids if id not in known), key=lambda x: str(x))
+        index = {id: i for i, id in enumerate(ids)}
+
+        doc_map = np.fromiter((index[id] for id in doc_ids), dtype=np.int32, count=len(doc_ids))
+        indices = np.asarray(indices)[order]
+        scores = np.asarray(scores, dtype=np.float32)[order]
+        return cls(ids, np.where(indices >= 0, doc_map[indices], -1).astype(np.int32), scores)
+
+    @classmethod
+    def from_positions(cls, ids: List[str], indices: np.ndarray) -> "RankedLists":
+        """
+        Builds ranked lists scored by their position, as the UDLF output has no scores.
+        The first item of a list of size l gets score l, the last gets 1.
+        """
+        indices = compact(indices.astype(np.int32, copy=False))
+        sizes = (indices >= 0).sum(axis=1, keepdims=True)
+        scores = (sizes - np.arange(indices.shape[1])).astype(np.float32)
+        scores[indices < 0] = -np.inf
+        return cls(ids, indices, scores)
+
+    def to_beir(self, query_ids: Iterable[str] = None) -> Dict[str, Dict[str, float]]:
+        """
+        Decodes the ranked lists as BEIR results, optionally only for the given query ids.
+        """
+        rows = range(len(self)) if query_ids is None else [
+            self.index[query_id] for query_id in query_ids
+            if query_id in self.index and self.index[query_id] < len(self)
+        ]
+
+        results = {}
+        for i in rows:
+            valid = self.indices[i] >= 0
+            results[self.ids[i]] = dict(zip(
+                (self.ids[d] for d in self.indices[i][valid]),
+                self.scores[i][valid].tolist()
+            ))
+        return results
+
+    def truncate(self, depth: int = None) -> "RankedLists":
+        """
+        Keeps the first depth items of each ranked list, as views of the matrices.
+        """
+        if depth is None or depth >= self.width:
+            return self
+        return RankedLists(self.ids, self.indices[:, :depth], self.scores[:, :depth])
+
+    def text_size(self, start: int = 0) -> int:
+        """
+        Characters taken in the UDLF text format by the items from position start on.
+        """
+        lengths = np.fromiter((len(id) + 1 for id in self.ids), dtype=np.int64, count=len(self.ids))
+        indices = np.asarray(self.indices[:, start:])
+        return int(lengths[indices[indices >= 0]].sum())
+
+    def select(self, ids: List[str], n_queries: int) -> "RankedLists":
+        """
+        Keeps only the ranked lists of the first n_queries of ids, re-encoded over ids,
+        which must hold every id of this vocabulary.
+        """
+        index = {id: i for i, id in enumerate(ids)}
+        rows = np.fromiter((self.index[id] for id in ids[:n_queries]), dtype=np.int64, count=n_queries)
+        mapping = np.fromiter((index[id] for id in self.ids), dtype=np.int32, count=len(self.ids))
+
+        indices = np.asarray(self.indices[rows])
+        return RankedLists(ids, np.where(indices >= 0, mapping[indices], -1), np.asarray(self.scores[rows]))
+
+    def reencode(self, ids: List[str], n_queries: int) -> "RankedLists":
+        """
+        Re-encodes the ranked lists over another vocabulary, whose first n_queries ids are
+        the queries. Items missing from ids are dropped, queries missing from this
+        vocabulary get an empty list.
+        """
+        index = {id: i for i, id in enumerate(ids)}
+        mapping = np.fromiter((index.get(id, -1) for id in self.ids), dtype=np.int32, count=len(self.ids))
+        rows = np.fromiter((self.index.get(id, len(self)) for id in ids[:n_queries]), dtype=np.int64, count=n_queries)
+        known = rows < len(self)
+
+        indices = np.full((n_queries, self.width), -1, dtype=np.int32)
+        scores = np.full((n_queries, self.width), -np.inf, dtype=np.float32)
+        old = np.asarray(self.indices[rows[known]])
+        indices[known] = np.where(old >= 0, mapping[old], -1)
+        scores[known] = np.where(indices[known] >= 0, self.scores[rows[known]], -np.inf)
+
+        # dropped items leave gaps, moved to the end with their scores
+        order = np.argsort(indices < 0, axis=1, kind="stable")
+        return RankedLists(ids, np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1))
+
+    def rows_of(self, other: "RankedLists") -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Positions here of the queries of other with a list here, and their lists in other
+        mapped to this vocabulary, dropping the items it does not hold.
+        """
+        mapping = np.fromiter((self.index.get(id, -1) for id in other.ids), dtype=np.int32, count=len(other.ids))
+        rows = np.fromiter((self.index.get(id, len(self)) for id in other.query_ids), dtype=np.int64, count=len(other))
+        known = rows < len(self)
+
+        indices = np.asarray(other.indices[known])
+        indices = np.where(indices >= 0, mapping[indices], -1)
+        scores = np.where(indices >= 0, other.scores[known], -np.inf).astype(np.float32)
+        return rows[known], indices, scores
+
+    def replace(self, other: "RankedLists") -> "RankedLists":
+        """
+        Returns the ranked lists with the lists of the queries of other replaced by the
+        ones in other, widened when other is wider.
+        """
+        rows, indices, scores = self.rows_of(other)
+        width = max(self.width, other.width)
+        new_indices = np.full((len(self), width), -1, dtype=np.int32)
+        new_scores = np.full((len(self), width), -np.inf, dtype=np.float32)
+        new_indices[:, :self.width], new_scores[:, :self.width] = self.indices, self.scores
+
+        new_indices[rows], new_scores[rows] = -1, -np.inf
+        order = np.argsort(indices < 0, axis=1, kind="stable")
+        new_indices[rows, :other.width] = np.take_along_axis(indices, order, axis=1)
+        new_scores[rows, :other.width] = np.take_along_axis(scores, order, axis=1)
+        return RankedLists(self.ids, new_indices, new_scores)
+
+    def merge(self, other: "RankedLists") -> Tuple["RankedLists", np.ndarray]:
+        """
+        Merges the items of other into the lists of the same queries, keeping the width
+        best scored items of each, other being scored on the same scale.
+
+        Returns:
+            The merged ranked lists, and the positions of the lists that took an item of other.
+        """
+        rows, indices, scores = self.rows_of(other)
+        candidates = np.concatenate([np.asarray(self.indices[rows]), indices], axis=1)
+        candidate_scores = np.concatenate([np.asarray(self.scores[rows]), scores], axis=1)
+        sources = np.broadcast_to(np.arange(candidates.shape[1]) >= self.width, candidates.shape)
+
+        # an item in both lists is counted once, with its best score
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        sources = np.take_along_axis(sources, order, axis=1)
+        by_index = np.argsort(candidates, axis=1, kind="stable")
+        sorted_candidates = np.take_along_axis(candidates, by_index, axis=1)
+        repeated = np.zeros(candidates.shape, dtype=bool)
+        repeated[:, 1:] = (sorted_candidates[:, 1:] == sorted_candidates[:, :-1]) & (sorted_candidates[:, 1:] >= 0)
+        duplicate = np.empty_like(repeated)
+        np.put_along_axis(duplicate, by_index, repeated, axis=1)
+        candidate_scores[duplicate] = -np.inf
+
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")[:, :self.width]
+        merged_indices = np.take_along_axis(candidates, order, axis=1)
+        merged_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        merged_indices[merged_scores == -np.inf] = -1
+        changed = (np.take_along_axis(sources, order, axis=1) & (merged_indices >= 0)).any(axis=1)
+
+        new_indices, new_scores = np.array(self.indices), np.array(self.scores)
+        new_indices[rows[changed]] = merged_indices[changed]
+        new_scores[rows[changed]] = merged_scores[changed]
+        return RankedLists(self.ids, new_indices, new_scores), rows[changed]
+
+    def with_query_first(self) -> "RankedLists":
+        """
+        Returns the ranked lists with each query as the first item of its own list,
+        as the UDLF input expects. Lists that did not retrieve the query grow by one.
+
+        Raises:
+            ValueError: A query appears more than once in its own list.
+        """
+        n = len(self)
+        rows = np.arange(n, dtype=np.int32)
+        others = self.indices != rows[:, None]
+
+        repeated = np.flatnonzero((~others).sum(axis=1) > 1)
+        if len(repeated):
+            raise ValueError(f"Query ID {self.ids[repeated[0]]} appears multiple times in the ranked list.")
+
+        order = np.argsort(~others, axis=1, kind="stable")
+        rest_indices = np.take_along_axis(np.where(others, self.indices, -1), order, axis=1)
+        rest_scores = np.take_along_axis(np.where(others, self.scores, -np.inf), order, axis=1)
+
+        indices = np.full((n, self.width + 1), -1, dtype=np.int32)
+        scores = np.full((n, self.width + 1), -np.inf, dtype=np.float32)
+        indices[:, 0] = rows
+        scores[:, 0] = np.inf
+        indices[:, 1:] = rest_indices
+        scores[:, 1:] = rest_scores
+
+        if others.all(axis=1).any():
+            return RankedLists(self.ids, indices, scores)
+        return RankedLists(self.ids, indices[:, :-1], scores[:, :-1])
+
+    def rows(self) -> Iterable[Tuple[str, Sequence[str]]]:
+        """
+        Yields the (query_id, doc_ids) row of each ranked list, for write_ranked_lists.
+        """
+        ids = np.asarray(self.ids, dtype=object)
+        for i in range(len(self)):
+            row = np.asarray(self.indices[i])
+            yield self.ids[i], ids[row[row >= 0]]
+
+    def digest(self) -> str:
+        """
+        Hash of the ids, indices and scores, telling whether two ranked lists are the same.
+        """
+        digest = hashlib.sha1("\n".join(self.ids).encode())
+        digest.update(np.ascontiguousarray(self.indices, dtype=np.int32).tobytes())
+        digest.update(np.ascontiguousarray(self.scores, dtype=np.float32).tobytes())
+        return digest.hexdigest()
+
+    def save(self, path: str):
+        """
+        Saves the ranked lists in the binary format: a directory with the int32 indices
+        and float32 scores as .npy matrices plus the ids, one per line.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, INDICES_FILE), np.ascontiguousarray(self.indices, dtype=np.int32))
+        np.save(os.path.join(path, SCORES_FILE), np.ascontiguousarray(self.scores, dtype=np.float32))
+        with open(os.path.join(path, IDS_FILE), "w") as f:
+            f.write("\n".join(self.ids))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "RankedLists":
+        """
+        Loads ranked lists saved by save(), the matrices are memory-mapped read-only by default.
+        """
+        mmap_mode = "r" if mmap else None
+        indices = np.load(os.path.join(path, INDICES_FILE), mmap_mode=mmap_mode)
+        scores = np.load(os.path.join(path, SCORES_FILE), mmap_mode=mmap_mode)
+        with open(os.path.join(path, IDS_FILE)) as f:
+            ids = f.read().splitlines()
+        return cls(ids, indices, scores)
+
+    @classmethod
+    def from_text(cls, ranked_list_path: str, ids: List[str], n_queries: int = None) -> "RankedLists":
+        """
+        Parses a UDLF ranked list file, streaming it line by line, scored by position.
+        Each line is the ranked list of its first id, which is kept as the first item.
+
+        Parameters:
+            ranked_list_path (str): UDLF ranked list file.
+            ids (List[str]): Vocabulary, starting with the queries.
+            n_queries (int): Only the lines of the first n_queries ids are parsed, the
+                others are skipped without splitting them. Default is every id.
+        """
+        index = {id: i for i, id in enumerate(ids)}
+        n = len(ids) if n_queries is None else n_queries
+        rows = {}
+        with open(ranked_list_path) as f:
+            for line in f:
+                query_id = line.split(" ", 1)[0].strip()
+                if not query_id:
+                    continue
+
+                # showing failures
+                if query_id not in index:
+                    print(f"Query {query_id} not found in the results")
+                    continue
+                if index[query_id] >= n:
+                    continue
+
+                rows[index[query_id]] = np.fromiter(
+                    (index[item] for item in line.split() if item in index), dtype=np.int32
+                )
+
+        width = max((len(row) for row in rows.values()), default=0)
+        indices = np.full((n, width), -1, dtype=np.int32)
+        for i, row in rows.items():
+            indices[i, :len(row)] = row
+
+        return cls.from_positions(ids, indices)
+
+    def to_text(self, ranked_list_path: str, lists_path: str = None, query_first: bool = False,
+                depth: int = None) -> int:
+        """
+        Streams the ranked lists in the UDLF text format, optionally with its lists file.
+
+        Parameters:
+            ranked_list_path (str): Ranked list file.
+            lists_path (str): Lists file, not written by default.
+            query_first (bool): Writes each query as the first item of its own list.
+            depth (int): Items per line. Default keeps every item.
+
+        Returns:
+            Number of ranked lists written.
+        """
+        size = write_ranked_lists(ranked_list_path, self.rows(), depth=depth, query_first=query_first)
+
+        if lists_path is not None:
+            write_lines(lists_path, self.query_ids)
+
+        return size
@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from collections import deque
+from typing import Dict, List
+from udl.udlf import UDLF, UDLFConfig
+from udl.ranked_lists import RankedLists
+
+DEFAULT_SERVING_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "serving")
+# what a saved neighbour graph was built from, next to its matrices
+GRAPH_META_FILE = "graph.json"
+
+
+class LatencyStats:
+    """
+    Latencies of the last requests, per stage, and their percentiles.
+    """
+
+    def __init__(self, window: int = 10000):
+        """
+        Parameters:
+            window (int): Requests the percentiles are computed over.
+        """
+        self.window = window
+        self.latencies = {}
+        self.requests = 0
+        self.degraded = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, latencies: Dict[str, float], degraded: bool):
+        with self.lock:
+            self.requests += 1
+            self.degraded += degraded
+            for name, seconds in latencies.items():
+                self.latencies.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def summary(self) -> dict:
+        with self.lock:
+            summary = {
+                "requests": self.requests,
+                "degraded": self.degraded,
+                "uptime_seconds": time.time() - self.started
+            }
+            for name, values in self.latencies.items():
+                values = np.fromiter(values, dtype=np.float64) * 1000
+                summary[f"{name}_p50_ms"] = float(np.percentile(values, 50))
+                summary[f"{name}_p99_ms"] = float(np.percentile(values, 99))
+        return summary
+
+
+class QueryService:
+    """
+    Serves unseen queries with the contextual re-ranking computed offline.
+
+    The neighbour graph is the UDLF output of every dataset query and corpus doc,
+    held in memory. A query is retrieved for with the model, then its ranked list is
+    expanded with the refined lists of its first docs: a doc scores by reciprocal
+    rank in the query list, plus, for each expanded doc, the reciprocal rank of that
+    doc times the reciprocal rank of the doc in its refined list. The expansion stops
+    when the latency budget runs out, and the query list is returned as it is when
+    the retrieval already took the whole budget.
+    """
+
+    def __init__(self, model: UDLF, graph: RankedLists, depth: int = 100, expansion: int = 10,
+                 neighbours: int = 20, weight: float = 0.5, rrf_k: int = 60, budget_ms: float = 100.0,
+                 expansion_block: int = 4):
+        """
+        Parameters:
+            model (UDLF): Retrieval model, searched with search_texts.
+            graph (RankedLists): UDLF output of the dataset, see build_graph.
+            depth (int): Items retrieved for each query.
+            expansion (int): First docs of the query list whose refined lists are used.
+            neighbours (int): Items of each refined list used.
+            weight (float): Weight of the refined lists, the query list weighing 1 - weight.
+            rrf_k (int): Rank offset of the reciprocal ranks.
+            budget_ms (float): Default latency budget of a query, in milliseconds.
+            expansion_block (int): Refined lists added between two checks of the budget.
+        """
+        self.model = model
+        self.graph = graph
+        self.depth = depth
+        self.expansion = expansion
+        self.neighbours = neighbours
+        self.weight = weight
+        self.rrf_k = rrf_k
+        self.budget_ms = budget_ms
+        self.expansion_block = expansion_block
+        self.stats = LatencyStats()
+
+    @staticmethod
+    def graph_meta(model: UDLF, config: UDLFConfig) -> dict:
+        """
+        Hashes of the method config and of the model results a neighbour graph is built from.
+        """
+        from models.commons.checkpoint import config_hash
+
+        return {
+            "config": config_hash({"params": config.params(), "backend": config.backend}),
+            "results": model.results.digest()
+        }
+
+    @staticmethod
+    def build_graph(model: UDLF, config: UDLFConfig, path: str) -> RankedLists:
+        """
+        Loads the neighbour graph saved in path when it was built with the same method
+        parameters from the same model results, otherwise re-ranks the model results with
+        config and saves the graph there. The model results are retrieved, or loaded from
+        the cache, first.
+        """
+        if model.results is None:
+            model.retrieve()
+        meta = QueryService.graph_meta(model, config)
+
+        meta_path = os.path.join(path, GRAPH_META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                if json.load(f) == meta:
+                    return RankedLists.load(path)
+            print(f"The neighbour graph in {path} was built from another config or results, rebuilding it")
+
+        model.udlf_run(config)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        model.udlf_results.save(tmp_path)
+        with open(os.path.join(tmp_path, GRAPH_META_FILE), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return model.udlf_results
+
+    def expand(self, doc_ids: List[str], deadline: float):
+        """
+        Re-ranks a query list with the refined lists of its first docs, until the deadline.
+        Returns the positions in the graph and their scores, by descending score, and
+        whether every refined list was used.
+        """
+        positions = np.fromiter((self.graph.index.get(id, -1) for id in doc_ids), dtype=np.int64, count=len(doc_ids))
+        ranks = np.arange(len(doc_ids))
+        known = positions >= 0
+        candidates = [positions[known]]
+        values = [(1 - self.weight) / (self.rrf_k + ranks[known] + 1)]
+
+        # the refined lists are those of the docs that are queries of the graph
+        rows = np.flatnonzero(known & (positions < len(self.graph)))[:self.expansion]
+        expanded = 0
+        neighbour_weights = (self.rrf_k + 1) / (self.rrf_k + np.arange(self.neighbours) + 1)
+        for start in range(0, len(rows), self.expansion_block):
+            if time.perf_counter() >= deadline:
+                break
+            block = rows[start:start + self.expansion_block]
+            lists = np.asarray(self.graph.indices[positions[block], :self.neighbours])
+            valid = lists >= 0
+            weights = self.weight / (self.rrf_k + ranks[block] + 1)
+            candidates.append(lists[valid])
+            values.append((weights[:, None] * neighbour_weights[:lists.shape[1]])[valid])
+            expanded += len(block)
+
+        keys, inverse = np.unique(np.concatenate(candidates), return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=np.concatenate(values))
+        order = np.argsort(-totals, kind="stable")
+        return keys[order], totals[order], expanded == len(rows)
+
+    def search(self, text: str, top_k: int = 10, budget_ms: float = None) -> dict:
+        """
+        Retrieves and re-ranks the results of a query within the latency budget.
+
+        Returns:
+            The top_k results as {"id", "score"}, whether the budget cut the re-ranking
+            short, and the latency of each stage in milliseconds.
+        """
+        budget = (self.budget_ms if budget_ms is None else budget_ms) / 1000
+        start = time.perf_counter()
+        deadline = start + budget
+
+        hits = self.model.search_texts([text], self.depth)[0]
+        retrieved = time.perf_counter()
+
+        if retrieved >= deadline:
+            results = [{"id": doc_id, "score": score} for doc_id, score in hits[:top_k]]
+            reranked = False
+        else:
+            positions, scores, reranked = self.expand([doc_id for doc_id, _ in hits], deadline)
+            results = [
+                {"id": self.graph.ids[position], "score": float(score)}
+                for position, score in zip(positions[:top_k], scores[:top_k])
+            ]
+        end = time.perf_counter()
+
+        degraded = not reranked
+        latencies = {"total": end - start, "retrieval": retrieved - start, "rerank": end - retrieved}
+        self.stats.record(latencies, degraded)
+        return {
+            "results": results,
+            "degraded": degraded,
+            "latency_ms": {name: seconds * 1000 for name, seconds in latencies.items()}
+        }
+
+    def metrics(self) -> dict:
+        return self.stats.summary()
@@ -0,0 +1,357 @@
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List
+from beir.retrieval.evaluation import EvaluateRetrieval
+from udl.udlf import UDLF, UDLFConfig, max_depth
+from udl.helpers.config import UDLFConfigHelper
+from udl.ranked_lists import RankedLists, write_lines
+from udl.driver import UDLFDriver
+from models.commons.instrumentation import PROFILER, stage
+
+# depth and format of the shared inputs, written once they are complete
+INPUT_FILE = "input.json"
+# aligned ranked lists of each retriever of a fusion model, fused by the UDLF fusion task
+MEMBER_RANKED_LIST_FILE = "ranked_list_{}.txt"
+
+
+def grid(method_class, **params) -> Dict[str, UDLFConfig]:
+    """
+    Builds a method config for every combination of the given parameter values.
+
+    Example:
+        grid(CPRRMethod, l=[100], k=[3, 5], t=[1, 2]) gives four CPRR configs, named as "CPRR(l=100,k=3,t=1)".
+    """
+    configs = {}
+    names = list(params.keys())
+    for values in itertools.product(*(params[name] for name in names)):
+        config = method_class(**dict(zip(names, values)))
+        configs[describe(config, names)] = config
+    return configs
+
+
+def describe(config: UDLFConfig, names: List[str]) -> str:
+    return f"{config.method}({','.join(f'{name}={getattr(config, name)}' for name in names)})"
+
+
+class SweepDataset:
+    """
+    Stands for the BEIR dataset in a worker, which only needs its name and qrels.
+    """
+
+    def __init__(self, dataset_name: str, qrels: dict):
+        self.dataset_name = dataset_name
+        self.qrels = qrels
+
+
+class SweepJob(UDLF):
+    """
+    Runs one method config in its own working directory, over the shared ranked lists.
+    """
+
+    def __init__(self, workdir: str, dataset_name: str, name: str, results: RankedLists,
+                 qrels: dict, k_values: list, shared_input_dir: str, prune_to_qrels: bool = False,
+                 fusion_paths: List[str] = None):
+        super().__init__(beir_local_datasets_path=workdir + "/", dataset_name=dataset_name,
+                         prune_to_qrels=prune_to_qrels)
+        self.dataset = SweepDataset(dataset_name, qrels)
+        self.name = name
+        self.results = results
+        self.k_values = k_values
+        self.retriever = EvaluateRetrieval(k_values=k_values)
+        self.ndcg, self._map, self.recall, self.precision = None, None, None, None
+
+        # the text input is written once for every job, only the config and the output are per job
+        os.makedirs(os.path.dirname(self.config_ini_path), exist_ok=True)
+        self.ranked_list_path = os.path.join(shared_input_dir, "ranked_list.txt")
+        self.lists_path = os.path.join(shared_input_dir, "lists.txt")
+        self.fusion_paths = fusion_paths
+
+    def udlf_input(self, config: UDLFConfig, write_input: bool = False) -> "InputType":
+        """
+        The binary of a fusion model's job runs the UDLF fusion task over the aligned
+        lists of its retrievers, as FusionModel.udlf_run does.
+        """
+        if self.fusion_paths is None:
+            return super().udlf_input(config, write_input)
+
+        params = UDLFConfigHelper.create_fusion_config(
+            size=len(self.results),
+            lists_path=self.lists_path,
+            output_path=self.output_path
+        ) | config.params()
+        return self.input_config(params, self.fusion_paths)
+
+    @property
+    def data(self):
+        return {
+            "dataset": self.dataset_name,
+            "k_values": self.k_values,
+            "retriever": self.name,
+            "ndcg": self.ndcg,
+            "map": self._map,
+            "recall": self.recall,
+            "precision": self.precision
+        }
+
+
+# state of each worker process, set once by the pool initializer
+_worker = {}
+
+
+def _init_worker(shared_dir: str, qrels: dict, binary_path: str):
+    _worker["results"] = RankedLists.load(os.path.join(shared_dir, "ranked_lists"))
+    _worker["qrels"] = qrels
+    _worker["shared_dir"] = shared_dir
+    UDLF.set_binary_path(binary_path)
+
+
+def _run_job(job: dict):
+    with stage("udlf_job", dataset=job["dataset_name"], model=job["model_name"], method=job["method_name"]):
+        result = _run_sweep_job(job)
+    # the stage records of the job go back to the parent process
+    return result + (PROFILER.take(),)
+
+
+def _run_sweep_job(job: dict):
+    try:
+        sweep_job = SweepJob(
+            workdir=job["workdir"],
+            dataset_name=job["dataset_name"],
+            name=job["model_name"],
+            results=_worker["results"],
+            qrels=_worker["qrels"],
+            k_values=job["k_values"],
+            shared_input_dir=_worker["shared_dir"],
+            prune_to_qrels=job["prune_to_qrels"],
+            fusion_paths=job["fusion_paths"]
+        )
+        sweep_job.udlf_run(config=job["config"], write_input=False)
+        sweep_job.evaluate_udlf()
+        return job["method_name"], sweep_job.dataframe(method=job["method_name"]), None
+    except Exception:
+        return job["method_name"], None, traceback.format_exc()
+
+
+class SweepRunner:
+    """
+    Runs a set of UDLF method configs over the results of a model on a bounded process
+    pool. The ranked lists are saved once in the binary format and memory-mapped
+    read-only by every worker, and each job gets its own working directory, so no
+    job overwrites the config or output of another. A failed config is reported
+    without stopping the others.
+    """
+
+    def __init__(self, model: UDLF, workdir: str = None, max_workers: int = None):
+        """
+        Parameters:
+            model (UDLF): Model with retrieved results.
+            workdir (str): Directory of the jobs. Default is a temporary directory, removed afterwards.
+            max_workers (int): Size of the process pool. Default is the number of cores.
+        """
+        self.model = model
+        self.workdir = workdir
+        self.max_workers = max_workers or os.cpu_count()
+        self.failures = {}
+        self.truncation = None
+
+    def truncation_report(self, results: RankedLists, texts: list, seconds: float) -> dict:
+        """
+        Bytes not written thanks to the truncation, in the binary and text inputs, and the
+        writing time saved, estimated in proportion to the bytes.
+
+        Parameters:
+            texts (list): (full, truncated) ranked lists of each text input.
+        """
+        width = self.model.results.width
+        binary_bytes = len(results) * results.width * 8
+        binary_saved = len(results) * (width - results.width) * 8
+
+        text_bytes = sum(truncated.text_size() for _, truncated in texts)
+        text_saved = sum(full.text_size(truncated.width) for full, truncated in texts)
+
+        written = binary_bytes + text_bytes
+        return {
+            "width": width,
+            "depth": results.width,
+            "bytes_written": written,
+            "bytes_saved": binary_saved + text_saved,
+            "seconds": seconds,
+            "seconds_saved": seconds * (binary_saved + text_saved) / written if written else 0.0
+        }
+
+    def members(self) -> list:
+        """
+        Aligned ranked lists of each retriever of a fusion model, None for a single retriever.
+        """
+        return getattr(self.model, "aligned", None)
+
+    def fusion_paths(self, shared_dir: str) -> List[str]:
+        members = self.members()
+        if members is None:
+            return None
+        return [os.path.join(shared_dir, MEMBER_RANKED_LIST_FILE.format(i)) for i in range(len(members))]
+
+    def write_input(self, shared_dir: str, methods: Dict[str, UDLFConfig]):
+        """
+        Writes the shared binary and text inputs, unless a previous run of the same
+        working directory left inputs deep enough for the methods. The text input of a
+        fusion model is the aligned lists of its retrievers, for the UDLF fusion task.
+        """
+        # the ranked lists are truncated once to the deepest method, before any input is written
+        depth = max_depth(methods.values())
+        text = any(config.backend == "binary" for config in methods.values())
+        fusion_paths = self.fusion_paths(shared_dir)
+
+        input_path = os.path.join(shared_dir, INPUT_FILE)
+        if os.path.exists(input_path):
+            with open(input_path) as f:
+                written = json.load(f)
+            if ((written["text"] or not text) and written.get("fusion") == (fusion_paths is not None)
+                    and (written["depth"] is None or (depth is not None and written["depth"] >= depth))):
+                print(f"Reusing the UDLF input of {shared_dir}")
+                return
+            os.remove(input_path)
+
+        results = self.model.results.truncate(depth)
+        start = time.perf_counter()
+        results.save(os.path.join(shared_dir, "ranked_lists"))
+        texts = []
+        if text and fusion_paths is not None:
+            for member, path in zip(self.members(), fusion_paths):
+                truncated = member.truncate(depth)
+                truncated.to_text(path, query_first=True, depth=depth)
+                texts.append((member, truncated))
+            write_lines(os.path.join(shared_dir, "lists.txt"), results.query_ids)
+        elif text:
+            results.to_text(
+                os.path.join(shared_dir, "ranked_list.txt"),
+                os.path.join(shared_dir, "lists.txt"),
+                query_first=True,
+                depth=depth
+            )
+            texts.append((self.model.results, results))
+        self.truncation = self.truncation_report(results, texts, time.perf_counter() - start)
+        print(f"Truncated ranked lists from {self.truncation['width']} to {self.truncation['depth']} items, "
+              f"saving {self.truncation['bytes_saved']} bytes and about {self.truncation['seconds_saved']:.2f}s of writing")
+
+        # written last, it marks the inputs as complete
+        with open(input_path, "w") as f:
+            json.dump({"depth": depth, "text": text, "fusion": fusion_paths is not None}, f)
+
+    def prepare(self, methods: Dict[str, UDLFConfig]):
+        """
+        Writes the shared input, returns the working directory, the shared directory and the jobs.
+        """
+        workdir = self.workdir or tempfile.mkdtemp(prefix="udlf-sweep-")
+        shared_dir = os.path.join(workdir, "shared")
+        os.makedirs(shared_dir, exist_ok=True)
+        with stage("write_udlf_input", dataset=self.model.dataset.dataset_name, model=self.model.name):
+            self.write_input(shared_dir, methods)
+
+        jobs = [{
+            "workdir": os.path.join(workdir, f"job-{i}"),
+            "dataset_name": self.model.dataset.dataset_name,
+            "model_name": self.model.name,
+            "k_values": self.model.k_values,
+            "method_name": method_name,
+            "config": config,
+            "prune_to_qrels": self.model.prune_to_qrels,
+            # the binary of a fusion model runs the fusion task, the native backend re-ranks the fused lists
+            "fusion_paths": self.fusion_paths(shared_dir) if config.backend == "binary" else None
+        } for i, (method_name, config) in enumerate(methods.items())]
+        return workdir, shared_dir, jobs
+
+    def run(self, methods: Dict[str, UDLFConfig],
+            on_result: Callable[[str, pd.DataFrame], None] = None) -> List[pd.DataFrame]:
+        """
+        Returns one dataframe per successful config, in the final_results.csv schema.
+        Failures are kept in self.failures by method name.
+
+        Parameters:
+            methods (Dict[str, UDLFConfig]): Method configs by name.
+            on_result (Callable): Called with the name and dataframe of each config as soon as it finishes.
+        """
+        workdir, shared_dir, jobs = self.prepare(methods)
+        results, self.failures = {}, {}
+        with ProcessPoolExecutor(
+                max_workers=min(self.max_workers, len(jobs)) or 1,
+                initializer=_init_worker,
+                initargs=(shared_dir, self.model.dataset.qrels, UDLF.binary_path)
+        ) as executor:
+            for future in as_completed([executor.submit(_run_job, job) for job in jobs]):
+                method_name, dataframe, error, records = future.result()
+                PROFILER.extend(records)
+                if error is not None:
+                    print(f"Method {method_name} failed:\n{error}")
+                    self.failures[method_name] = error
+                else:
+                    results[method_name] = dataframe
+                    if on_result is not None:
+                        on_result(method_name, dataframe)
+
+        if self.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        # in the order of the methods
+        return [results[method_name] for method_name in methods if method_name in results]
+
+    async def run_async(self, methods: Dict[str, UDLFConfig], driver: UDLFDriver,
+                        on_result: Callable[[str, pd.DataFrame], None] = None) -> List[pd.DataFrame]:
+        """
+        run on an event loop instead of a process pool: the binaries run as jobs of the
+        driver, which bounds them with every other job it runs, e.g. of other datasets,
+        and each output is evaluated on a thread while the other jobs go on.
+        """
+        workdir, shared_dir, jobs = await asyncio.to_thread(self.prepare, methods)
+        shared_results = RankedLists.load(os.path.join(shared_dir, "ranked_lists"))
+
+        async def run_job(job: dict):
+            with stage("udlf_job", dataset=job["dataset_name"], model=job["model_name"], method=job["method_name"]):
+                try:
+                    sweep_job = SweepJob(
+                        workdir=job["workdir"],
+                        dataset_name=job["dataset_name"],
+                        name=job["model_name"],
+                        results=shared_results,
+                        qrels=self.model.dataset.qrels,
+                        k_values=job["k_values"],
+                        shared_input_dir=shared_dir,
+                        prune_to_qrels=job["prune_to_qrels"],
+                        fusion_paths=job["fusion_paths"]
+                    )
+                    await sweep_job.udlf_run_async(job["config"], driver, write_input=False)
+                    await asyncio.to_thread(sweep_job.evaluate_udlf)
+                    return job["method_name"], sweep_job.dataframe(method=job["method_name"]), None
+                except Exception:
+                    return job["method_name"], None, traceback.format_exc()
+
+        results, self.failures = {}, {}
+        tasks = [asyncio.create_task(run_job(job)) for job in jobs]
+        try:
+            for task in asyncio.as_completed(tasks):
+                method_name, dataframe, error = await task
+                if error is not None:
+                    print(f"Method {method_name} failed:\n{error}")
+                    self.failures[method_name] = error
+                else:
+                    results[method_name] = dataframe
+                    if on_result is not None:
+                        on_result(method_name, dataframe)
+        finally:
+            # a cancelled sweep cancels its jobs, which kill their binaries
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        return [results[method_name] for method_name in methods if method_name in results]
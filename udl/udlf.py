@@ -1,18 +1,97 @@
-from pyUDLF import run_calls as udlf
-from beir.retrieval.evaluation import EvaluateRetrieval
-from udl.input_type import InputType
+import asyncio
+import os
 from udl.helpers.config import UDLFConfigHelper
 from abc import ABC, abstractmethod
 from models.commons.output import CommonOutput
-from typing import List
+from udl import native
+from udl.ranked_lists import RankedLists, compact, exclude_queries, write_lines
+from udl.evaluation import Evaluator
+from udl.driver import UDLFDriver, UDLFJob, estimate_memory
+from models.commons.instrumentation import current_labels, instrumented, stage
+import numpy as np
+from typing import List, Tuple
+
+# prefix of the ids of queries given as text, see search_texts
+TEXT_QUERY_PREFIX = "text-query-"
 
 class UDLFConfig(ABC):
+    backend = "binary"
+
     @abstractmethod
     def params(self):
         pass
 
+    def run_native(self, ranks):
+        """
+        Runs the method in-process over a (n, width) matrix of integer ranked lists.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} has no native backend")
+
+    def depth(self):
+        """
+        Items of each ranked list the method reads, None when it reads all of them.
+        """
+        return None
+
+    def reach(self):
+        """
+        Hops over the ranked lists, from a list to the ones it holds or that hold it, within
+        which a change of one list can move the native output of another. None when unbounded.
+        """
+        return None
+
+def max_depth(configs) -> int:
+    """
+    Largest depth read by the given method configs, None when one of them reads every item.
+    """
+    depths = [config.depth() for config in configs]
+    if not depths or any(depth is None for depth in depths):
+        return None
+    return max(depths)
+
+def text_query_ids(n: int) -> List[str]:
+    """
+    Ids of queries given as text, outside the dataset, sorted as strings in their order.
+    """
+    return [f"{TEXT_QUERY_PREFIX}{i:08d}" for i in range(n)]
+
+
+def search_hits(doc_ids: List[str], indices: np.ndarray, scores: np.ndarray) -> List[List[Tuple[str, float]]]:
+    """
+    (doc_id, score) hits of each row of a search output, padding dropped.
+    """
+    return [
+        [(doc_ids[i], float(score)) for i, score in zip(row_indices, row_scores) if i >= 0]
+        for row_indices, row_scores in zip(indices, scores)
+    ]
+
+
+def native_ranks(results: RankedLists, config: UDLFConfig) -> np.ndarray:
+    """
+    Integer ranked lists read by the native method of config: each query first, cut to
+    the depth of the method, over the queries alone.
+    """
+    ranked_lists = results.truncate(config.depth()).with_query_first()
+
+    # the UDLF dataset is made of the queries, drop retrieved docs that are not one
+    n = len(ranked_lists)
+    return compact(np.where(ranked_lists.indices < n, ranked_lists.indices, -1))
+
+
+def native_rerank(results: RankedLists, config: UDLFConfig) -> RankedLists:
+    """
+    Re-ranks the ranked lists in-process with the method of config.
+    """
+    reranked = config.run_native(native_ranks(results, config))
+
+    # the query is not part of its own results
+    return RankedLists.from_positions(results.ids, exclude_queries(reranked))
+
+
 class UDLF(CommonOutput):
     binary_path = None
+    cache = None
+    timeout = None
 
     @staticmethod
     def set_binary_path(path: str):
@@ -21,30 +100,90 @@ class UDLF(CommonOutput):
         """
         UDLF.binary_path = path
 
-    def __init__(self, beir_local_datasets_path: str, dataset_name: str):
+    @staticmethod
+    def set_timeout(seconds: float):
+        """
+        Configure the seconds a run of the UDLF binary may take, None waits for it.
+        """
+        UDLF.timeout = seconds
+
+    @staticmethod
+    def set_cache(cache):
+        """
+        Configure the cache of retrieval results, None disables it.
+        """
+        UDLF.cache = cache
+
+    def __init__(self, beir_local_datasets_path: str, dataset_name: str, prune_to_qrels: bool = False):
+        """
+        Parameters:
+            beir_local_datasets_path (str): Directory of the BEIR datasets.
+            dataset_name (str): Dataset name, its directory holds the UDLF files.
+            prune_to_qrels (bool): Keeps only the UDLF output of queries with qrels. The
+                UDLF input still holds every ranked list, as the methods need them.
+        """
         self.beir_local_datasets_path = beir_local_datasets_path
         self.dataset_name = dataset_name
         self.ranked_list_path = f"{self.beir_local_datasets_path}{self.dataset_name}/ranked_list.txt"
         self.lists_path = f"{self.beir_local_datasets_path}{self.dataset_name}/lists.txt"
         self.output_path = f"{self.beir_local_datasets_path}{self.dataset_name}/udlf"
         self.config_ini_path = f"{self.beir_local_datasets_path}{self.dataset_name}/config.ini"
+        self.ranked_lists_dir = f"{self.beir_local_datasets_path}{self.dataset_name}/ranked_lists"
+        self.udlf_jobs_dir = f"{self.beir_local_datasets_path}{self.dataset_name}/udlf_jobs"
         self.udlf_config = None
+        self.evaluators = {}
+        self.prune_to_qrels = prune_to_qrels
+        self.pruned_ids, self.pruned_queries = None, None
+        self.changed_rows, self.former_neighbours = None, None
 
-    def udlf_run(self, config: UDLFConfig):
-        #
-        # Binary Path and Config File Path
-        #
-        udlf.setBinaryPath(UDLF.binary_path)
-        udlf.setConfigPath(self.config_ini_path)
+    def udlf_run(self, config: UDLFConfig, write_input: bool = True):
+        """
+        Re-ranks the results with a UDLF method into self.udlf_results.
 
-        #
-        # Set Parameters
-        #
-        self.write_udlf_ranked_list_file()
-        size = self.write_udlf_lists_file()
+        Parameters:
+            config (UDLFConfig): Method and its parameters.
+            write_input (bool): Writes the ranked list and lists files, unset when they are already in place.
+        """
+        # a sweep job is already labelled with the name of its config
+        method = current_labels().get("method") or config.method
+        with stage("udlf", dataset=self.dataset_name, model=getattr(self, "name", None), method=method):
+            if config.backend == "native":
+                self.native_run(config)
+                return
 
-        # Initiate config by using InputType class
-        self.udlf_config = InputType()
+            job = self.udlf_job(config, write_input)
+            # a blocking run, the caller may already be on an event loop
+            UDLFDriver(UDLF.binary_path, timeout=UDLF.timeout).run_sync(job)
+            self.output_results_path = job.output_path
+            self.read_results()
+
+    async def udlf_run_async(self, config: UDLFConfig, driver: UDLFDriver, write_input: bool = True):
+        """
+        udlf_run on an event loop: the binary runs as a job of the driver, the native
+        backend and the reading of the output run on a thread, so other jobs go on.
+        """
+        method = current_labels().get("method") or config.method
+        with stage("udlf", dataset=self.dataset_name, model=getattr(self, "name", None), method=method):
+            if config.backend == "native":
+                depth = config.depth() or self.results.width
+                async with driver.slot(estimate_memory(len(self.results), depth)):
+                    await asyncio.to_thread(self.native_run, config)
+                return
+
+            job = await asyncio.to_thread(self.udlf_job, config, write_input)
+            await driver.run(job)
+            self.output_results_path = job.output_path
+            await asyncio.to_thread(self.read_results)
+
+    def udlf_input(self, config: UDLFConfig, write_input: bool = True) -> "InputType":
+        """
+        Writes the input files, unless write_input is unset, and returns the UDLF parameters of the run.
+        """
+        if write_input:
+            self.write_udlf_ranked_list_file(depth=config.depth())
+            size = self.write_udlf_lists_file()
+        else:
+            size = len(self.results)
 
         params = UDLFConfigHelper.create_config(
             size=size,
@@ -52,109 +191,319 @@ class UDLF(CommonOutput):
             lists_path=self.lists_path,
             output_path=self.output_path
         ) | config.params()
+        return self.input_config(params)
 
+    def input_config(self, params: dict, input_files: List[str] = None) -> "InputType":
+        """
+        UDLF parameters of a run, with the ranked list files of the fusion task when given.
+        """
+        # pyUDLF is only needed by the binary backend
+        from pyUDLF import run_calls as udlf
+        from udl.input_type import InputType
+
+        udlf.setBinaryPath(UDLF.binary_path)
+        udlf.setConfigPath(self.config_ini_path)
+
+        # Initiate config by using InputType class
+        self.udlf_config = InputType()
         for key, value in params.items():
             print("Setting parameter", key, "to", value)
             self.udlf_config.set_param(key, value)
+        if input_files is not None:
+            self.udlf_config.set_input_files(input_files)
+        return self.udlf_config
 
-        #
-        # Execute UDLF
-        #
-        self.response = udlf.run(
-            self.udlf_config,
-            get_output = True
-        )
-
-        self.output_results_path = self.response.rk_path
-        self.read_results()
-        
-    def read_results(self):
-        output_results = {}
-        data = open(self.output_results_path).read()
-        for line in data.splitlines():
-            items = line.split(" ")
-            query_id = items[0]
-            doc_ids = items[1:]
-
-            # showing failures
-            if query_id not in self.results.keys():
-                print(f"Query {query_id} not found in the results")
-                continue
-
-            # construct the results as BEIR expects them {query_id: {doc_id: score, ...}}
-            # score will be the position
-            l = len(doc_ids)
-            doc_id_with_positions = {doc_id: l - i for i, doc_id in enumerate(doc_ids)}
-            output_results.update({query_id: doc_id_with_positions})
-        
-        self.udlf_results = output_results
-
-    def write_udlf_ranked_list_file(self) -> int:
+    def udlf_job(self, config: UDLFConfig, write_input: bool = True) -> UDLFJob:
         """
-        Returns integer as dataset size.
+        Job of the UDLF binary for a method, its config, output and log live in
+        udlf_jobs_dir, under the method name.
         """
-        with open(self.ranked_list_path, "w") as f:
-            sorted_query_ids = sorted(self.results.keys(), key=lambda x: str(x))
-            for i, query_id in enumerate(sorted_query_ids):
-                retrieved_documents = self.results[query_id]
+        method = current_labels().get("method") or config.method
+        udlf_config = self.udlf_input(config, write_input)
+        memory = estimate_memory(len(self.results), config.depth() or self.results.width)
+        return UDLFJob(method, udlf_config, os.path.join(self.udlf_jobs_dir, method), memory)
 
-                docs = self.ensure_query_id_first(
-                    query_id=query_id,
-                    docs=[
-                        doc_id for doc_id, score in
-                        sorted(retrieved_documents.items(), key=lambda x: x[1], reverse=True)
-                    ]
-                )
+    @instrumented("udlf_native")
+    def native_run(self, config: UDLFConfig):
+        """
+        Runs the method in-process, without writing the ranked lists nor calling the UDLF binary.
+        """
+        self.udlf_results = native_rerank(self.results, config)
+        if self.prune_to_qrels:
+            self.udlf_results = self.udlf_results.select(*self.qrels_vocabulary())
 
+    def qrels_vocabulary(self):
+        """
+        Vocabulary of the pruned UDLF output: the queries with qrels first, then every other id.
+        Built once, so the output of every method shares it.
+        """
+        if self.pruned_ids is None:
+            queries = sorted((
+                query_id for query_id in self.dataset.qrels
+                if self.results.index.get(query_id, len(self.results)) < len(self.results)
+            ), key=lambda x: str(x))
+            kept = set(queries)
+            self.pruned_ids = queries + [id for id in self.results.ids if id not in kept]
+            self.pruned_queries = len(queries)
+        return self.pruned_ids, self.pruned_queries
 
-                new_line = " ".join(docs)
-                if i < len(sorted_query_ids) - 1:
-                    f.write(new_line + "\n")
-                else:
-                    f.write(new_line)
+    @instrumented("read_results")
+    def read_results(self):
+        ids, n_queries = self.qrels_vocabulary() if self.prune_to_qrels else (self.results.ids, len(self.results))
 
-            f.close()
+        # the query is the first item of each output line, it is not part of its own results
+        output = RankedLists.from_text(self.output_results_path, ids, n_queries)
+        self.udlf_results = RankedLists.from_positions(ids, exclude_queries(output.indices))
 
-    def ensure_query_id_first(self, query_id: str, docs: List) -> List:
+    @instrumented("write_ranked_lists")
+    def write_udlf_ranked_list_file(self, depth: int = None) -> int:
         """
-        Ensures that the query_id is the first item in the list of docs.
+        Writes the first depth items of each ranked list, the query included. Default writes every item.
+        Returns integer as dataset size.
         """
-        query_id_indexes = [i for i, d in enumerate(docs) if d == query_id]
+        return self.results.truncate(depth).to_text(self.ranked_list_path, query_first=True, depth=depth)
 
-        if len(query_id_indexes) > 1:
-            raise ValueError(f"Query ID {query_id} appears multiple times in the ranked list.")
-        elif len(query_id_indexes) == 0:
-            docs = [query_id] + docs
-        else:
-            query_id_index = query_id_indexes[0]
-            if query_id_index != 0:
-                docs.pop(query_id_index)
-                docs = [query_id] + docs
+    @instrumented("write_lists")
+    def write_udlf_lists_file(self) -> int:
+        print(f"Writing lists file to {self.lists_path}")
+        return write_lines(self.lists_path, self.results.query_ids)
 
-        return docs
+    @instrumented("save_results")
+    def save_results(self, path: str = None):
+        """
+        Saves the retrieval results in the binary ranked list format.
+        """
+        self.results.save(path or self.ranked_lists_dir)
+
+    @instrumented("load_results")
+    def load_results(self, path: str = None):
+        """
+        Loads retrieval results saved by save_results, memory-mapped.
+        """
+        self.results = RankedLists.load(path or self.ranked_lists_dir)
 
-    def write_udlf_lists_file(self):
-        print(f"Writing lists file to {self.lists_path}")
-        with open(self.lists_path, "w") as f:
-            queries = self.results.keys()
-            f.write("\n".join(sorted(queries, key=lambda x: str(x))))
-            f.close()
-            
-        return sum(1 for _ in open(self.lists_path))
-            
     def evaluate_udlf(self):
         self.evaluate(self.udlf_results)
 
-    def retrieve(self):
-        self.results = self.retriever.retrieve(
+    @property
+    def params(self) -> dict:
+        """
+        Identity and parameters of the retrieval model, part of the cache key.
+        """
+        return {"name": self.name}
+
+    def load_model(self):
+        """
+        Builds the BEIR search model, only called when the retrieval is not cached.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} has no search model")
+
+    @instrumented("search")
+    def search(self) -> RankedLists:
+        """
+        Runs the BEIR retrieval of every query and corpus doc against the corpus.
+        """
+        if self.retriever.retriever is None:
+            self.model = self.load_model()
+            self.retriever.retriever = self.model
+
+        return RankedLists.from_beir(self.retriever.retrieve(
             queries=self.dataset.queries_of_queries_and_docs(),
             corpus=self.dataset.corpus_of_corpus_and_queries()
-        )
+        ))
 
-    def evaluate(self, external_results = None):
-        self.ndcg, self._map, self.recall, self.precision = self.retriever.evaluate(
-            self.dataset.qrels,
-            self.results if external_results is None else external_results,
-            self.retriever.k_values
-            #ignore_identical_ids=False
+    def cache_key(self) -> str:
+        return UDLF.cache.key(
+            dataset_name=self.dataset.dataset_name,
+            query_ids=list(self.dataset.queries) + list(self.dataset.corpus),
+            corpus_ids=self.dataset.corpus.keys(),
+            model_params=self.params,
+            top_k=self.retriever.top_k
         )
+
+    def cache_results(self, key: str):
+        UDLF.cache.put(key, self.results, meta={
+            "dataset": self.dataset.dataset_name,
+            "model": self.name,
+            "top_k": self.retriever.top_k
+        })
+
+    @instrumented("retrieve")
+    def retrieve(self):
+        self.evaluators, self.pruned_ids, self.pruned_queries = {}, None, None
+        key = None
+        if UDLF.cache is not None:
+            key = self.cache_key()
+            self.results = UDLF.cache.get(key)
+            if self.results is not None:
+                print(f"Loaded {self.name} results for {self.dataset.dataset_name} from cache")
+                return
+
+        self.results = self.search()
+
+        if key is not None:
+            self.cache_results(key)
+
+    def search_subset(self, query_ids: List[str], doc_ids: List[str] = None) -> RankedLists:
+        """
+        Retrieves for the given queries, or corpus docs used as queries, against the given
+        corpus docs, by default the whole corpus. Needed by update.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} has no incremental retrieval")
+
+    def search_texts(self, texts: List[str], top_k: int = None) -> List[List[Tuple[str, float]]]:
+        """
+        Retrieves for texts outside the dataset against the corpus, returns the
+        (doc_id, score) hits of each text, best first. Default depth is the retrieval one.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} cannot search texts")
+
+    @instrumented("update")
+    def update(self, added: List[str] = (), removed: List[str] = ()) -> np.ndarray:
+        """
+        Brings the results up to date with docs added to or removed from the dataset
+        corpus, which must already hold the change, without retrieving for every query.
+
+        Only the new docs are retrieved for. Every other list is scored against the new
+        docs alone, and a new doc enters the lists it now ranks in. The lists that held a
+        removed doc are retrieved again, so they keep their width. Scores of the other
+        items are kept, so a model whose scores depend on the corpus, such as BM25 through
+        its IDF, drifts slightly from a full retrieval until the next one.
+
+        Parameters:
+            added (List[str]): Ids of the docs added to the corpus.
+            removed (List[str]): Ids of the docs removed from the corpus.
+
+        Returns:
+            Positions in the new results of the lists that changed, see udlf_update.
+        """
+        old = self.results
+        removed = set(removed)
+        added = [id for id in added if id not in old.index or old.index[id] >= len(old)]
+        self.evaluators, self.pruned_ids, self.pruned_queries = {}, None, None
+
+        query_ids = sorted([id for id in old.query_ids if id not in removed] + added, key=lambda x: str(x))
+        known = set(query_ids)
+        ids = query_ids + sorted((
+            id for id in old.ids[len(old):] if id not in removed and id not in known
+        ), key=lambda x: str(x))
+        results = old.reencode(ids, len(query_ids))
+
+        # lists that lost an item to a removed doc
+        removed_positions = np.array([old.index[id] for id in removed if id in old.index], dtype=np.int32)
+        lost = np.isin(np.asarray(old.indices), removed_positions).any(axis=1)
+        lost_ids = [old.ids[i] for i in np.flatnonzero(lost) if old.ids[i] not in removed]
+
+        changed = [np.fromiter((results.index[id] for id in added + lost_ids), dtype=np.int64)]
+        if added or lost_ids:
+            results = results.replace(self.search_subset(added + lost_ids))
+        if added:
+            new_set = set(added)
+            results, merged = results.merge(self.search_subset(
+                [id for id in query_ids if id not in new_set], added
+            ))
+            changed.append(merged)
+
+        self.results = results
+        self.changed_rows = np.unique(np.concatenate(changed))
+
+        # items of the old changed and removed lists lose a list holding them
+        old_rows = [old.index[id] for id in removed if old.index.get(id, len(old)) < len(old)] + [
+            old.index[results.ids[i]] for i in self.changed_rows if old.index.get(results.ids[i], len(old)) < len(old)
+        ]
+        held = np.unique(np.asarray(old.indices[np.array(old_rows, dtype=np.int64)]))
+        self.former_neighbours = np.fromiter((
+            results.index[old.ids[i]] for i in held[held >= 0]
+            if results.index.get(old.ids[i], len(results)) < len(results)
+        ), dtype=np.int64)
+        print(f"Updated {self.name} results with {len(added)} added and {len(removed)} removed docs, "
+              f"{len(self.changed_rows)} of {len(results)} lists changed")
+
+        if UDLF.cache is not None:
+            self.cache_results(self.cache_key())
+        return self.changed_rows
+
+    @instrumented("udlf_update")
+    def udlf_update(self, config: UDLFConfig, previous: RankedLists = None, rows: np.ndarray = None):
+        """
+        Re-ranks only the queries whose output the lists changed by update can move, the
+        ones within config.reach() hops of them, reading the lists within as many hops of
+        those. The output of every other query is kept from the previous run, so the result
+        is the one of a full native run. When the lists read are half of them or more, or
+        the method has no bounded reach, every query is re-ranked. The binary backend
+        re-ranks every query.
+
+        Parameters:
+            config (UDLFConfig): Method and its parameters.
+            previous (RankedLists): UDLF output before the update. Default is self.udlf_results.
+            rows (np.ndarray): Positions of the changed lists, with the ones they held before the change.
+                Default is the ones of the last update.
+        """
+        previous = self.udlf_results if previous is None else previous
+        if rows is None:
+            rows = np.union1d(self.changed_rows, self.former_neighbours)
+        if config.backend != "native" or previous is None:
+            self.udlf_run(config)
+            return
+
+        ranks = native_ranks(self.results, config)
+        n = len(ranks)
+        hops = config.reach()
+        if hops is not None:
+            graph = native.neighbour_graph(ranks)
+            changed = np.zeros(n, dtype=bool)
+            changed[rows] = True
+            affected = native.neighbourhood(graph, changed, hops)
+            context = native.neighbourhood(graph, affected, hops)
+            # the lists of the context are read whole, their items are ranked lists of the re-run too
+            read = context.copy()
+            read[ranks[context][ranks[context] >= 0]] = True
+
+        if hops is None or 2 * read.sum() >= n:
+            self.native_run(config)
+            print(f"Re-ranked {n} of {n} queries with {config.method}")
+            return
+
+        # the rows read keep their order, the method sees the same lists over fewer queries
+        read_rows = np.flatnonzero(read)
+        positions = np.full(n, -1, dtype=np.int64)
+        positions[read_rows] = np.arange(len(read_rows))
+        sub_ranks = compact(np.where(ranks[read_rows] >= 0, positions[ranks[read_rows]], -1))
+        reranked = exclude_queries(config.run_native(sub_ranks))
+
+        output = np.full((n, reranked.shape[1]), -1, dtype=np.int64)
+        output[read_rows] = np.where(reranked >= 0, read_rows[reranked], -1)
+        affected_ids = [self.results.ids[i] for i in np.flatnonzero(affected)]
+        others = [self.results.ids[i] for i in np.flatnonzero(~affected)] + self.results.ids[n:]
+        reranked = RankedLists.from_positions(self.results.ids, output).select(affected_ids + others, len(affected_ids))
+
+        ids, n_queries = self.qrels_vocabulary() if self.prune_to_qrels else (self.results.ids, n)
+        self.udlf_results = previous.reencode(ids, n_queries).replace(reranked)
+        print(f"Re-ranked {len(affected_ids)} of {n} queries with {config.method}, "
+              f"reading {len(read_rows)} ranked lists")
+
+    @instrumented("evaluate")
+    def evaluate(self, external_results = None, engine: str = "numpy"):
+        """
+        Evaluates the results, or the given ones, against the dataset qrels.
+
+        Parameters:
+            external_results (RankedLists): Results to evaluate instead of the retrieval ones.
+            engine (str): "numpy" uses the vectorized Evaluator, "pytrec" the BEIR pytrec_eval evaluation.
+        """
+        results = self.results if external_results is None else external_results
+
+        if engine == "pytrec":
+            # only the queries with qrels are scored, decode just those
+            self.ndcg, self._map, self.recall, self.precision = self.retriever.evaluate(
+                self.dataset.qrels,
+                results.to_beir(self.dataset.qrels.keys()),
+                self.retriever.k_values
+                #ignore_identical_ids=False
+            )
+            return
+
+        # the qrels are encoded once per vocabulary, shared by the results of every method
+        if id(results.ids) not in self.evaluators:
+            self.evaluators[id(results.ids)] = Evaluator(self.dataset.qrels, results.ids, self.retriever.k_values)
+        self.ndcg, self._map, self.recall, self.precision = self.evaluators[id(results.ids)].evaluate(results)